@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""Benchmark canonical Fuel pipelines on synthetic data.
+
+Each benchmark generates a reproducible synthetic dataset in a temporary
+directory, iterates over a pipeline built on top of it and reports the
+throughput in examples and megabytes per second, as well as the peak
+resident set size. Every benchmark runs in a fresh interpreter, so that
+the peak is its own; the peak of the processes it starts (e.g. the data
+server) is reported separately.
+
+Results can be saved as JSON and compared against a stored baseline::
+
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+
+The script exits with a non-zero status if any benchmark is slower than
+its baseline by more than the given tolerance.
+
+"""
+from __future__ import division, print_function
+
+import argparse
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from multiprocessing import Process
+
+import h5py
+import numpy
+from PIL import Image
+from six.moves import range
+
+from fuel.datasets import H5PYDataset, TextFile
+from fuel.schemes import ConstantScheme, SequentialScheme, ShuffledScheme
+from fuel.server import start_server
+from fuel.streams import DataStream, ServerDataStream
+from fuel.transformers import Batch, Cast, Padding, ScaleAndShift
+from fuel.transformers.defaults import ToBytes
+from fuel.transformers.image import ImagesFromBytes, RandomFixedSizeCrop
+
+SEED = 1234
+
+
+def make_mnist_like(path, num_examples):
+    """Write an HDF5 file shaped like MNIST."""
+    rng = numpy.random.RandomState(SEED)
+    with h5py.File(path, mode='w') as h5file:
+        features = h5file.create_dataset(
+            'features', (num_examples, 1, 28, 28), dtype='uint8')
+        features[...] = rng.randint(256, size=features.shape)
+        targets = h5file.create_dataset(
+            'targets', (num_examples, 1), dtype='uint8')
+        targets[...] = rng.randint(10, size=targets.shape)
+        split_dict = {'train': {'features': (0, num_examples),
+                                'targets': (0, num_examples)}}
+        h5file.attrs['split'] = H5PYDataset.create_split_array(split_dict)
+
+
+def make_jpeg_like(path, num_examples, min_size=48, max_size=96):
+    """Write an HDF5 file of variable-size JPEG images, like ILSVRC."""
+    rng = numpy.random.RandomState(SEED)
+    with h5py.File(path, mode='w') as h5file:
+        dtype = h5py.special_dtype(vlen=numpy.dtype('uint8'))
+        images = h5file.create_dataset(
+            'encoded_images', (num_examples,), dtype=dtype)
+        images.dims[0].label = 'batch'
+        shapes = h5file.create_dataset(
+            'encoded_images_shapes', (num_examples, 1), dtype='int32')
+        for i in range(num_examples):
+            height, width = rng.randint(min_size, max_size + 1, size=2)
+            pixels = rng.randint(256, size=(height, width, 3))
+            buffer_ = io.BytesIO()
+            Image.fromarray(pixels.astype('uint8')).save(buffer_, 'JPEG')
+            images[i] = numpy.frombuffer(buffer_.getvalue(), dtype='uint8')
+            shapes[i] = len(buffer_.getvalue())
+        images.dims.create_scale(shapes, 'shapes')
+        images.dims[0].attach_scale(shapes)
+        shape_labels = h5file.create_dataset(
+            'encoded_images_shape_labels', data=numpy.array([b'bytes']))
+        images.dims.create_scale(shape_labels, 'shape_labels')
+        images.dims[0].attach_scale(shape_labels)
+        targets = h5file.create_dataset(
+            'targets', (num_examples, 1), dtype='int16')
+        targets[...] = rng.randint(1000, size=targets.shape)
+        split_dict = {'train': {'encoded_images': (0, num_examples),
+                                'targets': (0, num_examples)}}
+        h5file.attrs['split'] = H5PYDataset.create_split_array(split_dict)
+
+
+def make_text_corpus(path, num_sentences, vocabulary_size=10000,
+                     mean_length=25):
+    """Write a text file of sentences with Zipf-distributed words.
+
+    Returns the dictionary mapping the words to integers.
+
+    """
+    rng = numpy.random.RandomState(SEED)
+    with open(path, 'w') as text_file:
+        for _ in range(num_sentences):
+            length = max(rng.poisson(mean_length), 1)
+            words = numpy.minimum(rng.zipf(1.3, size=length),
+                                  vocabulary_size) - 1
+            text_file.write(' '.join('w{}'.format(w) for w in words) + '\n')
+    dictionary = dict(('w{}'.format(i), i) for i in range(vocabulary_size))
+    for token in ('<S>', '</S>', '<UNK>'):
+        dictionary[token] = len(dictionary)
+    return dictionary
+
+
+def mnist_pipeline(directory, num_examples):
+    path = os.path.join(directory, 'mnist.hdf5')
+    make_mnist_like(path, num_examples)
+    dataset = H5PYDataset(path, which_sets=('train',), load_in_memory=True)
+    stream = DataStream(
+        dataset, iteration_scheme=ShuffledScheme(
+            dataset.num_examples, 128, rng=numpy.random.RandomState(SEED)))
+    stream = ScaleAndShift(stream, 1 / 255., 0, which_sources=('features',))
+    return Cast(stream, 'float32', which_sources=('features',))
+
+
+def jpeg_pipeline(directory, num_examples):
+    # Decoding dominates, so a tenth of the examples is plenty
+    path = os.path.join(directory, 'jpeg.hdf5')
+    make_jpeg_like(path, num_examples // 10)
+    dataset = H5PYDataset(path, which_sets=('train',))
+    stream = DataStream(
+        dataset, iteration_scheme=SequentialScheme(dataset.num_examples, 64))
+    stream = ToBytes(stream, which_sources=('encoded_images',))
+    stream = ImagesFromBytes(stream, which_sources=('encoded_images',))
+    return RandomFixedSizeCrop(stream, (32, 32),
+                               which_sources=('encoded_images',))
+
+
+def nmt_pipeline(directory, num_examples):
+    path = os.path.join(directory, 'corpus.txt')
+    dictionary = make_text_corpus(path, num_examples)
+    stream = DataStream(TextFile([path], dictionary))
+    return Padding(Batch(stream, ConstantScheme(80)))
+
+
+def server_pipeline(directory, num_examples, port=5590):
+    stream = mnist_pipeline(directory, num_examples)
+    server = Process(target=start_server, args=(stream, port))
+    server.daemon = True
+    server.start()
+    client = ServerDataStream(stream.sources, False, port=port)
+    client.server = server
+    return client
+
+
+BENCHMARKS = OrderedDict([
+    ('mnist', mnist_pipeline),
+    ('jpeg', jpeg_pipeline),
+    ('nmt', nmt_pipeline),
+    ('server', server_pipeline),
+])
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB.
+
+    For ``RUSAGE_CHILDREN`` this is the peak of the largest child process
+    that has been waited for, not the sum over all children.
+
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def run(name, num_examples, epochs):
+    directory = tempfile.mkdtemp()
+    try:
+        stream = BENCHMARKS[name](directory, num_examples)
+        examples = nbytes = 0
+        start = time.time()
+        for _ in range(epochs):
+            for batch in stream.get_epoch_iterator():
+                examples += len(batch[0])
+                nbytes += sum(numpy.asarray(source).nbytes
+                              for source in batch)
+        elapsed = time.time() - start
+        if hasattr(stream, 'server'):
+            stream.server.terminate()
+            stream.server.join()
+        else:
+            stream.close()
+    finally:
+        shutil.rmtree(directory)
+    return OrderedDict([
+        ('examples_per_second', examples / elapsed),
+        ('mb_per_second', nbytes / elapsed / 1e6),
+        ('seconds', elapsed),
+        ('peak_rss_mb', peak_rss()),
+        ('children_peak_rss_mb', peak_rss(resource.RUSAGE_CHILDREN)),
+    ])
+
+
+def run_isolated(name, num_examples, epochs):
+    """Run a benchmark in a new interpreter and return its results."""
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), name, '--child',
+        '--num-examples', str(num_examples), '--epochs', str(epochs)])
+    return json.loads(output.decode('utf-8').splitlines()[-1],
+                      object_pairs_hook=OrderedDict)
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput relative to a baseline; return the regressions."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = (result['examples_per_second'] /
+                 baseline[name]['examples_per_second'])
+        print('{:<10} {:>8.2f}x baseline'.format(name, ratio))
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help='benchmarks to run, out of {} (default: all)'
+                        .format(', '.join(BENCHMARKS)))
+    parser.add_argument('--num-examples', type=int, default=20000,
+                        help='size of the synthetic datasets')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline',
+                        help='compare the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative slowdown (default: 0.1)')
+    # Runs a single benchmark in this process and prints the result as JSON
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+    if args.child:
+        name, = args.benchmarks
+        print(json.dumps(run(name, args.num_examples, args.epochs)))
+        return 0
+
+    results = OrderedDict()
+    print('{:<10} {:>12} {:>10} {:>10} {:>10} {:>14}'.format(
+        'benchmark', 'examples/s', 'MB/s', 'seconds', 'RSS (MB)',
+        'child RSS (MB)'))
+    for name in args.benchmarks or BENCHMARKS:
+        results[name] = result = run_isolated(name, args.num_examples,
+                                              args.epochs)
+        print('{:<10} {:>12.1f} {:>10.1f} {:>10.2f} {:>10.1f} {:>14.1f}'
+              .format(name, *result.values()))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('regressions: {}'.format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -103,6 +103,73 @@ def fill_hdf5_file(h5file, data):
     h5file.attrs['split'] = H5PYDataset.create_split_array(split_dict)
 
 
+def create_flat_vlen_source(h5file, name, examples, shape_labels,
+                            data_name=None):
+    """Store a variable-length source as one flat, concatenated dataset.
+
+    Reading variable-length data types through h5py is slow. Instead,
+    this stores the flattened examples one after the other in a single
+    one-dimensional dataset, and creates a source containing the offset
+    of each example in it. :class:`.H5PYDataset` reads batches of these
+    sources with a single read when possible.
+
+    Parameters
+    ----------
+    h5file : :class:`h5py.File`
+        File handle for an HDF5 file.
+    name : str
+        The name of the source.
+    examples : list of :class:`numpy.ndarray`
+        The examples, which must all have the same data type and number
+        of dimensions.
+    shape_labels : tuple of str
+        The labels of the axes of the examples.
+    data_name : str, optional
+        The name of the dataset containing the flat data. Defaults to
+        the name of the source followed by ``_data``.
+
+    Returns
+    -------
+    :class:`h5py.Dataset`
+        The source, whose first axis is labelled 'batch'. It still needs
+        to be added to the split array.
+
+    """
+    examples = [numpy.asarray(example) for example in examples]
+    if not examples:
+        raise ValueError('no examples given')
+    dtype = examples[0].dtype
+    if not all(example.dtype == dtype for example in examples):
+        raise ValueError("source '{}' has examples that ".format(name) +
+                         "vary in dtype")
+    if not all(example.ndim == len(shape_labels) for example in examples):
+        raise ValueError("the examples of source '{}' must ".format(name) +
+                         "have one dimension per shape label")
+    lengths = numpy.array([example.size for example in examples],
+                          dtype='uint64')
+    offsets = numpy.cumsum(lengths) - lengths
+
+    flat = h5file.create_dataset(
+        data_name or '{}_data'.format(name),
+        data=numpy.concatenate([example.ravel() for example in examples]))
+    source = h5file.create_dataset(name, data=offsets)
+    source.attrs['flat_data'] = flat.ref
+    source.dims[0].label = 'batch'
+
+    shapes = h5file.create_dataset(
+        '{}_shapes'.format(name),
+        data=numpy.array([example.shape for example in examples],
+                         dtype='int64').reshape((len(examples), -1)))
+    source.dims.create_scale(shapes, 'shapes')
+    source.dims[0].attach_scale(shapes)
+    labels = h5file.create_dataset(
+        '{}_shape_labels'.format(name),
+        data=numpy.array([label.encode('utf8') for label in shape_labels]))
+    source.dims.create_scale(labels, 'shape_labels')
+    source.dims[0].attach_scale(labels)
+    return source
+
+
 @contextmanager
 def progress_bar(name, maxval, prefix='Converting'):
     """Manages a progress bar for a conversion.
@@ -13,6 +13,6 @@ from fuel.datasets.dogs_vs_cats import DogsVsCats
 from fuel.datasets.iris import Iris
 from fuel.datasets.mnist import MNIST
 from fuel.datasets.svhn import SVHN
-from fuel.datasets.text import TextFile
+from fuel.datasets.text import TextFile, TokenizedTextFile
 from fuel.datasets.billion import OneBillionWord
 from fuel.datasets.image import ImagesFromFile
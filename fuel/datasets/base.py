@@ -165,6 +165,31 @@ class Dataset(object):
         """
         return self.reset(state)
 
+    def lookahead(self, state, request_iterator):
+        """Give the dataset access to the requests of an epoch in advance.
+
+        Datasets that can read data in the background (e.g. while the
+        previous batch is being processed) can override this method to
+        return an iterator that passes on the requests of
+        `request_iterator`, while scheduling reads for the requests that
+        follow. The default implementation returns `request_iterator`
+        unchanged.
+
+        Parameters
+        ----------
+        state : object
+            The current state.
+        request_iterator : iterator
+            The iterator over the requests of the epoch.
+
+        Returns
+        -------
+        iterator
+            An iterator over the same requests.
+
+        """
+        return request_iterator
+
     def close(self, state):
         """Cleanly close the dataset e.g. close file handles.
 
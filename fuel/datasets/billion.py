@@ -36,7 +36,10 @@ class OneBillionWord(TextFile):
         an input and returns a modified string. A useful function to pass
         could be ``str.lower``.
 
-    See :class:`TextFile` for remaining keyword arguments.
+    See :class:`TextFile` for remaining keyword arguments. In particular,
+    pass ``random_access=True`` to shuffle the sentences of the selected
+    partitions with e.g. a :class:`~fuel.schemes.ShuffledScheme`, or pass
+    `num_workers` to read the partitions in parallel processes.
 
     """
     def __init__(self, which_set, which_partitions, dictionary, **kwargs):
@@ -1,11 +1,13 @@
 import numbers
 from itertools import product
-from collections import defaultdict
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
 
 import h5py
 import numpy
 import six
 import tables
+from picklable_itertools import chain, iter_
 from six.moves import zip, range
 
 from fuel.datasets import Dataset
@@ -89,8 +91,138 @@ class PytablesDataset(Dataset):
         return data
 
 
+class _Prefetcher(six.Iterator):
+    """Reads the data for upcoming requests on a background thread.
+
+    This is the state of an :class:`H5PYDataset` that prefetches data.
+    When used as a request iterator, it passes on the requests of the
+    wrapped iterator while keeping reads for the next `num_requests`
+    requests in flight.
+
+    Parameters
+    ----------
+    dataset : :class:`H5PYDataset`
+        The dataset to read the data from.
+    num_requests : int
+        The number of requests to read ahead.
+
+    Notes
+    -----
+    A single thread is used, because the HDF5 library serializes all
+    calls anyway; h5py releases the GIL while reading, so the reads
+    overlap with the work done by the main thread.
+
+    """
+    def __init__(self, dataset, num_requests):
+        self.dataset = dataset
+        self.num_requests = num_requests
+        self.pool = None
+        self.request_iterator = None
+        self.pending = deque()
+        self.current = None
+
+    def wrap(self, request_iterator):
+        self.request_iterator = request_iterator
+        self.pending.clear()
+        self.current = None
+        return self
+
+    def __iter__(self):
+        return self
+
+    def _fill(self):
+        if self.pool is None:
+            self.pool = ThreadPool(1)
+        while (self.request_iterator is not None and
+               len(self.pending) < self.num_requests):
+            try:
+                request = next(self.request_iterator)
+            except StopIteration:
+                self.request_iterator = None
+                break
+            self.pending.append((request, self.pool.apply_async(
+                self.dataset._out_of_memory_get_data, (None, request))))
+
+    def __next__(self):
+        self._fill()
+        if not self.pending:
+            raise StopIteration
+        self.current = self.pending.popleft()
+        self._fill()
+        return self.current[0]
+
+    def get_data(self, request):
+        """Return the prefetched data if `request` was prefetched."""
+        if self.current is not None and self.current[0] is request:
+            result = self.current[1]
+            self.current = None
+            return result.get()
+        return self.dataset._out_of_memory_get_data(None, request)
+
+    def close(self):
+        self.wrap(None)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def __getstate__(self):
+        # The reads in flight can't be pickled, so their requests are put
+        # back in front of the remaining ones and read again on unpickling
+        remaining = [request for request, _ in self.pending]
+        if self.request_iterator is not None:
+            request_iterator = chain(remaining, self.request_iterator)
+        elif remaining:
+            request_iterator = iter_(remaining)
+        else:
+            request_iterator = None
+        state = self.__dict__.copy()
+        state.update(pool=None, request_iterator=request_iterator,
+                     pending=deque(), current=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.request_iterator is not None:
+            self._fill()
+
+
+def _split_flat(data, starts, shapes):
+    """Cut variable-length examples out of a flat array.
+
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray`
+        One-dimensional array containing the flattened examples.
+    starts : :class:`numpy.ndarray`
+        The position in `data` at which each example starts.
+    shapes : :class:`numpy.ndarray`
+        The shape of each example, one row per example.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        An object array of examples. If the examples aren't stored one
+        after the other in `data`, they are first gathered into a new
+        array, so that the examples are always views of a single
+        contiguous array.
+
+    """
+    lengths = numpy.prod(shapes, axis=1, dtype='int64')
+    ends = numpy.cumsum(lengths)
+    if len(starts) and not numpy.array_equal(starts, ends - lengths):
+        indices = (numpy.arange(ends[-1]) +
+                   numpy.repeat(starts - (ends - lengths), lengths))
+        data = data[indices]
+    examples = numpy.empty(len(starts), dtype=object)
+    for i, (start, end, shape) in enumerate(zip(ends - lengths, ends,
+                                                shapes)):
+        examples[i] = data[start:end].reshape(shape)
+    return examples
+
+
 @do_not_pickle_attributes('data_sources', 'external_file_handle',
-                          'source_shapes', 'in_memory_subset', 'subsets')
+                          'source_shapes', 'in_memory_subset', 'subsets',
+                          'memory_maps', 'flat_data')
 class H5PYDataset(Dataset):
     """An h5py-fueled HDF5 dataset.
 
@@ -116,6 +248,15 @@ class H5PYDataset(Dataset):
          for this source
       7. ``comment`` : comment string
 
+    Variable-length sources are one-dimensional, and have a ``shapes``
+    dimension scale giving the shape of each example and a
+    ``shape_labels`` dimension scale giving the labels of its axes. Their
+    examples are either stored in a variable-length data type, or
+    flattened and concatenated in a separate one-dimensional dataset. In
+    the latter case the source contains the offset of each example in the
+    flat dataset, which is referenced by the source's ``flat_data``
+    attribute. See :func:`~fuel.converters.base.create_flat_vlen_source`.
+
     Parameters
     ----------
     file_or_path : :class:`h5py.File` or str
@@ -144,6 +285,21 @@ class H5PYDataset(Dataset):
         performance, set this flag to `False`. Note that in that case,
         it is the user's responsibility to make sure that indices are
         ordered.
+    prefetch : int, optional
+        If given, read the data for this many upcoming requests on a
+        background thread while the current batch is being processed.
+        This requires the requests to come from the iteration scheme of a
+        :class:`.DataStream` wrapping this dataset; other requests are
+        read synchronously. Only supported if `load_in_memory` is
+        `False`. Defaults to `None`, i.e. no prefetching.
+    memory_map : bool, optional
+        If `True`, sources that are stored contiguously and uncompressed
+        in a file opened with the default driver are read through a
+        read-only :class:`numpy.memmap` instead of through h5py. Slice
+        requests then return views of the file without copying it, and
+        the operating system's page cache is shared between all
+        processes reading the file. Other sources are read as usual.
+        Only used if `load_in_memory` is `False`. Defaults to `False`.
 
     Attributes
     ----------
@@ -157,6 +313,9 @@ class H5PYDataset(Dataset):
         examples.
     vlen_sources : tuple of strings
         All sources provided by this dataset which have variable length.
+    flat_vlen_sources : tuple of strings
+        The variable-length sources whose examples are stored in a flat
+        dataset.
     default_axis_labels : dict mapping string to tuple of strings
         Maps all sources provided by this dataset to their axis labels.
 
@@ -167,7 +326,7 @@ class H5PYDataset(Dataset):
 
     def __init__(self, file_or_path, which_sets, subset=None,
                  load_in_memory=False, driver=None, sort_indices=True,
-                 **kwargs):
+                 prefetch=None, memory_map=False, **kwargs):
         if isinstance(file_or_path, h5py.File):
             self.path = file_or_path.filename
             self.external_file_handle = file_or_path
@@ -184,6 +343,14 @@ class H5PYDataset(Dataset):
         self.load_in_memory = load_in_memory
         self.driver = driver
         self.sort_indices = sort_indices
+        if prefetch is not None:
+            if load_in_memory:
+                raise ValueError('prefetching is only supported when the '
+                                 'data is not loaded in memory')
+            if prefetch < 1:
+                raise ValueError('prefetch must be a positive integer')
+        self.prefetch = prefetch
+        self.memory_map = memory_map
 
         self._parse_dataset_info()
 
@@ -226,6 +393,7 @@ class H5PYDataset(Dataset):
                 provides_sources = split_provides_sources
         self.provides_sources = tuple(sorted(provides_sources))
         self.vlen_sources = self.get_vlen_sources(handle)
+        self.flat_vlen_sources = self.get_flat_vlen_sources(handle)
         self.default_axis_labels = self.get_axis_labels(handle)
         self._out_of_memory_close()
 
@@ -384,6 +552,26 @@ class H5PYDataset(Dataset):
                 vlen_sources.append(source_name)
         return vlen_sources
 
+    @staticmethod
+    def get_flat_vlen_sources(h5file):
+        """Returns the names of variable-length sources stored flat.
+
+        Parameters
+        ----------
+        h5file : HDF5 file handle
+            An HDF5 dataset respecting the H5PYDataset interface.
+
+        Returns
+        -------
+        flat_vlen_sources : tuple of str
+            Names of the variable-length sources in ``h5file`` whose
+            examples are stored in a flat dataset.
+
+        """
+        return tuple(source_name for source_name
+                     in H5PYDataset.get_vlen_sources(h5file)
+                     if 'flat_data' in h5file[source_name].attrs)
+
     @staticmethod
     def get_axis_labels(h5file):
         """Returns axis labels for all sources in an HDF5 dataset.
@@ -476,10 +664,25 @@ class H5PYDataset(Dataset):
         if self.load_in_memory:
             data_sources = []
             source_shapes = []
+            flat_data = []
             for source_name, subset in zip(self.sources, self.subsets):
                 data_sources.append(
                     subset.index_within_subset(
                         handle[source_name], slice(None)))
+                if source_name in self.flat_vlen_sources:
+                    # Only load the part of the flat data that is used
+                    offsets = data_sources[-1].astype('int64')
+                    shapes = subset.index_within_subset(
+                        handle[source_name].dims[0]['shapes'], slice(None))
+                    ends = offsets + numpy.prod(shapes, axis=1,
+                                                dtype='int64')
+                    start = offsets.min() if len(offsets) else 0
+                    stop = ends.max() if len(offsets) else 0
+                    flat = handle[handle[source_name].attrs['flat_data']]
+                    data_sources[-1] = offsets - start
+                    flat_data.append(flat[start:stop])
+                else:
+                    flat_data.append(None)
                 if source_name in self.vlen_sources:
                     shapes = subset.index_within_subset(
                         handle[source_name].dims[0]['shapes'],
@@ -489,22 +692,90 @@ class H5PYDataset(Dataset):
                 source_shapes.append(shapes)
             self.data_sources = tuple(data_sources)
             self.source_shapes = tuple(source_shapes)
+            self.flat_data = tuple(flat_data)
             # This exists only for request sanity checking purposes.
             self.in_memory_subset = Subset(
                 slice(None), len(self.data_sources[0]))
         else:
             self.data_sources = None
             self.source_shapes = None
+            self.flat_data = None
             self.in_memory_subset = None
 
+        if self.memory_map and not self.load_in_memory:
+            self.memory_maps = tuple(
+                self._memory_map(handle, source_name)
+                for source_name in self.sources)
+        else:
+            self.memory_maps = None
+
         self._out_of_memory_close()
 
+    def _memory_map(self, handle, source_name):
+        """Map a source into memory, if its layout allows it.
+
+        Returns `None` unless the source's data is stored in a single
+        contiguous block of a regular file.
+
+        """
+        dataset = handle[source_name]
+        plist = dataset.id.get_create_plist()
+        if (source_name in self.vlen_sources or handle.driver != 'sec2' or
+                dataset.dtype.hasobject or not dataset.size or
+                plist.get_layout() != h5py.h5d.CONTIGUOUS or
+                plist.get_external_count()):
+            return None
+        offset = dataset.id.get_offset()
+        if offset is None:
+            return None
+        return numpy.memmap(handle.filename, dtype=dataset.dtype, mode='r',
+                            offset=offset,
+                            shape=dataset.shape).view(numpy.ndarray)
+
     @property
     def num_examples(self):
         return self.subsets[0].num_examples
 
+    @property
+    def examples_per_chunk(self):
+        """The number of consecutive examples stored in the same chunk.
+
+        This is the largest chunk length along the first axis of the
+        requested sources, or `None` if none of them is chunked. Pass it
+        as the `block_size` of a :class:`.BlockShuffledScheme`, and the
+        start of the split as its `offset`, to read each chunk once per
+        epoch while still shuffling the examples.
+
+        """
+        self._out_of_memory_open()
+        try:
+            handle = self._file_handle
+            lengths = [handle[source_name].chunks[0]
+                       for source_name in self.sources
+                       if handle[source_name].chunks is not None]
+        finally:
+            self._out_of_memory_close()
+        return max(lengths) if lengths else None
+
     def open(self):
-        return None if self.load_in_memory else self._out_of_memory_open()
+        if self.load_in_memory:
+            return None
+        self._out_of_memory_open()
+        if self.prefetch:
+            return _Prefetcher(self, self.prefetch)
+        return None
+
+    def reset(self, state):
+        if isinstance(state, _Prefetcher):
+            # Keep the thread pool around instead of starting a new one
+            state.wrap(None)
+            return state
+        return super(H5PYDataset, self).reset(state)
+
+    def lookahead(self, state, request_iterator):
+        if isinstance(state, _Prefetcher):
+            return state.wrap(request_iterator)
+        return request_iterator
 
     def _out_of_memory_open(self):
         if not self.external_file_handle:
@@ -515,6 +786,8 @@ class H5PYDataset(Dataset):
             self._ref_counts[self.path] += 1
 
     def close(self, state):
+        if isinstance(state, _Prefetcher):
+            state.close()
         if not self.load_in_memory:
             self._out_of_memory_close()
 
@@ -538,6 +811,8 @@ class H5PYDataset(Dataset):
     def get_data(self, state=None, request=None):
         if self.load_in_memory:
             data, shapes = self._in_memory_get_data(state, request)
+        elif isinstance(state, _Prefetcher):
+            data, shapes = state.get_data(request)
         else:
             data, shapes = self._out_of_memory_get_data(state, request)
         for i in range(len(data)):
@@ -557,8 +832,49 @@ class H5PYDataset(Dataset):
         shapes = [self.in_memory_subset.index_within_subset(shape, request)
                   if shape is not None else None
                   for shape in self.source_shapes]
+        for i, flat in enumerate(self.flat_data):
+            if flat is not None:
+                data[i] = self._get_flat_examples(flat, data[i], shapes[i])
+                shapes[i] = None
         return data, shapes
 
+    @staticmethod
+    def _get_flat_examples(flat, offsets, shapes, sparse_reads=False):
+        """Get examples from a flat dataset given their offsets.
+
+        Parameters
+        ----------
+        flat : :class:`numpy.ndarray` or :class:`h5py.Dataset`
+            The flat data.
+        offsets : int or :class:`numpy.ndarray`
+            The offset of each example in `flat`.
+        shapes : :class:`numpy.ndarray`
+            The shape of each example.
+        sparse_reads : bool, optional
+            If `True`, read the examples one by one when the data between
+            the first and the last example is more than twice the size of
+            the examples. Otherwise (the default), all of this data is
+            read at once.
+
+        """
+        if numpy.ndim(offsets) == 0:
+            offset = int(offsets)
+            return flat[offset:offset + int(numpy.prod(shapes))].reshape(
+                shapes)
+        offsets = numpy.asarray(offsets, dtype='int64')
+        shapes = numpy.asarray(shapes)
+        if not len(offsets):
+            return numpy.empty(0, dtype=object)
+        ends = offsets + numpy.prod(shapes, axis=1, dtype='int64')
+        start, stop = offsets.min(), ends.max()
+        if sparse_reads and stop - start > 2 * (ends - offsets).sum():
+            examples = numpy.empty(len(offsets), dtype=object)
+            for i, (offset, end, shape) in enumerate(zip(offsets, ends,
+                                                         shapes)):
+                examples[i] = flat[offset:end].reshape(shape)
+            return examples
+        return _split_flat(flat[start:stop], offsets - start, shapes)
+
     def _out_of_memory_get_data(self, state=None, request=None):
         if not isinstance(request, (numbers.Integral, slice, list)):
             raise ValueError()
@@ -573,13 +889,29 @@ class H5PYDataset(Dataset):
         except IOError:
             self._out_of_memory_open()
             handle = self._file_handle
-        for source_name, subset in zip(self.sources, self.subsets):
+        memory_maps = self.memory_maps or [None] * len(self.sources)
+        for source_name, subset, memory_map in zip(self.sources, self.subsets,
+                                                   memory_maps):
             # Process the data request within the context of the data source
             # subset
+            if memory_map is not None:
+                data.append(subset.index_within_subset(memory_map, request))
+                shapes.append(None)
+                continue
             data.append(
                 subset.index_within_subset(
                     handle[source_name], request,
                     sort_indices=self.sort_indices))
+            if source_name in self.flat_vlen_sources:
+                source = handle[source_name]
+                shapes.append(None)
+                data[-1] = self._get_flat_examples(
+                    handle[source.attrs['flat_data']], data[-1],
+                    subset.index_within_subset(
+                        source.dims[0]['shapes'], request,
+                        sort_indices=self.sort_indices),
+                    sparse_reads=True)
+                continue
             # If this source has variable length, get the shapes as well
             if source_name in self.vlen_sources:
                 shapes.append(
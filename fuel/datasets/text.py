@@ -1,9 +1,24 @@
+import locale
+import numbers
+import os
+import tempfile
+import traceback
+from collections import deque
+from itertools import islice
+from multiprocessing import Process, Queue, current_process
+
+import numpy
+import six
+from six.moves.queue import Empty
 from picklable_itertools import iter_, chain
 
 from fuel.datasets import Dataset
+from fuel.schemes import SequentialExampleScheme
+from fuel.utils import do_not_pickle_attributes
 from fuel.utils.formats import open_
 
 
+@do_not_pickle_attributes('line_indices', 'character_table')
 class TextFile(Dataset):
     r"""Reads text files and numberizes them given a dictionary.
 
@@ -39,7 +54,10 @@ class TextFile(Dataset):
         dictionary is expected to contain single letters as keys. A single
         example will be a list of character numbers, starting with the
         first non-whitespace character and finishing with the last one. The
-        default is 'word'.
+        default is 'word'. At the character level, sentences are encoded
+        with a single lookup in a table indexed by character code, unless
+        the dictionary contains characters outside of the Basic
+        Multilingual Plane.
     preprocess : function, optional
         A function which takes a sentence (string) as an input and returns
         a modified string. For example ``str.lower`` in order to lowercase
@@ -48,6 +66,30 @@ class TextFile(Dataset):
         The encoding to use to read the file. Defaults to ``None``. Use
         UTF-8 if the dictionary you pass contains UTF-8 characters, but
         note that this makes the dataset unpicklable on legacy Python.
+    random_access : bool, optional
+        If ``True``, an index of the byte offset of every line is built
+        for each file (see :func:`build_line_index`) and the dataset
+        accepts the sentence indices requested by iteration schemes such
+        as :class:`~fuel.schemes.ShuffledScheme`, reading only the
+        requested lines from disk. Gzipped files are not supported in
+        this mode. Defaults to ``False``, in which case the files are read
+        sequentially.
+    num_workers : int, optional
+        If given, the files are distributed over this many worker
+        processes, which read and numberize them in parallel. The workers
+        are started when the first sentence is requested, and restarted
+        from where they were when the state of an epoch is unpickled.
+        Inside a daemonic process (e.g. one of
+        :class:`~fuel.transformers.MultiProcessing`), which can't start
+        processes of its own, the files are read sequentially instead.
+        This can't be combined with `random_access`. Defaults to ``None``,
+        in which case the files are read in the main process.
+    ordered : bool, optional
+        Only used when `num_workers` is given. If ``True`` (default), the
+        sentences are returned in the same order as when reading the files
+        in the main process. If ``False``, chunks of sentences are returned
+        as soon as any worker has read them; the sentences of each file
+        remain in order.
 
     Examples
     --------
@@ -76,11 +118,22 @@ class TextFile(Dataset):
     ([0, 4, 3, 5],)
     ([0, 6, 7],)
 
+    In random access mode the sentences can be requested in any order.
+
+    >>> from fuel.schemes import SequentialScheme
+    >>> text_data = TextFile(files=['sentences.txt'],
+    ...                      dictionary=full_dictionary, bos_token=None,
+    ...                      eos_token=None, unk_token=None,
+    ...                      preprocess=lower, random_access=True)
+    >>> text_data.get_data(text_data.open(), [1, 0])
+    ([[0, 6, 7], [0, 4, 3, 5]],)
+
     .. doctest::
        :hide:
 
        >>> import os
        >>> os.remove('sentences.txt')
+       >>> os.remove('sentences.txt.index.npy')
 
     """
     provides_sources = ('features',)
@@ -88,7 +141,8 @@ class TextFile(Dataset):
 
     def __init__(self, files, dictionary, bos_token='<S>', eos_token='</S>',
                  unk_token='<UNK>', level='word', preprocess=None,
-                 encoding=None):
+                 encoding=None, random_access=False, num_workers=None,
+                 ordered=True):
         self.files = files
         self.dictionary = dictionary
         if bos_token is not None and bos_token not in dictionary:
@@ -110,12 +164,76 @@ class TextFile(Dataset):
         self.level = level
         self.preprocess = preprocess
         self.encoding = encoding
+        if random_access and any(f.endswith('.gz') for f in files):
+            raise ValueError("gzipped files can't be read in random access "
+                             "mode")
+        self.random_access = random_access
+        if num_workers is not None:
+            if random_access:
+                raise ValueError("num_workers can't be used in random "
+                                 "access mode")
+            if num_workers < 1:
+                raise ValueError("num_workers must be a positive integer")
+        self.num_workers = num_workers
+        self.ordered = ordered
         super(TextFile, self).__init__()
+        if random_access:
+            self.example_iteration_scheme = SequentialExampleScheme(
+                self.num_examples)
+
+    def load(self):
+        if self.random_access:
+            self.line_indices = [build_line_index(f) for f in self.files]
+        else:
+            self.line_indices = None
+        if self.level == 'character':
+            self.character_table = self._build_character_table()
+        else:
+            self.character_table = None
+
+    def _build_character_table(self):
+        """Build a table mapping character codes to their numbers.
+
+        The table covers the first 256 or 65536 character codes, depending
+        on the characters in the dictionary, plus a last entry which is
+        used for all the codes beyond that range. Characters that aren't
+        in the dictionary map to the number of the UNK token, or to -1 if
+        there is none. Returns `None` if the dictionary contains
+        characters with larger codes.
+
+        """
+        characters = dict((ord(token), value)
+                          for token, value in self.dictionary.items()
+                          if isinstance(token, six.string_types) and
+                          len(token) == 1)
+        largest = max(characters) if characters else 0
+        if largest >= 2 ** 16:
+            return None
+        size = 2 ** 8 if largest < 2 ** 8 else 2 ** 16
+        table = numpy.empty(size + 1, dtype=numpy.int64)
+        table.fill(-1 if self.unk_token is None
+                   else self.dictionary[self.unk_token])
+        table[list(characters.keys())] = list(characters.values())
+        return table
+
+    @property
+    def num_examples(self):
+        if not self.random_access:
+            return float('nan')
+        return sum(len(index) - 1 for index in self.line_indices)
 
     def open(self):
+        if self.random_access:
+            return _LineReader(self.files)
+        if self.num_workers is not None:
+            return _ShardedReader(self, self.num_workers, self.ordered)
         return chain(*[iter_(open_(f, encoding=self.encoding))
                        for f in self.files])
 
+    def close(self, state):
+        if self.random_access or self.num_workers is not None:
+            state.close()
+
     def _get_from_dictionary(self, symbol):
         value = self.dictionary.get(symbol)
         if value is not None:
@@ -126,19 +244,498 @@ class TextFile(Dataset):
                                "`unk_token` given".format(symbol))
             return self.dictionary[self.unk_token]
 
+    def _encode_characters(self, sentence):
+        if isinstance(sentence, six.text_type):
+            codes = numpy.frombuffer(sentence.encode('utf-32-le'),
+                                     dtype='<u4')
+        else:
+            codes = numpy.frombuffer(sentence, dtype=numpy.uint8)
+        data = self.character_table.take(codes, mode='clip')
+        if self.unk_token is None and data.size and data.min() < 0:
+            raise KeyError("token '{}' not found in dictionary and no "
+                           "`unk_token` given".format(
+                               sentence[numpy.argmax(data < 0)]))
+        return data
+
     def get_data(self, state=None, request=None):
-        if request is not None:
+        if not self.random_access:
+            if request is not None:
+                raise ValueError
+            if self.num_workers is not None:
+                # The workers numberize the sentences
+                return (next(state),)
+            return (self.numberize(next(state)),)
+        if request is None:
             raise ValueError
-        sentence = next(state)
+        if isinstance(request, numbers.Integral):
+            return (self.numberize(self._read_lines(state, [request])[0]),)
+        if isinstance(request, slice):
+            request = range(*request.indices(self.num_examples))
+        return ([self.numberize(line)
+                 for line in self._read_lines(state, request)],)
+
+    def _read_lines(self, state, request):
+        """Read the requested lines, visiting each file in order.
+
+        Lines are read in increasing order of position in the files, and
+        runs of consecutive lines are read with a single call.
+
+        """
+        request = numpy.asarray(request, dtype=numpy.int64)
+        starts = numpy.cumsum([0] + [len(index) - 1
+                                     for index in self.line_indices])
+        if request.size and (request.min() < 0 or
+                             request.max() >= starts[-1]):
+            raise IndexError("line index out of range")
+        file_indices = numpy.searchsorted(starts, request, side='right') - 1
+        order = numpy.lexsort((request, file_indices))
+        lines = [None] * len(request)
+        i = 0
+        while i < len(order):
+            file_index = file_indices[order[i]]
+            index = self.line_indices[file_index]
+            first = request[order[i]] - starts[file_index]
+            # Extend the run as long as the next line follows this one
+            j = i + 1
+            while (j < len(order) and file_indices[order[j]] == file_index and
+                   request[order[j]] <= request[order[j - 1]] + 1):
+                j += 1
+            last = request[order[j - 1]] - starts[file_index]
+            data = state.read(file_index, index[first],
+                              index[last + 1] - index[first])
+            for k in order[i:j]:
+                line = request[k] - starts[file_index]
+                lines[k] = self._decode(
+                    data[index[line] - index[first]:
+                         index[line + 1] - index[first]])
+            i = j
+        return lines
+
+    def _decode(self, line):
+        if six.PY2 and self.encoding is None:
+            return line
+        return line.decode(self.encoding or
+                           locale.getpreferredencoding(False))
+
+    def numberize(self, sentence):
+        """Turn a sentence into a list of integers.
+
+        Parameters
+        ----------
+        sentence : str
+            A single line of text, as read from one of the files.
+
+        Returns
+        -------
+        list of int
+            The numbers of the sentence's tokens, with the BOS and EOS
+            tokens added if given.
+
+        """
         if self.preprocess is not None:
             sentence = self.preprocess(sentence)
         data = [self.dictionary[self.bos_token]] if self.bos_token else []
         if self.level == 'word':
             data.extend(self._get_from_dictionary(word)
                         for word in sentence.split())
+        elif self.character_table is not None:
+            data.extend(self._encode_characters(sentence.strip()).tolist())
         else:
             data.extend(self._get_from_dictionary(char)
                         for char in sentence.strip())
         if self.eos_token:
             data.append(self.dictionary[self.eos_token])
-        return (data,)
+        return data
+
+
+class _LineReader(object):
+    """Reads byte ranges from a list of files.
+
+    File handles are opened when first needed and aren't pickled, so that
+    an epoch over a :class:`TextFile` in random access mode can be
+    serialized.
+
+    """
+    def __init__(self, files):
+        self.files = files
+        self.handles = [None] * len(files)
+
+    def read(self, file_index, offset, size):
+        handle = self.handles[file_index]
+        if handle is None:
+            handle = open(self.files[file_index], 'rb')
+            self.handles[file_index] = handle
+        if hasattr(os, 'pread'):
+            return os.pread(handle.fileno(), int(size), int(offset))
+        handle.seek(offset)
+        return handle.read(size)
+
+    def close(self):
+        for handle in self.handles:
+            if handle is not None:
+                handle.close()
+        self.handles = [None] * len(self.files)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['handles'] = [None] * len(self.files)
+        return state
+
+
+def _numberize_files(text_file, files, chunk_size):
+    """Numberize files and yield chunks of sentences.
+
+    `files` is a list of ``(file_index, filename, skip)`` tuples, where
+    `skip` is the number of sentences at the start of the file that have
+    been read before. Yields ``(file_index, sentences)`` tuples; the end
+    of each file is signalled by a tuple without sentences.
+
+    """
+    for file_index, filename, skip in files:
+        chunk = []
+        lines = open_(filename, encoding=text_file.encoding)
+        try:
+            for line in islice(lines, skip, None):
+                chunk.append(text_file.numberize(line))
+                if len(chunk) == chunk_size:
+                    yield file_index, chunk
+                    chunk = []
+        finally:
+            lines.close()
+        if chunk:
+            yield file_index, chunk
+        yield file_index, None
+
+
+def _read_shard(text_file, files, queue, chunk_size):
+    """Numberize files and put chunks of sentences in a queue.
+
+    Every message is a ``(file_index, sentences, error)`` tuple. See
+    :func:`_numberize_files` for the format of `files`.
+
+    """
+    for file_ in files:
+        try:
+            for file_index, sentences in _numberize_files(
+                    text_file, [file_], chunk_size):
+                queue.put((file_index, sentences, None))
+        except Exception:
+            queue.put((file_[0], None, traceback.format_exc()))
+            return
+
+
+class _ShardedReader(six.Iterator):
+    """Reads the files of a :class:`TextFile` in worker processes.
+
+    The workers are started when the first sentence is requested. Of the
+    files that remain to be read, the `i`-th is read by worker
+    ``i % num_workers``. When ordered, each worker has a queue of its own,
+    and the queues are read from in the order of the files.
+
+    The number of sentences received from each file is counted, so that
+    when pickled, only these counts and the sentences that haven't been
+    returned yet are saved. After unpickling, new workers pick up reading
+    where the old ones left off.
+
+    Daemonic processes, such as those of
+    :class:`~fuel.transformers.MultiProcessing`, can't have children. In
+    such a process the files are read in the process itself instead.
+
+    """
+    def __init__(self, text_file, num_workers, ordered, chunk_size=256,
+                 max_chunks=16):
+        self.text_file = text_file
+        self.num_workers = num_workers
+        self.ordered = ordered
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.received = [0] * len(text_file.files)
+        self.finished = [False] * len(text_file.files)
+        self.sentences = deque()
+        self.started = False
+        self.processes = []
+        self.queues = []
+        self.chunks = None
+        self.position = 0
+
+    def _start(self):
+        files = [(i, filename, self.received[i])
+                 for i, filename in enumerate(self.text_file.files)
+                 if not self.finished[i]]
+        self.started = True
+        self.position = 0
+        if current_process().daemon:
+            self.chunks = _numberize_files(self.text_file, files,
+                                           self.chunk_size)
+            return
+        num_workers = min(self.num_workers, len(files))
+        if self.ordered:
+            self.queues = [Queue(self.max_chunks)
+                           for _ in range(num_workers)]
+        else:
+            self.queues = [Queue(self.max_chunks * num_workers)]
+        for i in range(num_workers):
+            process = Process(target=_read_shard, args=(
+                self.text_file, files[i::num_workers],
+                self.queues[i % len(self.queues)], self.chunk_size))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def _get_chunk(self):
+        if self.chunks is not None:
+            return next(self.chunks) + (None,)
+        if self.ordered:
+            worker = self.position % len(self.processes)
+            queue, workers = self.queues[worker], [worker]
+        else:
+            queue, workers = self.queues[0], range(len(self.processes))
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                pass
+            # Workers exit once they have sent all their chunks, so if they
+            # have exited and nothing is left to read, one of them died
+            exited = [i for i in workers if not self.processes[i].is_alive()]
+            crashed = [i for i in exited if self.processes[i].exitcode]
+            if not crashed and len(exited) == len(workers) and queue.empty():
+                crashed = exited
+            if crashed:
+                exitcode = self.processes[crashed[0]].exitcode
+                self.close()
+                raise RuntimeError('worker process {} died with exit code '
+                                   '{}'.format(crashed[0], exitcode))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.sentences:
+            if all(self.finished):
+                raise StopIteration
+            if not self.started:
+                self._start()
+            file_index, sentences, error = self._get_chunk()
+            if error is not None:
+                self.close()
+                raise RuntimeError('worker process raised an exception '
+                                   'while reading file {}:\n{}'
+                                   .format(self.text_file.files[file_index],
+                                           error))
+            if sentences is None:
+                self.finished[file_index] = True
+                self.position += 1
+            else:
+                self.received[file_index] += len(sentences)
+                self.sentences.extend(sentences)
+        return self.sentences.popleft()
+
+    def close(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.started = False
+        self.processes = []
+        self.queues = []
+        self.chunks = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(started=False, processes=[], queues=[], chunks=None)
+        return state
+
+
+def build_line_index(filename, buffer_size=2 ** 24):
+    """Find the byte offset of every line in a file.
+
+    The index is cached in ``filename + '.index.npy'`` and read from there
+    as long as it is more recent than the file itself and ends at the
+    file's current size. The cache is written to a temporary file that is
+    then renamed, so that concurrent readers never see a partial index.
+    If the cache can't be written (e.g. because the data directory is
+    read-only) the index is rebuilt every time.
+
+    Parameters
+    ----------
+    filename : str
+        The file to index. Lines are separated by ``\\n``.
+    buffer_size : int, optional
+        The number of bytes to scan at a time. Defaults to 2 ** 24.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        An array of ``int64`` with one more element than there are lines
+        in the file. Line `i` is found between the offsets at positions
+        `i` and ``i + 1``; the last element is the size of the file.
+
+    """
+    index_path = filename + '.index.npy'
+    if (os.path.exists(index_path) and
+            os.path.getmtime(index_path) >= os.path.getmtime(filename)):
+        index = numpy.load(index_path, mmap_mode='r').view(numpy.ndarray)
+        # The mtime might not have changed if the file was rewritten within
+        # its resolution, but the last offset is the size of the file
+        if len(index) and index[-1] == os.path.getsize(filename):
+            return index
+    offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    position = 0
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(buffer_size)
+            if not data:
+                break
+            newlines = numpy.flatnonzero(
+                numpy.frombuffer(data, dtype=numpy.uint8) == ord('\n'))
+            offsets.append(newlines.astype(numpy.int64) + position + 1)
+            position += len(data)
+    index = numpy.concatenate(offsets)
+    if index[-1] != position:
+        # The last line isn't terminated by a newline
+        index = numpy.append(index, position)
+    try:
+        handle, temp_path = tempfile.mkstemp(
+            suffix='.npy', dir=os.path.dirname(os.path.abspath(filename)))
+    except (IOError, OSError):
+        return index
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            numpy.save(f, index)
+        os.rename(temp_path, index_path)
+    except (IOError, OSError):
+        os.remove(temp_path)
+    return index
+
+
+def tokenize_text_file(text_file, path, buffer_size=2 ** 20):
+    """Numberize a text dataset once and store the result on disk.
+
+    The numbers of all the tokens are written to `path` as one flat array
+    of little-endian unsigned 32-bit integers. The position at which each
+    sentence starts in this array is written to ``path + '.offsets.npy'``
+    as an array with one more element than there are sentences, the last
+    one being the total number of tokens. Use :class:`TokenizedTextFile`
+    to read the result.
+
+    Parameters
+    ----------
+    text_file : :class:`TextFile`
+        The dataset to numberize. Its dictionary, special tokens, level and
+        preprocessing function are applied as when iterating over it.
+    path : str
+        The file to write the tokens to.
+    buffer_size : int, optional
+        The number of tokens to collect before writing them to disk.
+        Defaults to 2 ** 20.
+
+    Returns
+    -------
+    int
+        The number of sentences written.
+
+    """
+    values = list(text_file.dictionary.values())
+    if values and not 0 <= min(values) <= max(values) < 2 ** 32:
+        raise ValueError("dictionary values don't fit in 32 bit unsigned "
+                         "integers")
+    lengths = []
+    buffer_ = []
+    stream = text_file.get_example_stream()
+    try:
+        with open(path, 'wb') as f:
+            for sentence, in stream.get_epoch_iterator():
+                lengths.append(len(sentence))
+                buffer_.extend(sentence)
+                if len(buffer_) >= buffer_size:
+                    numpy.array(buffer_, dtype='<u4').tofile(f)
+                    buffer_ = []
+            numpy.array(buffer_, dtype='<u4').tofile(f)
+    finally:
+        stream.close()
+    offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    numpy.save(path + '.offsets.npy', offsets)
+    return len(lengths)
+
+
+@do_not_pickle_attributes('tokens', 'offsets')
+class TokenizedTextFile(Dataset):
+    r"""Serves sentences numberized by :func:`tokenize_text_file`.
+
+    The tokens and sentence offsets are memory-mapped, so that each
+    sentence is returned as a read-only view of the file and no text is
+    parsed while iterating.
+
+    Parameters
+    ----------
+    path : str
+        The file the tokens were written to by :func:`tokenize_text_file`.
+
+    Notes
+    -----
+    Requests can be a single sentence index, a list of indices or a
+    slice. A single index returns a one-dimensional array of ``uint32``;
+    lists and slices return a list of such arrays, one per sentence, which
+    can be padded with :class:`~fuel.transformers.Padding`.
+
+    Examples
+    --------
+    >>> with open('sentences.txt', 'w') as f:
+    ...     _ = f.write("This is a sentence\n")
+    ...     _ = f.write("This another one")
+    >>> dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4}
+    >>> text_data = TextFile(files=['sentences.txt'],
+    ...                      dictionary=dictionary, bos_token=None,
+    ...                      preprocess=str.lower)
+    >>> tokenize_text_file(text_data, 'sentences.bin')
+    2
+    >>> tokenized = TokenizedTextFile('sentences.bin')
+    >>> tokenized.num_examples
+    2
+    >>> print(tokenized.get_data(request=1)[0])
+    [2 0 4 1]
+
+    .. doctest::
+       :hide:
+
+       >>> import os
+       >>> del tokenized
+       >>> for name in ('sentences.txt', 'sentences.bin',
+       ...              'sentences.bin.offsets.npy'):
+       ...     os.remove(name)
+
+    """
+    provides_sources = ('features',)
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        super(TokenizedTextFile, self).__init__(**kwargs)
+        self.example_iteration_scheme = SequentialExampleScheme(
+            self.num_examples)
+
+    def load(self):
+        self.offsets = numpy.load(self.path + '.offsets.npy',
+                                  mmap_mode='r').view(numpy.ndarray)
+        if self.offsets[-1]:
+            self.tokens = numpy.memmap(
+                self.path, dtype='<u4', mode='r',
+                shape=(int(self.offsets[-1]),)).view(numpy.ndarray)
+        else:
+            # Empty files can't be memory-mapped
+            self.tokens = numpy.empty(0, dtype='<u4')
+
+    @property
+    def num_examples(self):
+        return len(self.offsets) - 1
+
+    def get_data(self, state=None, request=None):
+        if request is None:
+            raise ValueError
+        tokens, offsets = self.tokens, self.offsets
+        if isinstance(request, numbers.Integral):
+            return (tokens[offsets[request]:offsets[request + 1]],)
+        if isinstance(request, slice):
+            request = range(*request.indices(self.num_examples))
+        return ([tokens[offsets[i]:offsets[i + 1]] for i in request],)
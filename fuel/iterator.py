@@ -1,3 +1,5 @@
+from timeit import default_timer
+
 import six
 
 
@@ -16,6 +18,12 @@ class DataIterator(six.Iterator):
         from each source. If `False` (default), return tuples in the
         same order as `data_stream.sources`.
 
+    Notes
+    -----
+    If the data stream has profiling counters attached (see
+    :mod:`fuel.utils.profiling`), the time spent in each call to its
+    `get_data` method is recorded.
+
     """
     def __init__(self, data_stream, request_iterator=None, as_dict=False):
         self.data_stream = data_stream
@@ -27,9 +35,16 @@ class DataIterator(six.Iterator):
 
     def __next__(self):
         if self.request_iterator is not None:
-            data = self.data_stream.get_data(next(self.request_iterator))
+            request = next(self.request_iterator)
+        profile = getattr(self.data_stream, 'profile', None)
+        if profile is not None:
+            start = default_timer()
+        if self.request_iterator is not None:
+            data = self.data_stream.get_data(request)
         else:
             data = self.data_stream.get_data()
+        if profile is not None:
+            profile.record(default_timer() - start, data)
         if self.as_dict:
             return dict(zip(self.data_stream.sources, data))
         else:
@@ -1,8 +1,9 @@
 from abc import ABCMeta, abstractmethod
 from collections import Iterable
+import sys
 
 import numpy
-from picklable_itertools import chain, repeat, imap, iter_
+from picklable_itertools import chain, repeat, imap, iter_, islice
 from picklable_itertools.extras import partition_all
 from six import add_metaclass
 from six.moves import xrange
@@ -124,6 +125,47 @@ class ConcatenatedScheme(IterationScheme):
         return self.schemes[0].requests_examples
 
 
+class ShardedScheme(IterationScheme):
+    """Return every n-th request of another scheme.
+
+    Useful for dividing the requests of a scheme between several
+    processes that each have a copy of it.
+
+    Parameters
+    ----------
+    scheme : :class:`IterationScheme`
+        The scheme whose requests to divide.
+    num_shards : int
+        The number of shards the requests are divided into.
+    shard : int
+        The shard to return the requests of, between 0 and `num_shards`
+        - 1.
+
+    Notes
+    -----
+    The shards only form a partition of the requests of `scheme` if each
+    copy of `scheme` returns the same requests, e.g. stochastic schemes
+    should be copied along with the state of their random number
+    generator.
+
+    """
+    def __init__(self, scheme, num_shards, shard):
+        if not 0 <= shard < num_shards:
+            raise ValueError('shard must be between 0 and num_shards - 1')
+        self.scheme = scheme
+        self.num_shards = num_shards
+        self.shard = shard
+
+    def get_request_iterator(self):
+        # picklable_itertools' islice doesn't support a stop of None
+        return islice(self.scheme.get_request_iterator(), self.shard,
+                      sys.maxsize, self.num_shards)
+
+    @property
+    def requests_examples(self):
+        return self.scheme.requests_examples
+
+
 @add_metaclass(ABCMeta)
 class IndexScheme(IterationScheme):
     """Iteration schemes that return single indices.
@@ -229,6 +271,84 @@ class ShuffledScheme(BatchScheme):
             return imap(list, partition_all(self.batch_size, indices))
 
 
+class BlockShuffledScheme(BatchScheme):
+    """Shuffled batches iterator that preserves locality.
+
+    Iterate over all the examples in a dataset of fixed size in batches
+    that are shuffled at two levels: the examples are divided into blocks
+    of consecutive examples that are visited in a random order, and the
+    examples within a buffer of several such blocks are shuffled. When
+    the blocks correspond to the chunks of an HDF5 dataset, each chunk
+    needs to be read only once per epoch.
+
+    Parameters
+    ----------
+    block_size : int
+        The number of consecutive examples in a block. For
+        :class:`.H5PYDataset`, :attr:`.H5PYDataset.examples_per_chunk`
+        gives the number of examples per chunk.
+    buffer_size : int, optional
+        The number of examples shuffled together. It is rounded down to a
+        multiple of `block_size`, but includes at least one block.
+        Defaults to the largest of `batch_size` and `block_size`.
+    offset : int, optional
+        The position in storage of the example with index 0. Blocks start
+        at the examples whose position is a multiple of `block_size`. For
+        a split of an :class:`.H5PYDataset` that doesn't start at a chunk
+        boundary, pass the start of the split, so that blocks line up
+        with chunks. Defaults to 0.
+    sorted_indices : bool, optional
+        If `True`, enforce that indices within a batch are ordered.
+        Defaults to `False`.
+
+    Notes
+    -----
+    The batch size isn't enforced, so the last batch could be smaller.
+
+    The examples are divided into blocks in the order in which they are
+    given, so they should be sorted for the blocks to consist of
+    consecutive examples.
+
+    """
+    def __init__(self, examples, batch_size, block_size, **kwargs):
+        self.rng = kwargs.pop('rng', None)
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
+        self.sorted_indices = kwargs.pop('sorted_indices', False)
+        buffer_size = kwargs.pop('buffer_size', None)
+        self.offset = kwargs.pop('offset', 0)
+        super(BlockShuffledScheme, self).__init__(examples, batch_size,
+                                                  **kwargs)
+        if block_size < 1:
+            raise ValueError('block_size must be a positive integer')
+        self.block_size = block_size
+        if buffer_size is None:
+            buffer_size = max(self.batch_size, block_size)
+        self.buffer_size = buffer_size
+
+    def get_request_iterator(self):
+        indices = list(self.indices)
+        block_ids = (numpy.asarray(indices, dtype=numpy.int64) +
+                     self.offset) // self.block_size
+        bounds = ([0] + (numpy.flatnonzero(numpy.diff(block_ids)) +
+                         1).tolist() + [len(indices)])
+        blocks = [indices[start:stop]
+                  for start, stop in zip(bounds[:-1], bounds[1:])
+                  if start < stop]
+        order = self.rng.permutation(len(blocks))
+        blocks_per_buffer = max(1, self.buffer_size // self.block_size)
+        shuffled = []
+        for i in xrange(0, len(blocks), blocks_per_buffer):
+            buffer_ = list(chain(*[blocks[j]
+                                   for j in order[i:i + blocks_per_buffer]]))
+            self.rng.shuffle(buffer_)
+            shuffled.extend(buffer_)
+        if self.sorted_indices:
+            return imap(sorted, partition_all(self.batch_size, shuffled))
+        else:
+            return imap(list, partition_all(self.batch_size, shuffled))
+
+
 class BalancedSamplingScheme(ShuffledScheme):
     """Balanced sampling batches iterator.
 
@@ -1,15 +1,101 @@
+import ast
 import logging
+import os
+import struct
+import sys
+import zlib
+from multiprocessing import Process
 
 import numpy
 import zmq
-from numpy.lib.format import header_data_from_array_1_0
+from numpy.lib.format import dtype_to_descr
+from six import string_types
 
-from fuel.utils import buffer_
+from fuel.schemes import BatchSizeScheme, ShardedScheme
+from fuel.utils.parallel import reseed_streams
+
+try:
+    import lz4.frame
+    lz4_available = True
+except ImportError:
+    lz4_available = False
+
+try:
+    import zstandard
+    zstd_available = True
+except ImportError:
+    zstd_available = False
+
+try:
+    import blosc
+    blosc_available = True
+except ImportError:
+    blosc_available = False
 
 logger = logging.getLogger(__name__)
 
+PROTOCOL_VERSION = 1
+CODECS = ('zlib', 'lz4', 'zstd', 'blosc')
+
+_MAGIC = b'FUEL'
+_STOP = 1
+_FORTRAN_ORDER = 1
+_LITERAL_DESCR = 2
+# Magic bytes, protocol version, flags and number of arrays
+_MESSAGE_HEADER = struct.Struct('<4sBBI')
+# Codec, flags, number of dimensions, length of the dtype description and
+# size of the uncompressed data
+_ARRAY_HEADER = struct.Struct('<BBBBQ')
+_CODEC_IDS = {None: 0, 'zlib': 1, 'lz4': 2, 'zstd': 3, 'blosc': 4}
+_CODEC_NAMES = dict((id_, name) for name, id_ in _CODEC_IDS.items())
+
+
+def codec_available(codec):
+    """Check whether a compression codec can be used.
 
-def send_arrays(socket, arrays, stop=False):
+    Parameters
+    ----------
+    codec : str or None
+        One of :data:`CODECS`, or `None` for no compression.
+
+    Returns
+    -------
+    bool
+
+    """
+    if codec not in _CODEC_IDS:
+        raise ValueError('unknown codec: {}'.format(codec))
+    return {'lz4': lz4_available, 'zstd': zstd_available,
+            'blosc': blosc_available}.get(codec, True)
+
+
+def _compress(codec, data, itemsize):
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    elif codec == 'lz4':
+        return lz4.frame.compress(data)
+    elif codec == 'zstd':
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    elif codec == 'blosc':
+        return blosc.compress(data, typesize=itemsize)
+
+
+def _decompress(codec, data, nbytes):
+    if not codec_available(codec):
+        raise ImportError('received data compressed with {0}, but {0} is '
+                          'not installed'.format(codec))
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    elif codec == 'lz4':
+        return lz4.frame.decompress(data)
+    elif codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=nbytes)
+    elif codec == 'blosc':
+        return blosc.decompress(data)
+
+
+def send_arrays(socket, arrays, stop=False, compression=None):
     """Send NumPy arrays using the buffer interface and some metadata.
 
     Parameters
@@ -19,30 +105,80 @@ def send_arrays(socket, arrays, stop=False):
     arrays : list
         A list of :class:`numpy.ndarray` to transfer.
     stop : bool, optional
-        Instead of sending a series of NumPy arrays, send a JSON object
-        with a single `stop` key. The :func:`recv_arrays` will raise
+        Instead of sending a series of NumPy arrays, send a message that
+        signals the end of the epoch. The :func:`recv_arrays` will raise
         ``StopIteration`` when it receives this.
+    compression : str or list, optional
+        The codec with which to compress the arrays (one of
+        :data:`CODECS`), or a list with a codec (or `None`) for each array.
+        By default no compression is used.
 
     Notes
     -----
-    The protocol is very simple: A single JSON object describing the array
-    format (using the same specification as ``.npy`` files) is sent first.
-    Subsequently the arrays are sent as bytestreams (through NumPy's
-    support of the buffering protocol).
+    A message consists of a binary header frame followed by one frame per
+    array. The header describes the data type, shape, memory layout and
+    compression codec of each array, so the receiving end doesn't need to
+    be told beforehand which codecs are used. Arrays for which compression
+    doesn't save any space are sent uncompressed.
+
+    ZeroMQ sends frames asynchronously, after this function has returned.
+    Uncompressed arrays that own their data are sent without being copied
+    if they are contiguous, so they should not be modified after having
+    been sent. Arrays that are views, such as those of a buffer that is
+    reused for every batch (e.g. by :class:`~fuel.transformers.Padding`
+    with `reuse_buffers`), are copied before being sent.
 
     """
-    if arrays:
-        # The buffer protocol only works on contiguous arrays
-        arrays = [numpy.ascontiguousarray(array) for array in arrays]
     if stop:
-        headers = {'stop': True}
-        socket.send_json(headers)
-    else:
-        headers = [header_data_from_array_1_0(array) for array in arrays]
-        socket.send_json(headers, zmq.SNDMORE)
-        for array in arrays[:-1]:
-            socket.send(array, zmq.SNDMORE)
-        socket.send(arrays[-1])
+        socket.send(_MESSAGE_HEADER.pack(_MAGIC, PROTOCOL_VERSION, _STOP, 0))
+        return
+    if compression is None or isinstance(compression, string_types):
+        compression = [compression] * len(arrays)
+    elif len(compression) != len(arrays):
+        raise ValueError('got {} codecs for {} arrays'
+                         .format(len(compression), len(arrays)))
+    header = [_MESSAGE_HEADER.pack(_MAGIC, PROTOCOL_VERSION, 0,
+                                   len(arrays))]
+    frames = []
+    for array, codec in zip(arrays, compression):
+        array = numpy.asarray(array)
+        if array.dtype.hasobject:
+            raise ValueError('object arrays cannot be sent')
+        flags = 0
+        if array.flags.f_contiguous and not array.flags.c_contiguous:
+            flags |= _FORTRAN_ORDER
+            data = array.T
+        else:
+            data = numpy.ascontiguousarray(array)
+        data = data.reshape(-1).view(numpy.uint8)
+        if data.nbytes and codec is not None:
+            compressed = _compress(codec, data, array.dtype.itemsize)
+            if len(compressed) < data.nbytes:
+                data = compressed
+            else:
+                codec = None
+        else:
+            codec = None
+        if (codec is None and not array.flags.owndata and
+                numpy.may_share_memory(data, array)):
+            # The memory might be overwritten before the frame is sent
+            data = data.copy()
+        if array.dtype.fields is None and array.dtype.subdtype is None:
+            descr = array.dtype.str
+        else:
+            flags |= _LITERAL_DESCR
+            descr = repr(dtype_to_descr(array.dtype))
+        descr = descr.encode('ascii')
+        header.append(_ARRAY_HEADER.pack(_CODEC_IDS[codec], flags,
+                                         array.ndim, len(descr),
+                                         array.nbytes))
+        header.append(descr)
+        header.append(struct.pack('<{}q'.format(array.ndim), *array.shape))
+        frames.append(data)
+    socket.send(b''.join(header), zmq.SNDMORE if frames else 0)
+    for i, data in enumerate(frames):
+        socket.send(data, zmq.SNDMORE if i < len(frames) - 1 else 0,
+                    copy=False)
 
 
 def recv_arrays(socket):
@@ -61,27 +197,132 @@ def recv_arrays(socket):
     Raises
     ------
     StopIteration
-        If the first JSON object received contains the key `stop`,
-        signifying that the server has finished a single epoch.
+        If the message received signifies that the server has finished a
+        single epoch.
 
     """
-    headers = socket.recv_json()
-    if 'stop' in headers:
+    frames = socket.recv_multipart(copy=False)
+    header = frames[0].bytes
+    magic, version, flags, num_arrays = _MESSAGE_HEADER.unpack_from(header)
+    if magic != _MAGIC or version != PROTOCOL_VERSION:
+        raise ValueError('received a message in an unknown format; make '
+                         'sure the server runs the same version of Fuel')
+    if flags & _STOP:
         raise StopIteration
+    offset = _MESSAGE_HEADER.size
     arrays = []
-    for header in headers:
-        data = socket.recv()
-        buf = buffer_(data)
-        array = numpy.frombuffer(buf, dtype=numpy.dtype(header['descr']))
-        array.shape = header['shape']
-        if header['fortran_order']:
-            array.shape = header['shape'][::-1]
-            array = array.transpose()
+    for frame in frames[1:]:
+        codec, flags, ndim, descr_length, nbytes = \
+            _ARRAY_HEADER.unpack_from(header, offset)
+        offset += _ARRAY_HEADER.size
+        descr = header[offset:offset + descr_length].decode('ascii')
+        offset += descr_length
+        if flags & _LITERAL_DESCR:
+            descr = ast.literal_eval(descr)
+        dtype = numpy.dtype(descr)
+        shape = struct.unpack_from('<{}q'.format(ndim), header, offset)
+        offset += 8 * ndim
+        if not nbytes:
+            array = numpy.empty(shape, dtype=dtype)
+        else:
+            data = frame.buffer
+            if codec:
+                data = _decompress(_CODEC_NAMES[codec], data, nbytes)
+            if flags & _FORTRAN_ORDER:
+                array = numpy.frombuffer(data, dtype=dtype).reshape(
+                    shape[::-1]).T
+            else:
+                array = numpy.frombuffer(data, dtype=dtype).reshape(shape)
         arrays.append(array)
     return arrays
 
 
-def start_server(data_stream, port=5557, hwm=10):
+def _is_stop_message(header):
+    _, _, flags, _ = _MESSAGE_HEADER.unpack_from(header)
+    return bool(flags & _STOP)
+
+
+def _wait_for_socket(socket, event, parent_pid):
+    """Wait until a socket is ready, exiting if the parent has died."""
+    while not socket.poll(1000, event):
+        if os.getppid() != parent_pid:
+            sys.exit(1)
+
+
+def _run_producer(data_stream, broker_port, num_producers, producer,
+                  parent_pid, hwm, compression):
+    """Send a shard of the batches of a data stream to the broker.
+
+    The requests of the iteration scheme of the innermost data stream are
+    divided between the producers. At the end of each epoch the producer
+    sends a stop message and waits for the broker to signal that all
+    producers have finished the epoch.
+
+    """
+    stream = reseed_streams(data_stream, producer)
+    stream.iteration_scheme = ShardedScheme(stream.iteration_scheme,
+                                            num_producers, producer)
+
+    context = zmq.Context()
+    socket = context.socket(zmq.DEALER)
+    socket.set_hwm(hwm)
+    socket.connect('tcp://127.0.0.1:{}'.format(broker_port))
+    try:
+        while True:
+            for data in data_stream.get_epoch_iterator():
+                _wait_for_socket(socket, zmq.POLLOUT, parent_pid)
+                send_arrays(socket, data, compression=compression)
+            _wait_for_socket(socket, zmq.POLLOUT, parent_pid)
+            send_arrays(socket, None, stop=True)
+            _wait_for_socket(socket, zmq.POLLIN, parent_pid)
+            socket.recv()
+    finally:
+        context.destroy(linger=0)
+
+
+def _run_broker(socket, data_stream, num_producers, hwm, compression):
+    """Start producer processes and forward their batches to the client."""
+    router = socket.context.socket(zmq.ROUTER)
+    router.set_hwm(hwm)
+    broker_port = router.bind_to_random_port('tcp://127.0.0.1')
+    producers = []
+    for producer in range(num_producers):
+        process = Process(
+            target=_run_producer,
+            args=(data_stream, broker_port, num_producers, producer,
+                  os.getpid(), hwm, compression))
+        process.daemon = True
+        process.start()
+        producers.append(process)
+
+    logger.info('server started with {} producers'.format(num_producers))
+    finished = []
+    try:
+        while True:
+            if not router.poll(1000):
+                if not all(process.is_alive() for process in producers):
+                    raise RuntimeError('a producer process has died')
+                continue
+            frames = router.recv_multipart(copy=False)
+            identity, frames = frames[0].bytes, frames[1:]
+            if not _is_stop_message(frames[0].bytes):
+                logger.debug("sending {} arrays".format(len(frames) - 1))
+                socket.send_multipart(frames, copy=False)
+                continue
+            finished.append(identity)
+            if len(finished) == num_producers:
+                logger.debug("sending StopIteration")
+                send_arrays(socket, None, stop=True)
+                for identity in finished:
+                    router.send_multipart([identity, b''])
+                finished = []
+    finally:
+        for process in producers:
+            process.terminate()
+
+
+def start_server(data_stream, port=5557, hwm=10, compression=None,
+                 num_producers=None):
     """Start a data processing server.
 
     This command starts a server in the current process that performs the
@@ -106,8 +347,58 @@ def start_server(data_stream, port=5557, hwm=10):
         many batches will actually be queued with a particular HWM.
         Defaults to 10. Be sure to set the corresponding HWM on the
         receiving end as well.
+    compression : str or dict, optional
+        The codec with which to compress batches before sending them (one
+        of :data:`CODECS`), or a dictionary mapping source names to codecs
+        to compress only some sources. The codec is sent along with each
+        array, so no changes are needed on the receiving end, but the
+        client needs to have the same compression library installed.
+        By default batches are sent uncompressed.
+    num_producers : int, optional
+        If given, the data is processed by this many producer processes
+        instead of by the server process itself. The requests of the
+        iteration scheme of the innermost data stream are divided evenly
+        between the producers, and the server forwards the batches to the
+        client as soon as they are ready, so the order of the batches
+        isn't preserved. The end of an epoch is signalled once, after all
+        producers have finished their share of it.
+
+    Notes
+    -----
+    When using several producers the iteration scheme of the innermost
+    data stream must request specific examples (e.g. a
+    :class:`~fuel.schemes.SequentialScheme` or
+    :class:`~fuel.schemes.ShuffledScheme`), and stochastic schemes must
+    use a fixed random number generator, so that each producer draws the
+    same requests. Random number generators stored as the `rng` attribute
+    of streams in the chain are reseeded differently in each producer.
 
     """
+    if compression is None or isinstance(compression, string_types):
+        compression = dict.fromkeys(data_stream.sources, compression)
+    unknown = set(compression) - set(data_stream.sources)
+    if unknown:
+        raise ValueError('unknown sources in compression: {}'
+                         .format(', '.join(sorted(unknown))))
+    for codec in compression.values():
+        if not codec_available(codec):
+            raise ValueError('{} is not installed'.format(codec))
+    compression = [compression.get(source) for source in data_stream.sources]
+
+    if num_producers is not None:
+        if num_producers < 1:
+            raise ValueError('num_producers must be a positive integer')
+        stream = data_stream
+        while hasattr(stream, 'data_stream'):
+            stream = stream.data_stream
+        if getattr(stream, 'iteration_scheme', None) is None:
+            raise ValueError('the innermost data stream must have an '
+                             'iteration scheme to divide between producers')
+        if isinstance(stream.iteration_scheme, BatchSizeScheme):
+            raise ValueError('the requests of a BatchSizeScheme cannot be '
+                             'divided between producers, because each '
+                             'producer would read the same examples')
+
     logging.basicConfig(level='INFO')
 
     context = zmq.Context()
@@ -115,6 +406,10 @@ def start_server(data_stream, port=5557, hwm=10):
     socket.set_hwm(hwm)
     socket.bind('tcp://*:{}'.format(port))
 
+    if num_producers is not None:
+        _run_broker(socket, data_stream, num_producers, hwm, compression)
+        return
+
     it = data_stream.get_epoch_iterator()
 
     logger.info('server started')
@@ -128,4 +423,4 @@ def start_server(data_stream, port=5557, hwm=10):
             data = None
             stop = True
             logger.debug("sending StopIteration")
-        send_arrays(socket, data, stop=stop)
+        send_arrays(socket, data, stop=stop, compression=compression)
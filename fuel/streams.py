@@ -1,4 +1,5 @@
 from abc import ABCMeta, abstractmethod
+from timeit import default_timer
 
 import zmq
 from six import add_metaclass, iteritems
@@ -40,8 +41,13 @@ class AbstractDataStream(object):
     produces_examples : bool
         Whether this data stream produces examples (as opposed to batches
         of examples).
+    profile : :class:`.StageProfile`
+        Profiling counters for this data stream, or ``None`` (default) if
+        it isn't being profiled. See :mod:`fuel.utils.profiling`.
 
     """
+    profile = None
+
     def __init__(self, iteration_scheme=None, axis_labels=None):
         self.iteration_scheme = iteration_scheme
         self.axis_labels = axis_labels
@@ -175,7 +181,11 @@ class DataStream(AbstractDataStream):
             self.next_epoch()
         else:
             self._fresh_state = False
-        return super(DataStream, self).get_epoch_iterator(**kwargs)
+        iterator = super(DataStream, self).get_epoch_iterator(**kwargs)
+        if iterator.request_iterator is not None:
+            iterator.request_iterator = self.dataset.lookahead(
+                self.data_state, iterator.request_iterator)
+        return iterator
 
     @classmethod
     def default_stream(cls, dataset, **kwargs):
@@ -233,7 +243,11 @@ class ServerDataStream(AbstractDataStream):
             raise ValueError
         if not self.connected:
             self.connect()
+        if self.profile is not None:
+            start = default_timer()
         data = recv_arrays(self.socket)
+        if self.profile is not None:
+            self.profile.wait_time += default_timer() - start
         return tuple(data)
 
     def get_epoch_iterator(self, **kwargs):
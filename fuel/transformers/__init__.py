@@ -1,19 +1,25 @@
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque
 import logging
 from multiprocessing import Process, Queue
+from timeit import default_timer
+import traceback
 
 import numpy
+import scipy.sparse
 import warnings
 from picklable_itertools import chain, ifilter, izip
+import six
 from six import add_metaclass, iteritems
+from six.moves.queue import Empty
 
 import pyximport
 pyximport.install()
 
 from fuel import config
 from fuel.streams import AbstractDataStream
-from fuel.schemes import BatchSizeScheme
+from fuel.schemes import BatchSizeScheme, IterationScheme
+from fuel.utils.parallel import SharedMemoryRing, reseed_streams
 from ..exceptions import AxisLabelsMismatchError
 
 log = logging.getLogger(__name__)
@@ -437,6 +443,163 @@ class ForceFloatX(AgnosticSourcewiseTransformer):
         return source_data
 
 
+class FusedElementwise(AgnosticTransformer):
+    """Applies a chain of elementwise transformers in a single pass.
+
+    Stacking :class:`ScaleAndShift`, :class:`Cast`, :class:`ForceFloatX`
+    and :class:`Flatten` transformers allocates a new array at every step.
+    This transformer applies the same steps to each source, but writes
+    into a single output array per source wherever possible: arithmetic
+    is done in place using the `out` argument of NumPy ufuncs, and casts
+    directly following a :class:`ScaleAndShift` are folded into it.
+
+    Usually constructed through :func:`fuse_elementwise`.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to wrap.
+    transformers : list of :class:`Transformer`
+        The transformers to fuse, innermost first. They must be instances
+        of the classes listed in :attr:`fusable`, and each one is applied
+        to its own `which_sources`.
+
+    Notes
+    -----
+    When a cast to a floating point type follows a :class:`ScaleAndShift`,
+    scaling and shifting are carried out in the precision of the target
+    type. Results can therefore differ in the last bit from the unfused
+    chain, which computes in the wider type and rounds afterwards.
+
+    """
+    fusable = (ScaleAndShift, Cast, ForceFloatX, Flatten)
+
+    def __init__(self, data_stream, transformers, **kwargs):
+        for transformer in transformers:
+            if type(transformer) not in self.fusable:
+                raise ValueError('cannot fuse {}'.format(
+                    transformer.__class__.__name__))
+        if transformers:
+            kwargs.setdefault('axis_labels', transformers[-1].axis_labels)
+        super(FusedElementwise, self).__init__(
+            data_stream, data_stream.produces_examples, **kwargs)
+        self.transformers = transformers
+
+    @staticmethod
+    def _cast_dtype(transformer, dtype):
+        """The dtype `transformer` casts an array of `dtype` to."""
+        if isinstance(transformer, Cast):
+            return numpy.dtype(transformer.dtype)
+        if dtype.kind == 'f' and dtype != config.floatX:
+            return numpy.dtype(config.floatX)
+        return dtype
+
+    def _scale_and_shift(self, source_data, owned, steps):
+        transformer = steps[0]
+        scale, shift = transformer.scale, transformer.shift
+        dtype = numpy.result_type(source_data, scale)
+        dtype = numpy.result_type(
+            dtype if source_data.ndim else numpy.zeros((), dtype), shift)
+        # Fold casts between floating point types into the output buffer
+        folded = 1
+        for cast in steps[1:]:
+            if not isinstance(cast, (Cast, ForceFloatX)):
+                break
+            cast_dtype = self._cast_dtype(cast, dtype)
+            if dtype.kind != 'f' or cast_dtype.kind != 'f':
+                break
+            dtype = cast_dtype
+            folded += 1
+        shape = numpy.broadcast(source_data, scale, shift).shape
+        if owned and source_data.shape == shape and source_data.dtype == dtype:
+            output = source_data
+        else:
+            output = numpy.empty(shape, dtype=dtype)
+        numpy.multiply(source_data, scale, out=output, casting='unsafe')
+        numpy.add(output, shift, out=output, casting='unsafe')
+        return output, folded
+
+    def _transform_source(self, source_data, source_name):
+        steps = [transformer for transformer in self.transformers
+                 if source_name in transformer.which_sources]
+        owned = False
+        i = 0
+        while i < len(steps):
+            transformer = steps[i]
+            i += 1
+            if isinstance(transformer, ForceFloatX):
+                if not isinstance(source_data, numpy.ndarray):
+                    continue
+            else:
+                source_data = numpy.asarray(source_data)
+            if isinstance(transformer, ScaleAndShift):
+                source_data, folded = self._scale_and_shift(
+                    source_data, owned, steps[i - 1:])
+                owned = True
+                i += folded - 1
+            elif isinstance(transformer, Flatten):
+                if self.produces_examples:
+                    source_data = (source_data.reshape(-1) if owned
+                                   else source_data.flatten())
+                    owned = True
+                else:
+                    source_data = source_data.reshape(
+                        (len(source_data), -1))
+            else:
+                dtype = self._cast_dtype(transformer, source_data.dtype)
+                if dtype != source_data.dtype:
+                    source_data = source_data.astype(dtype)
+                    owned = True
+        return source_data
+
+    def transform_any(self, data):
+        return tuple(self._transform_source(source_data, source_name)
+                     for source_data, source_name in zip(data, self.sources))
+
+
+def fuse_elementwise(data_stream):
+    """Fuse chains of elementwise transformers in a pipeline.
+
+    Walks down the pipeline starting at `data_stream`, replacing every
+    run of two or more consecutive :class:`ScaleAndShift`, :class:`Cast`,
+    :class:`ForceFloatX` and :class:`Flatten` transformers by a single
+    :class:`FusedElementwise` transformer. Subclasses of these
+    transformers are left alone.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The outermost data stream of the pipeline.
+
+    Returns
+    -------
+    :class:`AbstractDataStream`
+        The outermost data stream of the fused pipeline. The pipeline is
+        modified in place, so this is `data_stream` unless that data
+        stream was itself fused.
+
+    """
+    outermost, parent, stream = data_stream, None, data_stream
+    while isinstance(stream, Transformer):
+        run = []
+        while type(stream) in FusedElementwise.fusable:
+            run.append(stream)
+            stream = stream.data_stream
+        if len(run) > 1:
+            fused = FusedElementwise(stream, run[::-1])
+            if parent is None:
+                outermost = fused
+            else:
+                parent.data_stream = fused
+            parent = fused
+        elif run:
+            parent = run[0]
+        else:
+            parent = stream
+            stream = stream.data_stream
+    return outermost
+
+
 class Filter(Transformer):
     """Filters samples that meet a predicate.
 
@@ -460,6 +623,60 @@ class Filter(Transformer):
         return ifilter(self.predicate, self.child_epoch_iterator)
 
 
+class _CachedSource(object):
+    """The unread examples of a single source held by :class:`Cache`.
+
+    Chunks are kept as arrays in a queue together with a read cursor into
+    the first one, so that taking a batch only slices (and, for batches
+    spanning several chunks, concatenates) the examples it returns.
+
+    """
+    def __init__(self):
+        self.chunks = deque()
+        self.cursor = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, data):
+        data = numpy.asarray(data)
+        if len(data):
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def compact(self):
+        """Copy the unread examples out of the chunks they belong to.
+
+        This keeps the cache valid if the wrapped stream reuses the
+        memory of the chunks it returned.
+
+        """
+        if self.size:
+            remainder = self.take(self.size).copy()
+            self.chunks.append(remainder)
+            self.size = len(remainder)
+
+    def take(self, num_examples):
+        pieces = []
+        while num_examples and self.chunks:
+            chunk = self.chunks[0]
+            stop = min(self.cursor + num_examples, len(chunk))
+            pieces.append(chunk[self.cursor:stop])
+            num_examples -= stop - self.cursor
+            self.size -= stop - self.cursor
+            if stop == len(chunk):
+                self.chunks.popleft()
+                self.cursor = 0
+            else:
+                self.cursor = stop
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return numpy.asarray([])
+        return numpy.concatenate(pieces)
+
+
 class Cache(Transformer):
     """Cache examples when sequentially reading a dataset.
 
@@ -470,18 +687,25 @@ class Cache(Transformer):
     Parameters
     ----------
     iteration_scheme : :class:`.IterationScheme`
-        Note that this iteration scheme must return batch sizes (integers),
-        which must necessarily be smaller than the child data stream i.e.
-        the batches returned must be smaller than the cache size.
+        Note that this iteration scheme must return batch sizes (integers).
+        Batches larger than the chunks of the child data stream are
+        assembled from several chunks.
 
     Attributes
     ----------
-    cache : list of lists of objects
+    cache : list of cached sources
         This attribute holds the cache at any given point. It is a list of
         the same size as the :attr:`sources` attribute. Each element in
-        this list in its turn a list of examples that are currently in the
-        cache. The cache gets emptied at the start of each epoch, and gets
-        refilled when needed through the :meth:`get_data` method.
+        this list holds the examples of that source that are currently in
+        the cache, and its length is the number of these examples. The
+        cache gets emptied at the start of each epoch, and gets refilled
+        when needed through the :meth:`get_data` method.
+
+    Notes
+    -----
+    Chunks are stored as arrays and batches are returned as views into
+    them wherever possible, so taking a batch does not copy the rest of
+    the cache.
 
     """
     def __init__(self, data_stream, iteration_scheme, **kwargs):
@@ -495,31 +719,31 @@ class Cache(Transformer):
             kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
         super(Cache, self).__init__(
             data_stream, iteration_scheme=iteration_scheme, **kwargs)
-        self.cache = [[] for _ in self.sources]
+        self.cache = [_CachedSource() for _ in self.sources]
 
     def get_data(self, request=None):
         if request is None:
             raise ValueError
         if request > len(self.cache[0]):
-            self._cache()
-        data = []
-        for i, cache in enumerate(self.cache):
-            data.append(numpy.asarray(cache[:request]))
-            self.cache[i] = cache[request:]
-        return tuple(data)
+            self._cache(request)
+        return tuple(cache.take(request) for cache in self.cache)
 
     def get_epoch_iterator(self, **kwargs):
-        self.cache = [[] for _ in self.sources]
+        self.cache = [_CachedSource() for _ in self.sources]
         return super(Cache, self).get_epoch_iterator(**kwargs)
 
-    def _cache(self):
-        try:
-            for cache, data in zip(self.cache,
-                                   next(self.child_epoch_iterator)):
-                cache.extend(data)
-        except StopIteration:
-            if not self.cache[0]:
-                raise
+    def _cache(self, request):
+        for cache in self.cache:
+            cache.compact()
+        while request > len(self.cache[0]):
+            try:
+                data = next(self.child_epoch_iterator)
+            except StopIteration:
+                if not len(self.cache[0]):
+                    raise
+                break
+            for cache, source_data in zip(self.cache, data):
+                cache.extend(source_data)
 
 
 class SortMapping(object):
@@ -591,25 +815,101 @@ class Batch(Transformer):
             data_stream, iteration_scheme=iteration_scheme, **kwargs)
         self.strictness = strictness
 
+    @staticmethod
+    def _allocate(example, size):
+        """Allocate a batch array for examples shaped like `example`.
+
+        Returns ``None`` if the example isn't a NumPy array or scalar, in
+        which case the batch is built from a list instead.
+
+        """
+        if (isinstance(example, (numpy.ndarray, numpy.generic)) and
+                example.dtype != object):
+            return numpy.empty((size,) + example.shape, dtype=example.dtype)
+
+    @staticmethod
+    def _fits(example, batch):
+        return (isinstance(example, (numpy.ndarray, numpy.generic)) and
+                example.shape == batch.shape[1:] and
+                example.dtype == batch.dtype)
+
     def get_data(self, request=None):
-        """Get data from the dataset."""
+        """Get data from the dataset.
+
+        If the first example of a source is a NumPy array (or scalar), the
+        batch for that source is allocated once and examples are written
+        into it in place. Should a later example differ in shape or dtype,
+        that source falls back to collecting examples in a list.
+
+        """
         if request is None:
             raise ValueError
+        if isinstance(self.data_stream, Unpack):
+            return self._get_unpacked_data(request)
+        batches = [None] * len(self.sources)
         data = [[] for _ in self.sources]
+        num_examples = 0
         for i in range(request):
             try:
-                for source_data, example in zip(
-                        data, next(self.child_epoch_iterator)):
-                    source_data.append(example)
+                example = next(self.child_epoch_iterator)
             except StopIteration:
                 # If some data has been extracted and `strict` is not set,
                 # we should spit out this data before stopping iteration.
-                if not self.strictness and data[0]:
+                if not self.strictness and num_examples:
                     break
-                elif self.strictness > 1 and data[0]:
+                elif self.strictness > 1 and num_examples:
                     raise ValueError
                 raise
-        return tuple(numpy.asarray(source_data) for source_data in data)
+            if i == 0:
+                batches = [self._allocate(source_example, request)
+                           for source_example in example]
+            for j, source_example in enumerate(example):
+                batch = batches[j]
+                if batch is not None:
+                    if self._fits(source_example, batch):
+                        batch[i] = source_example
+                        continue
+                    data[j] = list(batch[:i])
+                    batches[j] = None
+                data[j].append(source_example)
+            num_examples += 1
+        return tuple(
+            batch[:num_examples] if batch is not None
+            else numpy.asarray(source_data)
+            for batch, source_data in zip(batches, data))
+
+    def _get_unpacked_data(self, request):
+        """Re-batch the examples of an :class:`Unpack` data stream.
+
+        Slices are taken directly from the batches the unpacked stream
+        holds, so no tuple is created for individual examples.
+
+        """
+        pieces = [[] for _ in self.sources]
+        num_examples = 0
+        while num_examples < request:
+            try:
+                slices = self.data_stream.get_slices(request - num_examples)
+            except StopIteration:
+                if not self.strictness and num_examples:
+                    break
+                elif self.strictness > 1 and num_examples:
+                    raise ValueError
+                raise
+            for source_pieces, source_slice in zip(pieces, slices):
+                source_pieces.append(source_slice)
+            num_examples += len(slices[0])
+        return tuple(self._join(source_pieces) for source_pieces in pieces)
+
+    @staticmethod
+    def _join(pieces):
+        if all(isinstance(piece, numpy.ndarray) for piece in pieces):
+            try:
+                return numpy.concatenate(pieces)
+            except ValueError:
+                pass
+        return numpy.asarray([example for piece in pieces
+                              for example in piece])
 
 
 class Unpack(Transformer):
@@ -623,6 +923,12 @@ class Unpack(Transformer):
     data_stream : :class:`AbstractDataStream` instance
         The data stream to unpack
 
+    Notes
+    -----
+    A :class:`Batch` wrapping this stream takes slices of the unpacked
+    batches through :meth:`get_slices` instead of collecting the examples
+    one by one.
+
     """
     def __init__(self, data_stream, **kwargs):
         if data_stream.produces_examples:
@@ -636,18 +942,50 @@ class Unpack(Transformer):
         super(Unpack, self).__init__(
             data_stream, produces_examples=True, **kwargs)
         self.data = None
+        self.cursor = 0
+        self.size = 0
+
+    def _next_batch(self):
+        while self.data is None or self.cursor == self.size:
+            self.data = next(self.child_epoch_iterator)
+            self.cursor = 0
+            self.size = min(len(source_data) for source_data in self.data)
 
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
-        if not self.data:
-            data = next(self.child_epoch_iterator)
-            self.data = izip(*data)
-        try:
-            return next(self.data)
-        except StopIteration:
-            self.data = None
-            return self.get_data()
+        self._next_batch()
+        example = tuple(source_data[self.cursor]
+                        for source_data in self.data)
+        self.cursor += 1
+        return example
+
+    def get_slices(self, num_examples):
+        """Return the next examples as slices of the current batch.
+
+        Parameters
+        ----------
+        num_examples : int
+            The maximum number of examples to return. Fewer are returned
+            if the current batch runs out.
+
+        Returns
+        -------
+        tuple
+            For each source, a slice of the current batch.
+
+        Raises
+        ------
+        StopIteration
+            When the wrapped data stream is exhausted.
+
+        """
+        self._next_batch()
+        stop = min(self.cursor + num_examples, self.size)
+        slices = tuple(source_data[self.cursor:stop]
+                       for source_data in self.data)
+        self.cursor = stop
+        return slices
 
 
 class Padding(Transformer):
@@ -673,10 +1011,19 @@ class Padding(Transformer):
     mask_dtype: str, optional
         data type of masks. If not provided, floatX from config will
         be used.
+    length_multiple : int, optional
+        If given, the padded length is rounded up to a multiple of this
+        number, which reduces the number of different shapes of the
+        batches. By default batches are padded to their longest sequence.
+    reuse_buffers : bool, optional
+        If `True`, the padded batches and masks are written into buffers
+        that are reused for each batch, instead of being allocated anew.
+        The arrays returned are then overwritten by the next batch, so
+        they must be copied if they are to be kept. Defaults to `False`.
 
     """
     def __init__(self, data_stream, mask_sources=None, mask_dtype=None,
-                 **kwargs):
+                 length_multiple=None, reuse_buffers=False, **kwargs):
         if data_stream.produces_examples:
             raise ValueError('the wrapped data stream must produce batches of '
                              'examples, not examples')
@@ -689,6 +1036,25 @@ class Padding(Transformer):
             self.mask_dtype = config.floatX
         else:
             self.mask_dtype = mask_dtype
+        if length_multiple is not None and length_multiple < 1:
+            raise ValueError('length_multiple must be a positive integer')
+        self.length_multiple = length_multiple
+        self.reuse_buffers = reuse_buffers
+        self._buffers = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = {}
+        return state
+
+    def _get_buffer(self, name, shape, dtype):
+        size = int(numpy.prod(shape))
+        buffer_ = self._buffers.get(name)
+        if (buffer_ is None or buffer_.dtype != dtype or
+                buffer_.size < size):
+            buffer_ = numpy.empty(size, dtype=dtype)
+            self._buffers[name] = buffer_
+        return buffer_[:size].reshape(shape)
 
     @property
     def sources(self):
@@ -707,26 +1073,32 @@ class Padding(Transformer):
                 batch_with_masks.append(source_batch)
                 continue
 
-            shapes = [numpy.asarray(sample).shape for sample in source_batch]
-            lengths = [shape[0] for shape in shapes]
-            max_sequence_length = max(lengths)
-            rest_shape = shapes[0][1:]
-            if not all([shape[1:] == rest_shape for shape in shapes]):
+            samples = [numpy.asarray(sample) for sample in source_batch]
+            lengths = numpy.array([sample.shape[0] for sample in samples])
+            rest_shape = samples[0].shape[1:]
+            if not all(sample.shape[1:] == rest_shape for sample in samples):
                 raise ValueError("All dimensions except length must be equal")
-            dtype = numpy.asarray(source_batch[0]).dtype
-
-            padded_batch = numpy.zeros(
-                (len(source_batch), max_sequence_length) + rest_shape,
-                dtype=dtype)
-            for i, sample in enumerate(source_batch):
-                padded_batch[i, :len(sample)] = sample
+            dtype = samples[0].dtype
+            max_sequence_length = lengths.max()
+            if self.length_multiple:
+                max_sequence_length = (-(-max_sequence_length //
+                                         self.length_multiple) *
+                                       self.length_multiple)
+
+            mask = numpy.arange(max_sequence_length) < lengths[:, None]
+            shape = (len(samples), max_sequence_length) + rest_shape
+            if self.reuse_buffers:
+                padded_batch = self._get_buffer(source, shape, dtype)
+                padded_batch[~mask] = 0
+                mask_batch = self._get_buffer(source + '_mask', mask.shape,
+                                              self.mask_dtype)
+                mask_batch[...] = mask
+            else:
+                padded_batch = numpy.zeros(shape, dtype=dtype)
+                mask_batch = mask.astype(self.mask_dtype)
+            padded_batch[mask] = numpy.concatenate(samples)
             batch_with_masks.append(padded_batch)
-
-            mask = numpy.zeros((len(source_batch), max_sequence_length),
-                               self.mask_dtype)
-            for i, sequence_length in enumerate(lengths):
-                mask[i, :sequence_length] = 1
-            batch_with_masks.append(mask)
+            batch_with_masks.append(mask_batch)
         return tuple(batch_with_masks)
 
 
@@ -812,22 +1184,254 @@ class BackgroundProcess(object):
     max_batches : int
         The maximum number of batches to store in the queue. If reached,
         the process wil block until a batch is popped from the queue.
+    ring : :class:`~fuel.utils.parallel.SharedMemoryRing`, optional
+        If given, batches are passed through this shared memory instead
+        of being pickled.
 
     """
-    def __init__(self, data_stream, max_batches):
+    def __init__(self, data_stream, max_batches, ring=None):
         self.data_stream = data_stream
         self.batches = Queue(max_batches)
+        self.ring = ring
         self.run_background = True
 
     def main(self):
         while True:
             iterator = self.data_stream.get_epoch_iterator()
             for batch in iterator:
+                if self.ring is not None:
+                    batch = self.ring.write(batch)
                 self.batches.put(batch)
             self.batches.put(StopIteration)
 
     def get_next_data(self):
-        return self.batches.get()
+        batch = self.batches.get()
+        if self.ring is not None and batch is not StopIteration:
+            batch = self.ring.read(batch)
+        return batch
+
+
+def _find_request_stream(data_stream):
+    """Find the data stream whose iteration scheme drives a chain.
+
+    Parameters
+    ----------
+    data_stream : :class:`.DataStream` or :class:`Transformer`
+        The outermost data stream of the chain.
+
+    Returns
+    -------
+    :class:`.DataStream`
+        The innermost data stream of the chain, i.e. the one that is
+        queried with the requests of its iteration scheme.
+
+    Raises
+    ------
+    ValueError
+        If the innermost data stream has no iteration scheme, or if any
+        of the transformers wrapping it has an iteration scheme of its
+        own (e.g. :class:`Batch` or :class:`Cache`).
+
+    """
+    stream = data_stream
+    while hasattr(stream, 'data_stream'):
+        if stream.iteration_scheme is not None:
+            raise ValueError('{} instance has an iteration scheme of its '
+                             'own; requests must come from the innermost '
+                             'data stream'.format(stream.__class__.__name__))
+        stream = stream.data_stream
+    if getattr(stream, 'iteration_scheme', None) is None:
+        raise ValueError('the innermost data stream must have an iteration '
+                         'scheme')
+    return stream
+
+
+class _RequestFeed(six.Iterator):
+    """An iterator over requests that are pushed into it one at a time."""
+    def __init__(self):
+        self.requests = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.requests:
+            raise StopIteration
+        return self.requests.popleft()
+
+
+class _FeedScheme(IterationScheme):
+    """An iteration scheme whose requests are fed by a :class:`_RequestFeed`.
+
+    Used by the worker processes of :class:`BackgroundWorkers` to replace
+    the iteration scheme of the innermost data stream, so that requests
+    can be sent to them by the main process.
+
+    """
+    def __init__(self, feed, requests_examples):
+        self.feed = feed
+        self.requests_examples = requests_examples
+
+    def get_request_iterator(self):
+        return self.feed
+
+
+class BackgroundWorkers(object):
+    """A pool of processes that each process requests of a data stream.
+
+    The main process reads requests from the iteration scheme of the
+    innermost data stream and dispatches them to the workers. Every
+    worker holds a copy of the data stream and runs the complete chain of
+    transformers on the requests it receives.
+
+    Parameters
+    ----------
+    data_stream : :class:`.DataStream` or :class:`Transformer`
+        The data stream to read batches from. See :class:`MultiProcessing`
+        for the restrictions on this stream.
+    num_workers : int
+        The number of worker processes to start.
+    max_batches : int
+        The maximum number of requests that are being processed or whose
+        results haven't been returned yet.
+    ordered : bool
+        If `True`, batches are returned in the order of the requests.
+        Otherwise they are returned as soon as they are ready.
+    ring : :class:`~fuel.utils.parallel.SharedMemoryRing`, optional
+        If given, batches are passed through this shared memory instead
+        of being pickled.
+
+    """
+    def __init__(self, data_stream, num_workers, max_batches, ordered,
+                 ring=None):
+        self.data_stream = data_stream
+        self.ring = ring
+        self.request_stream = _find_request_stream(data_stream)
+        self.num_workers = num_workers
+        self.max_batches = max_batches
+        self.ordered = ordered
+        self.tasks = Queue()
+        self.results = Queue()
+        self.processes = []
+        self.epoch = 0
+        self.in_flight = 0
+        self.request_iterator = None
+
+    def start(self):
+        for i in range(self.num_workers):
+            process = Process(target=self.main, args=(i,))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def terminate(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+    def main(self, worker_id):
+        feed = _RequestFeed()
+        self.request_stream.iteration_scheme = _FeedScheme(
+            feed, self.request_stream.iteration_scheme.requests_examples)
+        reseed_streams(self.data_stream, worker_id)
+        iterator = self.data_stream.get_epoch_iterator()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            epoch, index, request = task
+            feed.requests.append(request)
+            try:
+                data = next(iterator)
+            except StopIteration:
+                feed.requests.clear()
+                iterator = self.data_stream.get_epoch_iterator()
+                error = ('the data stream did not return any data for '
+                         'request {}; each request must produce exactly '
+                         'one batch or example'.format(request))
+                self.results.put((epoch, index, None, error))
+            except Exception:
+                feed.requests.clear()
+                iterator = self.data_stream.get_epoch_iterator()
+                self.results.put((epoch, index, None,
+                                  traceback.format_exc()))
+            else:
+                if self.ring is not None:
+                    data = self.ring.write(data)
+                self.results.put((epoch, index, data, None))
+
+    def next_epoch(self):
+        """Start dispatching the requests of a new epoch."""
+        if self.ring is not None and self.request_iterator is not None:
+            ready = (self.ready.values() if self.ordered else self.ready)
+            for data in ready:
+                self.ring.discard(data)
+        self.epoch += 1
+        self.request_iterator = (
+            self.request_stream.iteration_scheme.get_request_iterator())
+        self.dispatched = 0
+        self.returned = 0
+        self.exhausted = False
+        self.ready = {} if self.ordered else deque()
+        self._dispatch()
+
+    def _dispatch(self):
+        while (not self.exhausted and
+               self.in_flight + len(self.ready) < self.max_batches):
+            try:
+                request = next(self.request_iterator)
+            except StopIteration:
+                self.exhausted = True
+                break
+            self.tasks.put((self.epoch, self.dispatched, request))
+            self.dispatched += 1
+            self.in_flight += 1
+
+    def _get_result(self):
+        """Wait for a result, raising an error if a worker has died."""
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except Empty:
+                for i, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        raise RuntimeError(
+                            'worker process {} died with exit code {}'
+                            .format(i, process.exitcode))
+
+    def get_next_data(self):
+        while True:
+            if self.ordered and self.returned in self.ready:
+                data = self.ready.pop(self.returned)
+                break
+            elif not self.ordered and self.ready:
+                data = self.ready.popleft()
+                break
+            elif self.exhausted and self.returned == self.dispatched:
+                raise StopIteration
+            epoch, index, data, error = self._get_result()
+            self.in_flight -= 1
+            if epoch != self.epoch:
+                if self.ring is not None and error is None:
+                    self.ring.discard(data)
+            elif error is not None:
+                raise RuntimeError(
+                    'worker process raised an exception for request '
+                    '{}:\n{}'.format(index, error))
+            elif self.ordered:
+                self.ready[index] = data
+            else:
+                self.ready.append(data)
+            self._dispatch()
+        self.returned += 1
+        self._dispatch()
+        if self.ring is not None:
+            data = self.ring.read(data)
+        return data
 
 
 class MultiProcessing(Transformer):
@@ -844,6 +1448,25 @@ class MultiProcessing(Transformer):
         The data stream to read batches from in the separate process.
     max_store : int, optional
         The maximum number of batches to keep in the queue.
+    num_workers : int, optional
+        If given, start this many worker processes instead of a single
+        background process. The requests of the innermost data stream's
+        iteration scheme are distributed over the workers, which each run
+        the complete chain of transformers. Defaults to `None`.
+    ordered : bool, optional
+        Only used when `num_workers` is given. If `True` (default), the
+        batches are returned in the order in which they were requested.
+        If `False`, they are returned as soon as a worker is done with
+        them, which lowers latency when processing times vary.
+    shared_memory : dict, optional
+        If given, batches are passed to the main process through shared
+        memory instead of being pickled. Maps source names to ``(shape,
+        dtype)`` tuples giving the maximum shape and the dtype of the
+        arrays of that source. Room for ``max_store + 1`` batches is
+        preallocated. Sources that aren't listed, and arrays that don't
+        fit, are pickled as usual. The arrays returned are views on the
+        shared memory that are overwritten once the next batch is
+        requested, so they need to be copied if they are to be kept.
 
     Notes
     -----
@@ -853,25 +1476,66 @@ class MultiProcessing(Transformer):
     batch of data does, but for fast models or slow data pipelines a more
     robust approach might need to be considered.
 
+    When using multiple workers, the innermost data stream must be a
+    :class:`.DataStream` with an iteration scheme, and none of the
+    transformers wrapping it can have an iteration scheme of its own. Each
+    transformer in the chain must return exactly one batch (or example)
+    per request it receives, as is the case for e.g. :class:`Mapping` and
+    sourcewise transformers. Random number generators stored as the `rng`
+    attribute of streams in the chain are reseeded differently in each
+    worker.
+
     """
-    def __init__(self, data_stream, max_store=100, **kwargs):
+    def __init__(self, data_stream, max_store=100, num_workers=None,
+                 ordered=True, shared_memory=None, **kwargs):
         if data_stream.axis_labels:
             kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
         super(MultiProcessing, self).__init__(
             data_stream, data_stream.produces_examples, **kwargs)
-        self.background = BackgroundProcess(data_stream, max_store)
-        self.proc = Process(target=self.background.main)
-        self.proc.daemon = True
-        self.proc.start()
+        ring = None
+        if shared_memory is not None:
+            unknown = set(shared_memory) - set(data_stream.sources)
+            if unknown:
+                raise ValueError('unknown sources in shared_memory: {}'
+                                 .format(', '.join(sorted(unknown))))
+            ring = SharedMemoryRing(
+                [shared_memory.get(source) for source in data_stream.sources],
+                max_store + 1)
+        if num_workers is None:
+            self.background = BackgroundProcess(data_stream, max_store, ring)
+            self.proc = Process(target=self.background.main)
+            self.proc.daemon = True
+            self.proc.start()
+        else:
+            if num_workers < 1:
+                raise ValueError('num_workers must be a positive integer')
+            self.background = BackgroundWorkers(
+                data_stream, num_workers, max_store, ordered, ring)
+            self.background.start()
+        self.num_workers = num_workers
+
+    def get_epoch_iterator(self, **kwargs):
+        if self.num_workers is not None:
+            self.background.next_epoch()
+        return super(MultiProcessing, self).get_epoch_iterator(**kwargs)
 
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
+        if self.profile is not None:
+            start = default_timer()
         data = self.background.get_next_data()
+        if self.profile is not None:
+            self.profile.wait_time += default_timer() - start
         if data == StopIteration:
             raise StopIteration
         return data
 
+    def close(self):
+        if self.num_workers is not None:
+            self.background.terminate()
+        super(MultiProcessing, self).close()
+
 
 class Rename(AgnosticTransformer):
     """Renames the sources of the stream.
@@ -988,36 +1652,88 @@ class OneHotEncoding(SourcewiseTransformer):
         The data stream.
     num_classes : int
         The number of classes.
+    output_format : str, optional
+        One of 'dense' (default), 'sparse' or 'indices'. 'sparse' returns
+        a :class:`scipy.sparse.csr_matrix` of shape (N, num_classes)
+        instead of a dense array. 'indices' only validates the targets and
+        returns them as integers, for consumers that do an embedding
+        lookup themselves.
+
+    Notes
+    -----
+    Targets can be of any integer, unsigned, boolean or floating point
+    dtype, as long as their values are integral. Negative targets and
+    targets not lower than `num_classes` raise a :class:`ValueError`.
 
     """
-    def __init__(self, data_stream, num_classes, **kwargs):
+    output_formats = ('dense', 'sparse', 'indices')
+
+    def __init__(self, data_stream, num_classes, output_format='dense',
+                 **kwargs):
+        if output_format not in self.output_formats:
+            raise ValueError("output_format must be one of {}"
+                             .format(', '.join(self.output_formats)))
         if data_stream.axis_labels:
             kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
         super(OneHotEncoding, self).__init__(
             data_stream, data_stream.produces_examples, **kwargs)
         self.num_classes = num_classes
+        self.output_format = output_format
 
-    def transform_source_example(self, source_example, source_name):
-        if source_example >= self.num_classes:
-            raise ValueError("source_example ({}) must be lower than "
-                             "num_classes ({})".format(source_example,
-                                                       self.num_classes))
-        output = numpy.zeros((1, self.num_classes))
-        output[0, source_example] = 1
+    def _validate(self, labels):
+        """Check that all labels are valid class indices.
+
+        Returns the labels as an integer array.
+
+        """
+        labels = numpy.asarray(labels)
+        if labels.dtype.kind == 'f':
+            integral = labels.astype(numpy.int64)
+            if not numpy.array_equal(integral, labels):
+                raise ValueError("targets must have integral values")
+            labels = integral
+        elif labels.dtype.kind == 'b':
+            labels = labels.view(numpy.uint8)
+        elif labels.dtype.kind not in 'iu':
+            raise ValueError("targets are of unusable input datatype {}"
+                             .format(labels.dtype))
+        if labels.size:
+            invalid = None
+            if labels.dtype.kind == 'i' and labels.min() < 0:
+                invalid = labels.min()
+            elif labels.max() >= self.num_classes:
+                invalid = labels.max()
+            if invalid is not None:
+                raise ValueError("all targets must be non-negative and "
+                                 "lower than num_classes ({}), found {}"
+                                 .format(self.num_classes, invalid))
+        return labels
+
+    def _encode(self, labels, dtype):
+        num_examples = len(labels)
+        if self.output_format == 'sparse':
+            return scipy.sparse.csr_matrix(
+                (numpy.ones(num_examples, dtype=dtype), labels,
+                 numpy.arange(num_examples + 1)),
+                shape=(num_examples, self.num_classes))
+        output = numpy.zeros((num_examples, self.num_classes), dtype=dtype)
+        output[numpy.arange(num_examples), labels] = 1
         return output
 
+    def transform_source_example(self, source_example, source_name):
+        labels = self._validate(source_example)
+        if self.output_format == 'indices':
+            return labels
+        return self._encode(labels.reshape((1,)), numpy.float64)
+
     def transform_source_batch(self, source_batch, source_name):
-        if numpy.max(source_batch) >= self.num_classes:
-            raise ValueError("all entries in source_batch must be lower than "
-                             "num_classes ({})".format(self.num_classes))
-        output = numpy.zeros((source_batch.shape[0], self.num_classes),
-                             dtype=source_batch.dtype)
+        labels = self._validate(source_batch)
+        if self.output_format == 'indices':
+            return labels
         # if batch is of shape N x 1
-        if source_batch.ndim == 2 and source_batch.shape[1] == 1:
-            source_batch = source_batch[:, 0]
-        for i in range(self.num_classes):
-            output[source_batch == i, i] = 1
-        return output
+        if labels.ndim == 2 and labels.shape[1] == 1:
+            labels = labels[:, 0]
+        return self._encode(labels, source_batch.dtype)
 
 
 class OneHotEncodingND(OneHotEncoding):
@@ -1032,53 +1748,46 @@ class OneHotEncodingND(OneHotEncoding):
         The data stream.
     num_classes : int
         The number of classes.
+    output_format : str, optional
+        Either 'dense' (default) or 'indices', see :class:`OneHotEncoding`.
     which_sources : tuple of str
         Which sources to apply the one hot encoding.
 
     """
+    output_formats = ('dense', 'indices')
+
+    def _encode_channels(self, labels, num_examples, dtype):
+        """Scatter labels of shape (N, ...) into an (N, C, ...) array."""
+        output = numpy.zeros((num_examples, self.num_classes) +
+                             labels.shape[1:], dtype=dtype)
+        flat_labels = labels.reshape((num_examples, -1))
+        output.reshape((num_examples, self.num_classes, -1))[
+            numpy.arange(num_examples)[:, None], flat_labels,
+            numpy.arange(flat_labels.shape[1])] = 1
+        return output
+
     def transform_source_example(self, source_example, source_name):
-        if source_example.max() >= self.num_classes:
-            raise ValueError("source_example must be lower than num_classes "
-                             "({})".format(self.num_classes))
-        if source_example.shape[0] != 1:
+        labels = self._validate(source_example)
+        if self.output_format == 'indices':
+            return labels
+        if labels.shape[0] != 1:
             warnings.warn("source_example has no channel dimension.")
-            source_example = numpy.expand_dims(source_example, axis=1)
-        output = numpy.zeros([self.num_classes] +
-                             list(source_example.shape[1:]),
-                             dtype=source_example.dtype)
-        if len(source_example.shape) > 1:
-            for i in range(self.num_classes):
-                output[i, source_example[0] == i] = 1
-        else:
-            output[source_example[0]] = 1
-        return output
+            labels = labels[None]
+        return self._encode_channels(labels, 1, source_example.dtype)[0]
 
     def transform_source_batch(self, source_batch, source_name):
-        if issubclass(source_batch.dtype.type, numpy.number):
-            if numpy.max(source_batch) >= self.num_classes:
-                raise ValueError("all entries in source_batch must be lower "
-                                 "than num_classes ({}), found {}"
-                                 .format(self.num_classes,
-                                         numpy.max(source_batch)))
-            if source_batch.shape[1] != 1:
-                warnings.warn("source_example has no channel dimension.")
-                source_batch = numpy.expand_dims(source_batch, axis=1)
-                output = numpy.zeros(
-                    [source_batch.shape[0], self.num_classes] +
-                    list(source_batch.shape[2:]), dtype=source_batch.dtype)
-
-            for i in range(self.num_classes):
-                # Set the output of channel i to be the output of the
-                # indicator function: is source_batch of class i?
-                output[:, i][source_batch[:, 0] == i] = 1
-            return output
-        elif source_batch.dtype == numpy.object:
+        if source_batch.dtype == numpy.object:
             return numpy.array([self.transform_source_example(example,
                                                               source_name)
                                 for example in source_batch])
-        else:
-            raise ValueError("source_batch is of unusable input datatype {}"
-                             .format(source_batch.dtype))
+        labels = self._validate(source_batch)
+        if self.output_format == 'indices':
+            return labels
+        if labels.shape[1] != 1:
+            warnings.warn("source_example has no channel dimension.")
+            labels = labels[:, None]
+        return self._encode_channels(labels[:, 0], len(labels),
+                                     source_batch.dtype)
 
 
 class Duplicate(Transformer):
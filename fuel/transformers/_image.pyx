@@ -1,5 +1,6 @@
 cimport cython
 from cython.parallel cimport prange
+from libc.math cimport cos, sin, floor
 
 
 ctypedef long Py_intptr_t
@@ -118,3 +119,227 @@ cpdef window_batch_bchw3d(image_dtype[:, :, :, :, :] batch,
             out[index] = batch[index, :, x_off:x_extent,
                                          y_off:y_extent,
                                          z_off:z_extent]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _sample(image_dtype[:, :, :, :] batch, Py_intptr_t index,
+                           Py_intptr_t channel, Py_intptr_t y,
+                           Py_intptr_t x) nogil:
+    if 0 <= y < batch.shape[2] and 0 <= x < batch.shape[3]:
+        return batch[index, channel, y, x]
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef rotate_batch_bchw(image_dtype[:, :, :, :] batch, double[:] angles,
+                        image_dtype[:, :, :, :] out, bint bilinear=False):
+    """rotate_batch_bchw(batch, angles, out, bilinear=False)
+
+    Rotate each image of a (batch, channels, height, width) tensor.
+
+    Parameters
+    ----------
+    batch : memoryview, 4-dimensional
+        A 4-d tensor containing a batch of images in the expected
+        format above.
+    angles : memoryview, double, 1-dimensional
+        The counter-clockwise rotation of each image around its center,
+        in radians. Assumed that batch.shape[0] <= angles.shape[0].
+    out : memoryview
+        The array to which to write output, of the same shape as `batch`.
+        Pixels that fall outside of the rotated image are set to zero.
+    bilinear : bool, optional
+        If `True`, use bilinear interpolation, otherwise use the nearest
+        neighbour. Defaults to `False`.
+
+    Notes
+    -----
+    Pixel centers are mapped in the same way as PIL's `Image.rotate`,
+    so that nearest neighbour resampling gives the same results.
+
+    Operates on a batch in parallel via OpenMP. Set `OMP_NUM_THREADS`
+    to benefit from this parallelism.
+
+    This is a low-level utility that, for the sake of speed, does
+    not check its input for validity. Some amount of protection is
+    provided by Cython memoryview objects.
+
+    """
+    cdef Py_intptr_t index, channel, x, y, x_in, y_in
+    cdef Py_intptr_t height = batch.shape[2]
+    cdef Py_intptr_t width = batch.shape[3]
+    cdef double center_x = width / 2.0
+    cdef double center_y = height / 2.0
+    cdef double cos_angle, sin_angle, x_src, y_src, dx, dy, value
+    with nogil:
+        for index in prange(batch.shape[0]):
+            cos_angle = cos(angles[index])
+            sin_angle = sin(angles[index])
+            for y in range(height):
+                for x in range(width):
+                    # Map the center of the output pixel back to the input
+                    dx = x + 0.5 - center_x
+                    dy = y + 0.5 - center_y
+                    x_src = cos_angle * dx - sin_angle * dy + center_x
+                    y_src = sin_angle * dx + cos_angle * dy + center_y
+                    if not bilinear:
+                        x_in = <Py_intptr_t>floor(x_src)
+                        y_in = <Py_intptr_t>floor(y_src)
+                        for channel in range(batch.shape[1]):
+                            out[index, channel, y, x] = <image_dtype>_sample(
+                                batch, index, channel, y_in, x_in)
+                        continue
+                    x_src = x_src - 0.5
+                    y_src = y_src - 0.5
+                    x_in = <Py_intptr_t>floor(x_src)
+                    y_in = <Py_intptr_t>floor(y_src)
+                    dx = x_src - x_in
+                    dy = y_src - y_in
+                    for channel in range(batch.shape[1]):
+                        value = (
+                            (1 - dy) * ((1 - dx) * _sample(batch, index,
+                                                           channel, y_in,
+                                                           x_in) +
+                                        dx * _sample(batch, index, channel,
+                                                     y_in, x_in + 1)) +
+                            dy * ((1 - dx) * _sample(batch, index, channel,
+                                                     y_in + 1, x_in) +
+                                  dx * _sample(batch, index, channel,
+                                               y_in + 1, x_in + 1)))
+                        if image_dtype is cython.uchar:
+                            value = value + 0.5
+                        out[index, channel, y, x] = <image_dtype>value
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _sample_window(image_dtype[:, :, :, :] batch,
+                                  Py_intptr_t index, Py_intptr_t channel,
+                                  Py_intptr_t y, Py_intptr_t x,
+                                  Py_intptr_t height, Py_intptr_t width,
+                                  Py_intptr_t h_off, Py_intptr_t w_off,
+                                  bint flip_h, bint flip_v) nogil:
+    if not (0 <= y < height and 0 <= x < width):
+        return 0
+    if flip_h:
+        x = width - 1 - x
+    if flip_v:
+        y = height - 1 - y
+    return batch[index, channel, h_off + y, w_off + x]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef augment_batch_bchw(image_dtype[:, :, :, :] batch,
+                         long[:] height_offsets, long[:] width_offsets,
+                         unsigned char[:] flip_h, unsigned char[:] flip_v,
+                         double[:] angles, image_dtype[:, :, :, :] out,
+                         bint bilinear=False):
+    """augment_batch_bchw(batch, height_offsets, width_offsets, flip_h,
+                          flip_v, angles, out, bilinear=False)
+
+    Crop, flip and rotate a (batch, channels, height, width) tensor.
+
+    The result is the same as windowing the batch with
+    :func:`window_batch_bchw`, flipping the windows and rotating them
+    with :func:`rotate_batch_bchw`, but every output pixel is computed
+    directly from the input in a single pass.
+
+    Parameters
+    ----------
+    batch : memoryview, 4-dimensional
+        A 4-d tensor containing a batch of images in the expected
+        format above.
+    height_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the height dimension of each image.
+    width_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the width dimension of each image.
+    flip_h : memoryview, uint8, 1-dimensional
+        Whether to flip each window horizontally.
+    flip_v : memoryview, uint8, 1-dimensional
+        Whether to flip each window vertically.
+    angles : memoryview, double, 1-dimensional
+        The counter-clockwise rotation of each window around its center,
+        in radians.
+    out : memoryview
+        The array to which to write output. Its height and width are the
+        size of the window. It is assumed that
+        `out.shape[2] + height_offsets[i] <= batch.shape[2]` and
+        `out.shape[3] + width_offsets[i] <= batch.shape[3]`, for
+        all values of `i`.
+    bilinear : bool, optional
+        If `True`, use bilinear interpolation when rotating, otherwise use
+        the nearest neighbour. Defaults to `False`.
+
+    Notes
+    -----
+    Operates on a batch in parallel via OpenMP. Set `OMP_NUM_THREADS`
+    to benefit from this parallelism.
+
+    This is a low-level utility that, for the sake of speed, does
+    not check its input for validity. Some amount of protection is
+    provided by Cython memoryview objects.
+
+    """
+    cdef Py_intptr_t index, channel, x, y, x_in, y_in, h_off, w_off
+    cdef Py_intptr_t height = out.shape[2]
+    cdef Py_intptr_t width = out.shape[3]
+    cdef double center_x = width / 2.0
+    cdef double center_y = height / 2.0
+    cdef double cos_angle, sin_angle, x_src, y_src, dx, dy, value
+    cdef bint h, v
+    with nogil:
+        for index in prange(batch.shape[0]):
+            h_off = height_offsets[index]
+            w_off = width_offsets[index]
+            h = flip_h[index]
+            v = flip_v[index]
+            cos_angle = cos(angles[index])
+            sin_angle = sin(angles[index])
+            for y in range(height):
+                for x in range(width):
+                    dx = x + 0.5 - center_x
+                    dy = y + 0.5 - center_y
+                    x_src = cos_angle * dx - sin_angle * dy + center_x
+                    y_src = sin_angle * dx + cos_angle * dy + center_y
+                    if not bilinear:
+                        x_in = <Py_intptr_t>floor(x_src)
+                        y_in = <Py_intptr_t>floor(y_src)
+                        for channel in range(batch.shape[1]):
+                            out[index, channel, y, x] = (
+                                <image_dtype>_sample_window(
+                                    batch, index, channel, y_in, x_in,
+                                    height, width, h_off, w_off, h, v))
+                        continue
+                    x_src = x_src - 0.5
+                    y_src = y_src - 0.5
+                    x_in = <Py_intptr_t>floor(x_src)
+                    y_in = <Py_intptr_t>floor(y_src)
+                    dx = x_src - x_in
+                    dy = y_src - y_in
+                    for channel in range(batch.shape[1]):
+                        value = (
+                            (1 - dy) * (
+                                (1 - dx) * _sample_window(
+                                    batch, index, channel, y_in, x_in,
+                                    height, width, h_off, w_off, h, v) +
+                                dx * _sample_window(
+                                    batch, index, channel, y_in, x_in + 1,
+                                    height, width, h_off, w_off, h, v)) +
+                            dy * (
+                                (1 - dx) * _sample_window(
+                                    batch, index, channel, y_in + 1, x_in,
+                                    height, width, h_off, w_off, h, v) +
+                                dx * _sample_window(
+                                    batch, index, channel, y_in + 1,
+                                    x_in + 1, height, width, h_off, w_off,
+                                    h, v)))
+                        if image_dtype is cython.uchar:
+                            value = value + 0.5
+                        out[index, channel, y, x] = <image_dtype>value
@@ -1,6 +1,7 @@
 from __future__ import division
 from io import BytesIO
 import math
+from multiprocessing.pool import ThreadPool
 
 import numpy
 import scipy.ndimage
@@ -12,6 +13,11 @@ try:
     window_batch_bchw_available = True
 except ImportError:
     window_batch_bchw_available = False
+try:
+    from ._image import rotate_batch_bchw, augment_batch_bchw
+    rotate_batch_bchw_available = True
+except ImportError:
+    rotate_batch_bchw_available = False
 
 from . import ExpectsAxisLabels, SourcewiseTransformer, Transformer
 
@@ -31,6 +37,17 @@ class ImagesFromBytes(SourcewiseTransformer):
     color_mode : str, optional
         Mode to pass to PIL for color space conversion. Default is RGB.
         If `None`, no coercion is performed.
+    num_threads : int, optional
+        If given, the images of a batch are decoded in parallel by a pool
+        of this many threads. PIL releases the GIL while decoding, so this
+        speeds up decoding on multi-core machines. By default images are
+        decoded serially.
+    stack : bool, optional
+        If `True`, batches of images that all have the same shape are
+        decoded into a single preallocated array of shape
+        `(batch, channel, height, width)` instead of a list of arrays.
+        Batches of images of different shapes are still returned as
+        lists. Defaults to `False`.
 
     Notes
     -----
@@ -45,10 +62,13 @@ class ImagesFromBytes(SourcewiseTransformer):
     This SourcewiseTransformer supports streams returning single examples
     as `bytes` objects (`str` on legacy Python) as well as streams that
     return iterables containing such objects. In the case of an iterable, a
-    list of loaded images is returned.
+    list of loaded images is returned, unless `stack` is set.
 
     """
-    def __init__(self, data_stream, color_mode='RGB', **kwargs):
+    def __init__(self, data_stream, color_mode='RGB', num_threads=None,
+                 stack=False, **kwargs):
+        if num_threads is not None and num_threads < 1:
+            raise ValueError('num_threads must be positive')
         kwargs.setdefault('produces_examples', data_stream.produces_examples)
         # Acrobatics currently required to correctly set axis labels.
         which_sources = kwargs.get('which_sources', data_stream.sources)
@@ -57,6 +77,27 @@ class ImagesFromBytes(SourcewiseTransformer):
         kwargs.setdefault('axis_labels', axis_labels)
         super(ImagesFromBytes, self).__init__(data_stream, **kwargs)
         self.color_mode = color_mode
+        self.num_threads = num_threads
+        self.stack = stack
+        self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        super(ImagesFromBytes, self).close()
+
+    def _map(self, function, iterable):
+        if self.num_threads is None:
+            return [function(item) for item in iterable]
+        if self.pool is None:
+            self.pool = ThreadPool(self.num_threads)
+        return self.pool.map(function, iterable)
 
     def transform_source_example(self, example, source_name):
         if PY3:
@@ -80,7 +121,25 @@ class ImagesFromBytes(SourcewiseTransformer):
         return image
 
     def transform_source_batch(self, batch, source_name):
-        return [self.transform_source_example(im, source_name) for im in batch]
+        if not self.stack or not len(batch):
+            return self._map(
+                lambda im: self.transform_source_example(im, source_name),
+                batch)
+        first = self.transform_source_example(batch[0], source_name)
+        output = numpy.empty((len(batch),) + first.shape, dtype=first.dtype)
+        output[0] = first
+
+        def decode_into(i):
+            image = self.transform_source_example(batch[i], source_name)
+            if image.shape != first.shape or image.dtype != first.dtype:
+                return image
+            output[i] = image
+
+        mismatches = self._map(decode_into, range(1, len(batch)))
+        if any(image is not None for image in mismatches):
+            return [first] + [output[i] if image is None else image
+                              for i, image in enumerate(mismatches, 1)]
+        return output
 
     def _make_axis_labels(self, data_stream, which_sources, produces_examples):
         # This is ugly and probably deserves a refactoring of how we handle
@@ -1085,7 +1144,17 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
     yielded by `data_stream` then lists will be yielded by this
     transformer.
 
+    Images of type `uint8`, `float32` or `float64` are rotated by a
+    compiled kernel when using 'nearest' or 'bilinear' resampling, which
+    handles a whole 4-dimensional batch at once. Other images are rotated
+    with PIL. The kernel's nearest neighbour resampling matches PIL's,
+    while its bilinear interpolation can differ slightly along the
+    borders of the image.
+
     """
+    kernel_dtypes = (numpy.dtype('uint8'), numpy.dtype('float32'),
+                     numpy.dtype('float64'))
+
     def __init__(self, data_stream, maximum_rotation=math.pi,
                  resample='nearest', **kwargs):
         if maximum_rotation <= 0 or maximum_rotation > math.pi:
@@ -1124,6 +1193,8 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
                 out[im_idx] = self._example_transform(im, angle)
             return out
         elif isinstance(source, numpy.ndarray) and source.ndim == 4:
+            if self._use_kernel(source):
+                return self._kernel_transform(source, rotation_angles)
             return numpy.array([self._example_transform(im, angle)
                                 for im, angle in zip(source, rotation_angles)],
                                dtype=source.dtype)
@@ -1143,7 +1214,24 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
                                           self.maximum_rotation)
         return self._example_transform(example, rotation_angle)
 
+    def _use_kernel(self, images):
+        return (rotate_batch_bchw_available and
+                self.resample in (Image.NEAREST, Image.BILINEAR) and
+                images.dtype in self.kernel_dtypes)
+
+    def _kernel_transform(self, batch, rotation_angles):
+        # The kernel can't take read-only buffers, e.g. the arrays received
+        # by a ServerDataStream or memory-mapped from a file
+        batch = numpy.require(batch, requirements='W')
+        out = numpy.empty_like(batch)
+        rotate_batch_bchw(batch, numpy.deg2rad(rotation_angles), out,
+                          self.resample == Image.BILINEAR)
+        return out
+
     def _example_transform(self, example, rotation_angle):
+        if self._use_kernel(example):
+            return self._kernel_transform(example[numpy.newaxis],
+                                          numpy.array([rotation_angle]))[0]
         dt = example.dtype
         if numpy.issubdtype(dt, numpy.float):
             example = numpy.stack([numpy.array(Image.fromarray(ch).
@@ -1158,6 +1246,145 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
             return example.transpose(2, 0, 1)
 
 
+class RandomCropFlipRotate(SourcewiseTransformer, ExpectsAxisLabels):
+    """Randomly crop, flip and rotate 2D images in a single pass.
+
+    Equivalent to chaining :class:`RandomFixedSizeCrop`,
+    :class:`RandomSpatialFlip` and :class:`Random2DRotation`, but each
+    output image is computed directly from its input by a compiled kernel,
+    instead of each of the three transformers making a pass over the
+    batch and allocating its own output.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream`
+        The data stream to wrap.
+    window_shape : tuple
+        The `(height, width)` tuple representing the size of the output
+        window.
+    flip_h : bool, optional
+        Whether to randomly flip images horizontally. Defaults to `False`.
+    flip_v : bool, optional
+        Whether to randomly flip images vertically. Defaults to `False`.
+    maximum_rotation : float, optional
+        Maximum amount of rotation in radians. The image will be rotated by
+        an angle in the range [-maximum_rotation, maximum_rotation]. Must
+        be in the range [0, math.pi]; defaults to 0, i.e. no rotation.
+    resample : str, optional
+        Resampling filter to use for rotations, either 'nearest' (default)
+        or 'bilinear'.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator from which the crop offsets, flips and
+        rotation angles are all drawn, in that order. Defaults to one
+        seeded with ``fuel.config.default_seed``.
+
+    Notes
+    -----
+    This transformer expects to act on stream sources which provide one of
+
+     * Single images represented as 3-dimensional ndarrays, with layout
+       `(channel, height, width)`.
+     * Batches of images represented as lists of 3-dimensional ndarrays,
+       possibly of different shapes (i.e. images of differing
+       heights/widths).
+     * Batches of images represented as 4-dimensional ndarrays, with
+       layout `(batch, channel, height, width)`.
+
+    Images must be of type `uint8`, `float32` or `float64`. The format of
+    the stream will be un-altered, i.e. if lists are yielded by
+    `data_stream` then lists will be yielded by this transformer.
+
+    """
+    def __init__(self, data_stream, window_shape, flip_h=False,
+                 flip_v=False, maximum_rotation=0, resample='nearest',
+                 **kwargs):
+        if not rotate_batch_bchw_available:
+            raise ImportError('augment_batch_bchw not compiled')
+        if maximum_rotation < 0 or maximum_rotation > math.pi:
+            raise ValueError('maximum_rotation ({:.5f}) must be in the range '
+                             '[0, math.pi]'.format(maximum_rotation))
+        if resample not in ('nearest', 'bilinear'):
+            raise ValueError("unknown resampling filter '{}'".format(resample))
+        self.window_shape = window_shape
+        self.flip_h = flip_h
+        self.flip_v = flip_v
+        self.maximum_rotation = maximum_rotation
+        self.resample = resample
+        self.rng = kwargs.pop('rng', None)
+        self.warned_axis_labels = False
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
+        kwargs.setdefault('produces_examples', data_stream.produces_examples)
+        kwargs.setdefault('axis_labels', data_stream.axis_labels)
+        super(RandomCropFlipRotate, self).__init__(data_stream, **kwargs)
+
+    def _augment(self, batch, image_shapes):
+        """Draw the random parameters and augment a 4-d batch."""
+        if batch.dtype not in Random2DRotation.kernel_dtypes:
+            raise ValueError('unsupported image dtype {}'.format(batch.dtype))
+        window_height, window_width = self.window_shape
+        for image_height, image_width in image_shapes:
+            if image_height < window_height or image_width < window_width:
+                raise ValueError("can't obtain ({}, {}) window from image "
+                                 "dimensions ({}, {})".format(
+                                     window_height, window_width,
+                                     image_height, image_width))
+        heights, widths = numpy.array(image_shapes).T
+        offsets_h = (self.rng.uniform(size=len(batch)) *
+                     (heights - window_height + 1)).astype(numpy.int_)
+        offsets_w = (self.rng.uniform(size=len(batch)) *
+                     (widths - window_width + 1)).astype(numpy.int_)
+        flips_h = numpy.zeros(len(batch), dtype='uint8')
+        flips_v = numpy.zeros(len(batch), dtype='uint8')
+        if self.flip_h:
+            flips_h[:] = self.rng.binomial(n=1, p=0.5, size=len(batch))
+        if self.flip_v:
+            flips_v[:] = self.rng.binomial(n=1, p=0.5, size=len(batch))
+        angles = numpy.zeros(len(batch))
+        if self.maximum_rotation:
+            angles[:] = self.rng.uniform(-self.maximum_rotation,
+                                         self.maximum_rotation, len(batch))
+        out = numpy.empty(batch.shape[:2] + tuple(self.window_shape),
+                          dtype=batch.dtype)
+        # The kernel can't take read-only buffers, e.g. the arrays received
+        # by a ServerDataStream or memory-mapped from a file
+        batch = numpy.require(batch, requirements='W')
+        augment_batch_bchw(batch, offsets_h, offsets_w, flips_h, flips_v,
+                           angles, out, self.resample == 'bilinear')
+        return out
+
+    def transform_source_batch(self, source, source_name):
+        self.verify_axis_labels(('batch', 'channel', 'height', 'width'),
+                                self.data_stream.axis_labels[source_name],
+                                source_name)
+        if isinstance(source, numpy.ndarray) and source.ndim == 4:
+            return self._augment(source, [source.shape[2:]] * len(source))
+        elif all(isinstance(b, numpy.ndarray) and b.ndim == 3
+                 for b in source):
+            # Images of different sizes can't share a kernel call
+            out = [self._augment(im[numpy.newaxis], [im.shape[1:]])[0]
+                   for im in source]
+            if isinstance(source, numpy.ndarray):
+                output = numpy.empty(len(source), dtype=object)
+                for i, image in enumerate(out):
+                    output[i] = image
+                return output
+            return out
+        else:
+            raise ValueError("uninterpretable batch format; expected a list "
+                             "of arrays with ndim = 3, or an array with "
+                             "ndim = 4")
+
+    def transform_source_example(self, example, source_name):
+        self.verify_axis_labels(('channel', 'height', 'width'),
+                                self.data_stream.axis_labels[source_name],
+                                source_name)
+        if not isinstance(example, numpy.ndarray) or example.ndim != 3:
+            raise ValueError("uninterpretable example format; expected "
+                             "ndarray with ndim = 3")
+        return self._augment(example[numpy.newaxis], [example.shape[1:]])[0]
+
+
 class Drop(SourcewiseTransformer):
     """
     Implement border drop (of size `border) and dropout`(with probability of
@@ -1,3 +1,10 @@
+from bisect import bisect_right
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+from six import iteritems
+from six.moves import zip
+
 from fuel.transformers import Transformer
 
 
@@ -121,3 +128,231 @@ class NGrams(Window):
     def get_data(self, *args, **kwargs):
         source, target = super(NGrams, self).get_data(*args, **kwargs)
         return (source, target[0])
+
+
+class BatchedWindow(Window):
+    """Return batches of source and target windows from a stream.
+
+    This is a batch-producing variant of :class:`Window`. All the windows
+    of a sequence are created at once as views of the sequence, using
+    :func:`~numpy.lib.stride_tricks.as_strided`, and copied into batches
+    of `batch_size` windows. A batch can contain windows from several
+    sequences; only the last batch of an epoch can be smaller.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of windows in a batch.
+    offset : int
+        The offset from the source window where the target window starts.
+    source_window : int
+        The size of the source window.
+    target_window : int
+        The size of the target window.
+    overlapping : bool
+        See :class:`Window`.
+    data_stream : :class:`.DataStream` instance
+        The data stream providing sequences. Each example is converted to
+        a NumPy array, so all sequences should have the same type.
+    target_source : str, optional
+        This data stream adds a new source for the target windows. By
+        default this source is 'targets'.
+
+    Notes
+    -----
+    The source and target batches are arrays of shape ``(batch_size,
+    source_window)`` and ``(batch_size, target_window)`` respectively, in
+    the same order as the windows returned by :class:`Window`.
+
+    """
+    def __init__(self, batch_size, offset, source_window, target_window,
+                 overlapping, data_stream, **kwargs):
+        super(BatchedWindow, self).__init__(
+            offset, source_window, target_window, overlapping, data_stream,
+            **kwargs)
+        self.produces_examples = False
+        self.batch_size = batch_size
+        self._reset_windows()
+
+    def _reset_windows(self):
+        self.windows = None
+        self.cursor = 0
+
+    def get_epoch_iterator(self, **kwargs):
+        self._reset_windows()
+        return super(BatchedWindow, self).get_epoch_iterator(**kwargs)
+
+    def _get_windows(self, sequence):
+        """Return views of all the source and target windows."""
+        sequence = numpy.asarray(sequence)
+        target_start = (self.source_window * (not self.overlapping) +
+                        self.offset)
+        first = -min(0, target_start)
+        length = max(self.source_window, target_start + self.target_window)
+        num_windows = max(len(sequence) - first - length + 1, 0)
+        strides = sequence.strides[:1] + sequence.strides
+        sources = as_strided(
+            sequence[first:], strides=strides,
+            shape=(num_windows, self.source_window) + sequence.shape[1:])
+        targets = as_strided(
+            sequence[first + target_start:], strides=strides,
+            shape=(num_windows, self.target_window) + sequence.shape[1:])
+        return sources, targets
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        chunks = []
+        num_windows = 0
+        while num_windows < self.batch_size:
+            if self.windows is None or self.cursor == len(self.windows[0]):
+                try:
+                    sequence, = next(self.child_epoch_iterator)
+                except StopIteration:
+                    if not chunks:
+                        raise
+                    break
+                self.windows = self._get_windows(sequence)
+                self.cursor = 0
+                continue
+            end = min(self.cursor + self.batch_size - num_windows,
+                      len(self.windows[0]))
+            chunks.append(tuple(windows[self.cursor:end]
+                                for windows in self.windows))
+            num_windows += end - self.cursor
+            self.cursor = end
+        if len(chunks) == 1:
+            return tuple(numpy.array(windows) for windows in chunks[0])
+        return tuple(numpy.concatenate(windows) for windows in zip(*chunks))
+
+
+class BatchedNGrams(BatchedWindow):
+    """Return batches of n-grams from a stream.
+
+    This is a batch-producing variant of :class:`NGrams`, see
+    :class:`BatchedWindow`. The targets are returned as a vector holding
+    the word that follows each n-gram.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of n-grams in a batch.
+    ngram_order : int
+        The order of the n-grams to output e.g. 3 for trigrams.
+    data_stream : :class:`.DataStream` instance
+        The data stream providing sentences. Each example is assumed to be
+        a list or array of integers.
+    target_source : str, optional
+        This data stream adds a new source for the target words. By default
+        this source is 'targets'.
+
+    """
+    def __init__(self, batch_size, ngram_order, *args, **kwargs):
+        super(BatchedNGrams, self).__init__(
+            batch_size, 0, ngram_order, 1, False, *args, **kwargs)
+
+    def get_data(self, *args, **kwargs):
+        source, target = super(BatchedNGrams, self).get_data(*args, **kwargs)
+        return (source, target[:, 0])
+
+
+class BucketedBatch(Transformer):
+    """Batch sequences of similar lengths together.
+
+    Examples are put into buckets according to the length of one of their
+    sources. As soon as a bucket contains `batch_size` examples, they are
+    returned as a batch. This way the sequences in a batch have similar
+    lengths, which reduces the amount of padding needed.
+
+    Parameters
+    ----------
+    data_stream : :class:`.DataStream` or :class:`.Transformer`
+        The data stream providing examples, e.g. sentences from a
+        :class:`.TextFile`.
+    batch_size : int
+        The number of examples in a batch.
+    bucket_boundaries : list of int
+        Increasing sequence lengths separating the buckets. Sequences
+        shorter than the first boundary go in the first bucket, sequences
+        at least as long as the last boundary in the last one.
+    buffer_size : int, optional
+        The maximum number of examples kept in all buckets together. When
+        reached, the bucket with the most examples is returned as a
+        (smaller) batch. Defaults to `batch_size` times the number of
+        buckets, i.e. the buffer is never full.
+    length_source : str, optional
+        The source whose length determines the bucket of an example.
+        Defaults to the first source.
+
+    Notes
+    -----
+    At the end of an epoch the remaining examples are returned, one
+    bucket at a time, in batches smaller than `batch_size`. The batches
+    are NumPy arrays built the same way as by :class:`.Batch`, so they
+    usually need to be padded with :class:`.Padding`.
+
+    """
+    def __init__(self, data_stream, batch_size, bucket_boundaries,
+                 buffer_size=None, length_source=None, **kwargs):
+        if not data_stream.produces_examples:
+            raise ValueError('the wrapped data stream must produce examples, '
+                             'not batches of examples.')
+        if any(left >= right for left, right in zip(bucket_boundaries[:-1],
+                                                    bucket_boundaries[1:])):
+            raise ValueError('bucket_boundaries must be increasing')
+        if buffer_size is None:
+            buffer_size = batch_size * (len(bucket_boundaries) + 1)
+        if buffer_size < batch_size:
+            raise ValueError('buffer_size must be at least batch_size')
+        if data_stream.axis_labels:
+            kwargs.setdefault(
+                'axis_labels',
+                dict((source, ('batch',) + labels if labels else None) for
+                     source, labels in iteritems(data_stream.axis_labels)))
+        super(BucketedBatch, self).__init__(
+            data_stream, produces_examples=False, **kwargs)
+        if length_source is None:
+            length_source = self.sources[0]
+        self.length_index = self.sources.index(length_source)
+        self.batch_size = batch_size
+        self.bucket_boundaries = list(bucket_boundaries)
+        self.buffer_size = buffer_size
+        self._reset_buckets()
+
+    def _reset_buckets(self):
+        self.buckets = [[] for _ in range(len(self.bucket_boundaries) + 1)]
+        self.num_buffered = 0
+        self.exhausted = False
+
+    def get_epoch_iterator(self, **kwargs):
+        self._reset_buckets()
+        return super(BucketedBatch, self).get_epoch_iterator(**kwargs)
+
+    def _pop_batch(self, bucket):
+        examples = bucket[:]
+        del bucket[:]
+        self.num_buffered -= len(examples)
+        return tuple(numpy.asarray(list(source_data))
+                     for source_data in zip(*examples))
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        while not self.exhausted:
+            try:
+                example = next(self.child_epoch_iterator)
+            except StopIteration:
+                self.exhausted = True
+                break
+            bucket = self.buckets[bisect_right(
+                self.bucket_boundaries, len(example[self.length_index]))]
+            bucket.append(example)
+            self.num_buffered += 1
+            if len(bucket) == self.batch_size:
+                return self._pop_batch(bucket)
+            if self.num_buffered >= self.buffer_size:
+                return self._pop_batch(max(self.buckets, key=len))
+        for bucket in self.buckets:
+            if bucket:
+                return self._pop_batch(bucket)
+        raise StopIteration
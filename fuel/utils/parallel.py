@@ -5,9 +5,18 @@ Currently including:
 * A very simple PUSH-PULL reusable producer-consumer pattern
   using a ZeroMQ socket instead of the (slow, unnecessarily
   copying) multiprocessing.Queue. See :func:`producer_consumer`.
+* A ring of preallocated shared-memory slots through which processes
+  can pass NumPy arrays without pickling them. See
+  :class:`SharedMemoryRing`.
+* Reseeding the random number generators of a data stream copied into
+  several processes. See :func:`reseed_streams`.
 
 """
-from multiprocessing import Process
+import ctypes
+from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
 import zmq
 
 
@@ -111,3 +120,184 @@ def producer_consumer(producer, consumer, addr='tcp://127.0.0.1',
         # Works around a Python 3.x bug.
         if context_created:
             context.destroy()
+
+
+def reseed_streams(data_stream, offset):
+    """Reseed the random number generators of a chain of data streams.
+
+    Processes forked from the same parent inherit identical random states,
+    which would make them all apply the same "random" transformations.
+    Each :class:`numpy.random.RandomState` stored as the `rng` attribute
+    of a stream in the chain is reseeded using `offset`, which should
+    differ between processes.
+
+    Parameters
+    ----------
+    data_stream : :class:`~fuel.streams.AbstractDataStream`
+        The outermost data stream of the chain.
+    offset : int
+        A number identifying the process, e.g. a worker index.
+
+    Returns
+    -------
+    :class:`~fuel.streams.AbstractDataStream`
+        The innermost data stream of the chain.
+
+    """
+    stream = data_stream
+    while True:
+        rng = getattr(stream, 'rng', None)
+        if isinstance(rng, numpy.random.RandomState):
+            rng.seed(rng.randint(2 ** 30) + offset)
+        if not hasattr(stream, 'data_stream'):
+            return stream
+        stream = stream.data_stream
+
+
+class SharedMemoryRing(object):
+    """Preallocated shared-memory slots for passing arrays between processes.
+
+    Each slot has room for one array of every source in `layout`. A
+    producer process writes a batch into a free slot with :meth:`write`
+    and sends the (small) message it returns to the consumer, e.g. over a
+    :class:`multiprocessing.Queue`. The consumer turns this message back
+    into a batch of arrays with :meth:`read`; these arrays are views on
+    the shared memory, so no copies or serialization are needed.
+
+    Parameters
+    ----------
+    layout : list
+        For each source, either `None` (in which case the data of this
+        source is always sent as part of the message) or a ``(shape,
+        dtype)`` tuple giving the maximum shape and the dtype of the
+        arrays of this source.
+    num_slots : int
+        The number of slots to allocate.
+
+    Notes
+    -----
+    Arrays that don't fit their slot (because their data type or number
+    of dimensions differ from the layout, or because they are larger than
+    the maximum shape) and data that aren't NumPy arrays are sent as part
+    of the message instead.
+
+    A slot is recycled as soon as the consumer reads the next message,
+    which means that the arrays returned by :meth:`read` are overwritten
+    after the next call. Copy them if they need to be kept.
+
+    The ring must be created before the producer processes are forked.
+
+    """
+    alignment = 64
+
+    def __init__(self, layout, num_slots):
+        if num_slots < 2:
+            raise ValueError('at least two slots are needed')
+        self.layout = []
+        self.offsets = []
+        slot_size = 0
+        for item in layout:
+            self.offsets.append(slot_size)
+            if item is None:
+                self.layout.append(None)
+                continue
+            shape, dtype = tuple(item[0]), numpy.dtype(item[1])
+            if dtype.hasobject:
+                raise ValueError('object arrays cannot be stored in shared '
+                                 'memory')
+            self.layout.append((shape, dtype))
+            nbytes = int(numpy.prod(shape)) * dtype.itemsize
+            slot_size += -(-nbytes // self.alignment) * self.alignment
+        self.slot_size = slot_size
+        self.num_slots = num_slots
+        self.buffer = RawArray(ctypes.c_ubyte, max(slot_size * num_slots, 1))
+        self.free_slots = Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        self.current_slot = None
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = numpy.frombuffer(self.buffer, dtype=numpy.uint8)
+        return self._array
+
+    def _view(self, slot, index, shape):
+        dtype = self.layout[index][1]
+        start = slot * self.slot_size + self.offsets[index]
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        return self.array[start:start + nbytes].view(dtype).reshape(shape)
+
+    def _fits(self, index, array):
+        if self.layout[index] is None or not isinstance(array,
+                                                        numpy.ndarray):
+            return False
+        shape, dtype = self.layout[index]
+        return (array.dtype == dtype and array.ndim == len(shape) and
+                all(dim <= max_dim
+                    for dim, max_dim in zip(array.shape, shape)))
+
+    def write(self, data):
+        """Write a batch to a free slot, blocking until one is available.
+
+        Parameters
+        ----------
+        data : tuple
+            The batch, with one element per source in the layout.
+
+        Returns
+        -------
+        message : tuple
+            A picklable message from which :meth:`read` reconstructs the
+            batch.
+
+        """
+        if len(data) != len(self.layout):
+            raise ValueError('expected {} sources, got {}'
+                             .format(len(self.layout), len(data)))
+        slot = self.free_slots.get() if self.slot_size else None
+        items = []
+        for index, array in enumerate(data):
+            if slot is not None and self._fits(index, array):
+                self._view(slot, index, array.shape)[...] = array
+                items.append((True, array.shape))
+            else:
+                items.append((False, array))
+        if slot is not None and not any(shared for shared, _ in items):
+            self.free_slots.put(slot)
+            slot = None
+        return slot, items
+
+    def read(self, message):
+        """Reconstruct a batch, recycling the previously read slot.
+
+        Parameters
+        ----------
+        message : tuple
+            A message returned by :meth:`write`.
+
+        Returns
+        -------
+        tuple
+            The batch, with views on the shared memory for the arrays
+            that were stored in it.
+
+        """
+        self.release()
+        slot, items = message
+        self.current_slot = slot
+        return tuple(self._view(slot, index, value) if shared else value
+                     for index, (shared, value) in enumerate(items))
+
+    def discard(self, message):
+        """Recycle the slot of a message without reading it."""
+        slot, _ = message
+        if slot is not None:
+            self.free_slots.put(slot)
+
+    def release(self):
+        """Recycle the slot of the last batch that was read."""
+        if self.current_slot is not None:
+            self.free_slots.put(self.current_slot)
+            self.current_slot = None
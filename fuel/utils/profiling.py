@@ -0,0 +1,173 @@
+"""Opt-in instrumentation of data stream pipelines.
+
+Profiling is enabled per pipeline with :func:`enable_profiling`, which
+attaches a :class:`StageProfile` to every data stream in it. Each time a
+data stream's :meth:`~.AbstractDataStream.get_data` method is called
+through a :class:`~fuel.iterator.DataIterator`, the wall time it took and
+the number of bytes it returned are recorded. Stages that wait on other
+processes (e.g. :class:`~fuel.transformers.MultiProcessing` and
+:class:`~fuel.streams.ServerDataStream`) also record how long they were
+blocked waiting.
+
+>>> from fuel.datasets import IterableDataset
+>>> from fuel.streams import DataStream
+>>> from fuel.transformers import Mapping
+>>> stream = Mapping(DataStream(IterableDataset([1, 2, 3])),
+...                  lambda data: data)
+>>> enable_profiling(stream)
+>>> _ = list(stream.get_epoch_iterator())
+>>> stream.profile.batches
+3
+
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class StageProfile(object):
+    """Counters for a single stage of a pipeline.
+
+    Attributes
+    ----------
+    batches : int
+        The number of examples or batches produced.
+    time : float
+        Wall time in seconds spent in the stage's `get_data`, including
+        the time spent in the stages it wraps.
+    bytes : int
+        The number of bytes produced, counting NumPy arrays only.
+    wait_time : float
+        Wall time in seconds spent waiting on other processes.
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.time = 0.
+        self.bytes = 0
+        self.wait_time = 0.
+
+    def record(self, elapsed, data):
+        self.batches += 1
+        self.time += elapsed
+        self.bytes += sum(getattr(source_data, 'nbytes', 0)
+                          for source_data in data)
+
+
+def _children(data_stream):
+    if hasattr(data_stream, 'data_streams'):
+        return list(data_stream.data_streams)
+    if hasattr(data_stream, 'data_stream'):
+        return [data_stream.data_stream]
+    return []
+
+
+def iterate_stages(data_stream, depth=0):
+    """Iterate over the data streams of a pipeline, outermost first.
+
+    Parameters
+    ----------
+    data_stream : :class:`~fuel.streams.AbstractDataStream`
+        The outermost data stream of the pipeline.
+
+    Yields
+    ------
+    tuple
+        A ``(depth, data_stream)`` pair for every stage.
+
+    """
+    yield depth, data_stream
+    for child in _children(data_stream):
+        for stage in iterate_stages(child, depth + 1):
+            yield stage
+
+
+def enable_profiling(data_stream):
+    """Attach fresh profiling counters to every stage of a pipeline."""
+    for _, stage in iterate_stages(data_stream):
+        stage.profile = StageProfile()
+
+
+def disable_profiling(data_stream):
+    """Remove the profiling counters from every stage of a pipeline."""
+    for _, stage in iterate_stages(data_stream):
+        stage.profile = None
+
+
+def profile_summary(data_stream):
+    """Aggregate the profiling counters of a pipeline.
+
+    The time a stage spends in the stages it wraps is subtracted from its
+    total time to obtain the time spent in the stage itself.
+
+    Parameters
+    ----------
+    data_stream : :class:`~fuel.streams.AbstractDataStream`
+        The outermost data stream of the pipeline.
+
+    Returns
+    -------
+    list of dict
+        One dictionary per stage, outermost first, with the keys `stage`,
+        `depth`, `batches`, `time`, `self_time`, `bytes` and `wait_time`.
+        Stages without counters are left out.
+
+    """
+    summary = []
+    for depth, stage in iterate_stages(data_stream):
+        profile = getattr(stage, 'profile', None)
+        if profile is None:
+            continue
+        children_time = sum(child.profile.time
+                            for child in _children(stage)
+                            if getattr(child, 'profile', None) is not None)
+        summary.append({
+            'stage': stage.__class__.__name__, 'depth': depth,
+            'batches': profile.batches, 'time': profile.time,
+            'self_time': max(profile.time - children_time, 0.),
+            'bytes': profile.bytes, 'wait_time': profile.wait_time})
+    return summary
+
+
+def profile_report(data_stream):
+    """Format the profiling counters of a pipeline as a table.
+
+    Parameters
+    ----------
+    data_stream : :class:`~fuel.streams.AbstractDataStream`
+        The outermost data stream of the pipeline.
+
+    Returns
+    -------
+    str
+        A table with one row per stage, indented by depth.
+
+    """
+    lines = ['{:<32} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'batches', 'time (s)', 'self (s)', 'wait (s)', 'MB')]
+    for row in profile_summary(data_stream):
+        lines.append('{:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}'
+                     .format('  ' * row['depth'] + row['stage'],
+                             row['batches'], row['time'], row['self_time'],
+                             row['wait_time'], row['bytes'] / 1e6))
+    return '\n'.join(lines)
+
+
+def log_profile(data_stream, logger=None, level=logging.INFO):
+    """Write the profiling report of a pipeline to a logger.
+
+    Parameters
+    ----------
+    data_stream : :class:`~fuel.streams.AbstractDataStream`
+        The outermost data stream of the pipeline.
+    logger : :class:`logging.Logger`, optional
+        The logger to write to. Defaults to this module's logger.
+    level : int, optional
+        The logging level. Defaults to ``logging.INFO``.
+
+    """
+    (logger or log).log(level, 'Pipeline profile:\n%s',
+                        profile_report(data_stream))
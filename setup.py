@@ -51,6 +51,7 @@ setup(
                       'requests'],
     extras_require={
         'test': ['mock', 'nose', 'nose2'],
+        'compression': ['lz4', 'zstandard', 'blosc'],
         'docs': ['sphinx', 'sphinx-rtd-theme']
     },
     entry_points={
@@ -18,7 +18,7 @@ from scipy.io import savemat
 from six.moves import range, zip, cPickle
 
 from fuel.converters.base import (fill_hdf5_file, check_exists,
-                                  MissingInputFiles)
+                                  create_flat_vlen_source, MissingInputFiles)
 from fuel.converters import (adult, binarized_mnist, caltech101_silhouettes,
                              celeba, iris, cifar10, cifar100, mnist, svhn)
 from fuel.downloaders.caltech101_silhouettes import silhouettes_downloader
@@ -92,6 +92,38 @@ class TestFillHDF5File(object):
              ('test', 'features', test_features)))
 
 
+class TestCreateFlatVlenSource(object):
+    def setUp(self):
+        self.h5file = h5py.File(
+            'file.hdf5', mode='w', driver='core', backing_store=False)
+        self.examples = [numpy.arange(6, dtype='uint8').reshape((2, 3)),
+                         numpy.arange(4, dtype='uint8').reshape((1, 4))]
+
+    def tearDown(self):
+        self.h5file.close()
+
+    def test_layout(self):
+        source = create_flat_vlen_source(self.h5file, 'features',
+                                         self.examples, ('height', 'width'))
+        assert_equal(source[...], [0, 6])
+        assert_equal(self.h5file[source.attrs['flat_data']][...],
+                     numpy.concatenate([e.ravel() for e in self.examples]))
+        assert_equal(source.dims[0]['shapes'][...], [[2, 3], [1, 4]])
+        assert_equal(source.dims[0]['shape_labels'][...],
+                     [b'height', b'width'])
+        assert_equal(source.dims[0].label, 'batch')
+
+    def test_value_errors(self):
+        assert_raises(ValueError, create_flat_vlen_source, self.h5file,
+                      'features', [], ('height', 'width'))
+        assert_raises(ValueError, create_flat_vlen_source, self.h5file,
+                      'features', self.examples, ('length',))
+        assert_raises(ValueError, create_flat_vlen_source, self.h5file,
+                      'features', [numpy.zeros((1, 1)),
+                                   numpy.zeros((1, 1), dtype='uint8')],
+                      ('height', 'width'))
+
+
 class TestMNIST(object):
     def setUp(self):
         MNIST_IMAGE_MAGIC = 2051
@@ -1,14 +1,16 @@
 import os
 import tables
+import tempfile
 
 import h5py
 import numpy
 from numpy.testing import assert_equal, assert_raises
 from six.moves import range, cPickle
 
+from fuel.converters.base import create_flat_vlen_source
 from fuel.datasets.hdf5 import PytablesDataset, H5PYDataset
 from fuel.streams import DataStream
-from fuel.schemes import SequentialScheme
+from fuel.schemes import SequentialScheme, ShuffledScheme
 
 
 class TestPytablesDataset(object):
@@ -430,6 +432,121 @@ class TestH5PYDataset(object):
         assert_equal(next(iter_),
                      (self.vlen_features[1], self.vlen_targets[1]))
 
+    def test_examples_per_chunk(self):
+        self.h5file.create_dataset('chunked', data=self.features,
+                                   chunks=(16, 36))
+        self.h5file.attrs['split'] = H5PYDataset.create_split_array(
+            {'train': {'features': (0, 20), 'chunked': (0, 20)}})
+        dataset = H5PYDataset(self.h5file, which_sets=('train',))
+        assert_equal(dataset.examples_per_chunk, 16)
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              sources=('features',))
+        assert dataset.examples_per_chunk is None
+
+    def test_memory_map(self):
+        handle, path = tempfile.mkstemp(suffix='.hdf5')
+        os.close(handle)
+        try:
+            with h5py.File(path, mode='w') as h5file:
+                h5file['features'] = self.features
+                h5file.create_dataset('chunked', data=self.features,
+                                      chunks=(10, 36))
+                split_dict = {'train': {'features': (10, 90),
+                                        'chunked': (10, 90)}}
+                h5file.attrs['split'] = H5PYDataset.create_split_array(
+                    split_dict)
+            dataset = H5PYDataset(path, which_sets=('train',),
+                                  memory_map=True)
+            memory_maps = dict(zip(dataset.sources, dataset.memory_maps))
+            assert isinstance(memory_maps['features'], numpy.ndarray)
+            assert memory_maps['chunked'] is None
+            handle = dataset.open()
+            for request in [slice(5, 15), [7, 3, 20], 4]:
+                assert_equal(dataset.get_data(handle, request),
+                             (self.features[10:90][request],) * 2)
+            data = dataset.get_data(handle, slice(0, 10))
+            features = data[dataset.sources.index('features')]
+            assert not features.flags.owndata
+            dataset.close(handle)
+            dataset = cPickle.loads(cPickle.dumps(dataset))
+            handle = dataset.open()
+            assert_equal(dataset.get_data(handle, slice(0, 2))[0],
+                         self.features[10:12])
+            dataset.close(handle)
+        finally:
+            os.remove(path)
+
+    def test_memory_map_not_used_for_core_driver(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              memory_map=True)
+        assert dataset.memory_maps == (None, None)
+        handle = dataset.open()
+        assert_equal(dataset.get_data(handle, slice(0, 8)),
+                     (self.features[:8], self.targets[:8]))
+        dataset.close(handle)
+
+    def test_prefetch(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('unlabeled',),
+                              prefetch=3)
+        stream = DataStream(dataset, iteration_scheme=ShuffledScheme(70, 8))
+        expected = DataStream(
+            H5PYDataset(self.h5file, which_sets=('unlabeled',)),
+            iteration_scheme=ShuffledScheme(70, 8))
+        for _ in range(2):
+            for batch, expected_batch in zip(
+                    stream.get_epoch_iterator(),
+                    expected.get_epoch_iterator()):
+                assert_equal(batch, expected_batch)
+        stream.close()
+        expected.close()
+
+    def test_prefetch_falls_back_on_other_requests(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',), prefetch=2)
+        handle = dataset.open()
+        iterator = dataset.lookahead(handle, iter([slice(0, 2), [3, 1]]))
+        assert_equal(next(iterator), slice(0, 2))
+        assert_equal(dataset.get_data(handle, slice(4, 6)),
+                     (self.features[4:6], self.targets[4:6]))
+        assert_equal(next(iterator), [3, 1])
+        assert_equal(dataset.get_data(handle, [3, 1]),
+                     (self.features[[3, 1]], self.targets[[3, 1]]))
+        assert_raises(StopIteration, next, iterator)
+        dataset.close(handle)
+
+    def test_prefetch_data_stream_pickling(self):
+        handle, path = tempfile.mkstemp(suffix='.hdf5')
+        os.close(handle)
+        try:
+            with h5py.File(path, mode='w') as h5file:
+                h5file['features'] = self.features
+                h5file.attrs['split'] = H5PYDataset.create_split_array(
+                    {'train': {'features': (0, 20)}})
+            stream = DataStream(
+                H5PYDataset(path, which_sets=('train',), prefetch=2),
+                iteration_scheme=SequentialScheme(20, 4))
+            iterator = stream.get_epoch_iterator()
+            for _ in range(2):
+                next(iterator)
+            iterator = cPickle.loads(cPickle.dumps(iterator))
+            expected = DataStream(
+                H5PYDataset(path, which_sets=('train',)),
+                iteration_scheme=SequentialScheme(20, 4))
+            expected_batches = list(expected.get_epoch_iterator())[2:]
+            assert_equal(list(iterator), expected_batches)
+            # Only stop the threads; the file handle is shared with `stream`
+            iterator.request_iterator.close()
+            stream.close()
+            expected.close()
+        finally:
+            os.remove(path)
+
+    def test_prefetch_value_errors(self):
+        assert_raises(ValueError, H5PYDataset, self.h5file,
+                      which_sets=('train',), prefetch=0)
+        assert_raises(ValueError, H5PYDataset, self.h5file,
+                      which_sets=('train',), load_in_memory=True,
+                      prefetch=2)
+
     def test_dataset_get_data_without_open(self):
         dataset = H5PYDataset(self.h5file, which_sets=('train',),
                               load_in_memory=False)
@@ -438,3 +555,70 @@ class TestH5PYDataset(object):
         except IOError:
             assert False
         dataset.close(None)
+
+
+class TestFlatVlenH5PYDataset(object):
+    def setUp(self):
+        self.features = [numpy.arange(i * 3 * (i + 2), dtype='float32')
+                         .reshape((i, 3, i + 2)) for i in range(1, 11)]
+        self.targets = numpy.arange(10, dtype='uint8').reshape((10, 1))
+        h5file = h5py.File(
+            'flat_vlen.hdf5', mode='w', driver='core', backing_store=False)
+        create_flat_vlen_source(h5file, 'features', self.features,
+                                ('time', 'channel', 'width'))
+        h5file['targets'] = self.targets
+        h5file['targets'].dims[0].label = 'batch'
+        h5file['targets'].dims[1].label = 'index'
+        split_dict = {'train': {'features': (0, 8), 'targets': (0, 8)},
+                      'test': {'features': (8, 10), 'targets': (8, 10)}}
+        h5file.attrs['split'] = H5PYDataset.create_split_array(split_dict)
+        self.h5file = h5file
+
+    def tearDown(self):
+        self.h5file.close()
+
+    def check(self, load_in_memory):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              load_in_memory=load_in_memory)
+        assert_equal(dataset.flat_vlen_sources, ('features',))
+        handle = dataset.open()
+        for request in [slice(1, 4), [6, 0, 3], 5]:
+            features, targets = dataset.get_data(handle, request)
+            if isinstance(request, int):
+                assert_equal(features, self.features[request])
+            else:
+                assert_equal(features.dtype, object)
+                if isinstance(request, slice):
+                    expected = self.features[request]
+                else:
+                    expected = [self.features[i] for i in request]
+                assert_equal(len(features), len(expected))
+                for example, expected_example in zip(features, expected):
+                    assert_equal(example, expected_example)
+            assert_equal(targets, self.targets[request])
+        dataset.close(handle)
+
+    def test_out_of_memory(self):
+        self.check(False)
+
+    def test_in_memory(self):
+        self.check(True)
+
+    def test_in_memory_loads_only_subset(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('test',),
+                              load_in_memory=True)
+        flat = dataset.flat_data[dataset.sources.index('features')]
+        assert_equal(flat, numpy.concatenate([self.features[8].ravel(),
+                                              self.features[9].ravel()]))
+        assert_equal(dataset.get_data(request=1)[0], self.features[9])
+
+    def test_axis_labels(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',))
+        assert_equal(dataset.axis_labels['features'],
+                     ('batch', 'time', 'channel', 'width'))
+
+    def test_example_scheme(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('test',))
+        iter_ = dataset.get_example_stream().get_epoch_iterator()
+        assert_equal(next(iter_)[0], self.features[8])
+        assert_equal(next(iter_)[0], self.features[9])
@@ -4,7 +4,8 @@ from numpy.testing import assert_raises
 from fuel.schemes import (ConstantScheme, SequentialExampleScheme,
                           SequentialScheme, ShuffledExampleScheme,
                           ShuffledScheme, ConcatenatedScheme,
-                          cross_validation, BalancedSamplingScheme)
+                          cross_validation, BalancedSamplingScheme,
+                          ShardedScheme, BlockShuffledScheme)
 
 
 def iterator_requester(scheme):
@@ -186,6 +187,64 @@ def test_concatenated_scheme_infers_request_type():
                  SequentialExampleScheme(examples=10)]).requests_examples
 
 
+def test_block_shuffled_scheme():
+    scheme = BlockShuffledScheme(100, 10, block_size=10,
+                                 rng=numpy.random.RandomState(1))
+    batches = list(scheme.get_request_iterator())
+    assert len(batches) == 10
+    # With a buffer of a single block, each batch is a shuffled block
+    for batch in batches:
+        assert sorted(batch) == list(range(min(batch), min(batch) + 10))
+    assert sorted(sum(batches, [])) == list(range(100))
+    assert batches != sorted(batches)
+    assert any(batch != sorted(batch) for batch in batches)
+
+
+def test_block_shuffled_scheme_buffer():
+    scheme = BlockShuffledScheme(90, 7, block_size=10, buffer_size=30,
+                                 rng=numpy.random.RandomState(1))
+    batches = list(scheme.get_request_iterator())
+    assert [len(batch) for batch in batches] == [7] * 12 + [6]
+    examples = sum(batches, [])
+    assert sorted(examples) == list(range(90))
+    for i in range(0, 90, 30):
+        assert len(set(j // 10 for j in examples[i:i + 30])) == 3
+
+
+def test_block_shuffled_scheme_sorted_indices():
+    scheme = BlockShuffledScheme(list(range(95)), 7, block_size=10,
+                                 buffer_size=30, sorted_indices=True)
+    batches = list(scheme.get_request_iterator())
+    assert all(batch == sorted(batch) for batch in batches)
+    assert sorted(sum(batches, [])) == list(range(95))
+
+
+def test_block_shuffled_scheme_offset():
+    scheme = BlockShuffledScheme(25, 25, block_size=10, buffer_size=10,
+                                 offset=5, rng=numpy.random.RandomState(1))
+    batch, = list(scheme.get_request_iterator())
+    assert sorted(batch) == list(range(25))
+    # Each of the blocks [0, 5), [5, 15), [15, 25) is visited in one go
+    block_ids = [(i + 5) // 10 for i in batch]
+    runs = [block_ids[0]] + [b for a, b in zip(block_ids, block_ids[1:])
+                             if a != b]
+    assert sorted(runs) == [0, 1, 2]
+
+
+def test_block_shuffled_scheme_value_error():
+    assert_raises(ValueError, BlockShuffledScheme, 10, 2, block_size=0)
+    assert_raises(TypeError, BlockShuffledScheme, 10, 2)
+
+
+def test_sharded_scheme():
+    shards = [list(ShardedScheme(SequentialExampleScheme(10), 3, shard)
+                   .get_request_iterator()) for shard in range(3)]
+    assert shards == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+    assert ShardedScheme(SequentialExampleScheme(10), 3, 0).requests_examples
+    assert not ShardedScheme(SequentialScheme(10, 2), 3, 0).requests_examples
+    assert_raises(ValueError, ShardedScheme, SequentialScheme(10, 2), 3, 3)
+
+
 def test_cross_validation():
     # test raise when strict=True
     cross = cross_validation(SequentialExampleScheme, 10, 3)
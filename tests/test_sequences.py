@@ -1,14 +1,20 @@
+import os
 import tempfile
+from collections import OrderedDict
 
 import numpy
-from numpy.testing import assert_raises
+from numpy.testing import assert_equal, assert_raises
 from six import BytesIO
 from six.moves import cPickle
 
-from fuel.datasets import TextFile, IterableDataset, IndexableDataset
-from fuel.schemes import SequentialScheme
+from fuel.datasets import (TextFile, TokenizedTextFile, IterableDataset,
+                           IndexableDataset)
+from fuel.datasets.text import build_line_index, tokenize_text_file
+from fuel.schemes import SequentialScheme, ShuffledScheme
 from fuel.streams import DataStream
-from fuel.transformers.sequences import Window, NGrams
+from fuel.transformers import MultiProcessing, Padding
+from fuel.transformers.sequences import (BucketedBatch, Window, NGrams,
+                                         BatchedWindow, BatchedNGrams)
 
 
 def lower(s):
@@ -55,6 +61,207 @@ def test_text():
     assert sentence[-3:] == [2, 4, 28]
 
 
+def test_tokenized_text():
+    directory = tempfile.mkdtemp()
+    text_path = os.path.join(directory, 'sentences.txt')
+    with open(text_path, 'w') as f:
+        f.write("This is a sentence\n")
+        f.write("\n")
+        f.write("This another one")
+    dictionary = {'<UNK>': 0, '<S>': 1, '</S>': 2, 'this': 3, 'a': 4,
+                  'one': 5}
+    text_data = TextFile(files=[text_path], dictionary=dictionary,
+                         preprocess=lower)
+    path = os.path.join(directory, 'sentences.bin')
+    assert tokenize_text_file(text_data, path, buffer_size=4) == 3
+
+    tokenized = TokenizedTextFile(path)
+    assert tokenized.num_examples == 3
+    expected = [data for data,
+                in DataStream(text_data).get_epoch_iterator()]
+    examples = [data.tolist() for data,
+                in tokenized.get_example_stream().get_epoch_iterator()]
+    assert examples == expected
+    assert tokenized.get_data(request=0)[0].dtype == numpy.uint32
+    assert ([data.tolist() for data in
+             tokenized.get_data(request=slice(1, None))[0]] == expected[1:])
+
+    stream = Padding(DataStream(tokenized,
+                                iteration_scheme=SequentialScheme(3, 2)))
+    batch, mask = next(stream.get_epoch_iterator())
+    assert batch.tolist() == [[1, 3, 0, 4, 0, 2], [1, 2, 0, 0, 0, 0]]
+
+    tokenized = cPickle.loads(cPickle.dumps(tokenized))
+    assert tokenized.get_data(request=2)[0].tolist() == expected[2]
+
+    text_data.dictionary = dict(dictionary, big=2 ** 32)
+    assert_raises(ValueError, tokenize_text_file, text_data, path)
+
+
+def exit_on_sentence_10(sentence):
+    if sentence.startswith('this is sentence 10 '):
+        os._exit(1)
+    return sentence
+
+
+def test_text_workers():
+    directory = tempfile.mkdtemp()
+    files = []
+    for i, length in enumerate([5, 0, 600, 3, 40]):
+        files.append(os.path.join(directory, '{}.txt'.format(i)))
+        with open(files[-1], 'w') as f:
+            for j in range(length):
+                f.write("this is sentence {} of {}\n".format(j, i))
+    dictionary = dict((str(i), i) for i in range(600))
+    dictionary.update({'<UNK>': 600, '<S>': 601, '</S>': 602})
+    expected = [data for data, in DataStream(
+        TextFile(files, dictionary)).get_epoch_iterator()]
+    for num_workers in (1, 2, 8):
+        text_data = TextFile(files, dictionary, num_workers=num_workers)
+        stream = DataStream(text_data)
+        for _ in range(2):
+            assert [data for data,
+                    in stream.get_epoch_iterator()] == expected
+        stream.close()
+
+    stream = DataStream(TextFile(files, dictionary, num_workers=2,
+                                 ordered=False))
+    sentences = [data for data, in stream.get_epoch_iterator()]
+    assert sorted(sentences) == sorted(expected)
+    assert ([sentence for sentence in sentences if sentence[-2] == 2] ==
+            [sentence for sentence in expected if sentence[-2] == 2])
+
+    # The workers start on the first sentence, and are restarted from
+    # where they were when the epoch is unpickled
+    stream = DataStream(TextFile(files, dictionary, num_workers=2))
+    stream = cPickle.loads(cPickle.dumps(stream))
+    epoch = stream.get_epoch_iterator()
+    assert [next(epoch)[0] for _ in range(100)] == expected[:100]
+    epoch = cPickle.loads(cPickle.dumps(epoch))
+    assert [data for data, in epoch] == expected[100:]
+    epoch.data_stream.close()
+    stream.close()
+
+    # Daemonic processes read the files themselves
+    stream = MultiProcessing(DataStream(TextFile(files, dictionary,
+                                                 num_workers=2)))
+    assert [data for data, in stream.get_epoch_iterator()] == expected
+    stream.close()
+
+    text_data = TextFile(files, dictionary, unk_token=None, num_workers=2)
+    assert_raises(RuntimeError, list,
+                  DataStream(text_data).get_epoch_iterator())
+
+    # Errors name the file, even if it is the first one of a worker
+    missing = os.path.join(directory, 'missing.txt')
+    text_data = TextFile([missing] + files, dictionary, num_workers=2)
+    try:
+        list(DataStream(text_data).get_epoch_iterator())
+    except RuntimeError as e:
+        assert missing in str(e)
+    else:
+        assert False
+
+    # A worker dying without reporting an error doesn't hang the stream
+    for ordered in (True, False):
+        text_data = TextFile(files, dictionary, num_workers=2,
+                             preprocess=exit_on_sentence_10, ordered=ordered)
+        assert_raises(RuntimeError, list,
+                      DataStream(text_data).get_epoch_iterator())
+    assert_raises(ValueError, TextFile, files, dictionary, num_workers=0)
+    assert_raises(ValueError, TextFile, files, dictionary, num_workers=2,
+                  random_access=True)
+
+
+def test_text_character_table():
+    with tempfile.NamedTemporaryFile(mode='wb', delete=False) as f:
+        path = f.name
+        f.write(u"ab c\u00e9\u0101\nzz\n".encode('utf-8'))
+    for extra in ({}, {u'\u0101': 5}, {u'\U0001f600': 6}):
+        dictionary = dict({'a': 0, 'b': 1, ' ': 2, '<S>': 3, '</S>': 4,
+                           '<UNK>': 7}, **extra)
+        text_data = TextFile([path], dictionary, level='character',
+                             encoding='utf-8')
+        assert ((text_data.character_table is None) ==
+                (u'\U0001f600' in extra))
+        sentences = [data for data,
+                     in DataStream(text_data).get_epoch_iterator()]
+        unk = 5 if extra.get(u'\u0101') == 5 else 7
+        assert sentences == [[3, 0, 1, 2, 7, 7, unk, 4], [3, 7, 7, 4]]
+
+    text_data = TextFile([path], {'a': 0, 'b': 1, ' ': 2, 'c': 3},
+                         bos_token=None, eos_token=None, unk_token=None,
+                         level='character', encoding='utf-8')
+    assert_raises(KeyError, next, DataStream(text_data).get_epoch_iterator())
+
+
+def test_line_index():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'sentences.txt')
+    with open(path, 'w') as f:
+        f.write("one\n\nthree\nfour")
+    index = build_line_index(path, buffer_size=3)
+    assert index.tolist() == [0, 4, 5, 11, 15]
+    assert os.path.exists(path + '.index.npy')
+    assert build_line_index(path).tolist() == index.tolist()
+
+    # A stale index is rebuilt
+    with open(path, 'w') as f:
+        f.write("one\n")
+    os.utime(path + '.index.npy', (0, 0))
+    assert build_line_index(path).tolist() == [0, 4]
+
+    # So is one that is as recent as the file, but of a different size
+    with open(path, 'w') as f:
+        f.write("one\ntwo\n")
+    os.utime(path, (0, 0))
+    assert build_line_index(path).tolist() == [0, 4, 8]
+    assert sorted(os.listdir(directory)) == ['sentences.txt',
+                                             'sentences.txt.index.npy']
+
+
+def test_text_random_access():
+    directory = tempfile.mkdtemp()
+    files = [os.path.join(directory, name) for name in ('a.txt', 'b.txt')]
+    with open(files[0], 'w') as f:
+        f.write("This is a sentence\nThis another one\n")
+    with open(files[1], 'w') as f:
+        f.write("More sentences\n\nThe last one")
+    dictionary = {'<UNK>': 0, '<S>': 1, '</S>': 2, 'this': 3, 'a': 4,
+                  'one': 5}
+    sequential = TextFile(files, dictionary, preprocess=lower)
+    expected = [data for data,
+                in DataStream(sequential).get_epoch_iterator()]
+    text_data = TextFile(files, dictionary, preprocess=lower,
+                         random_access=True)
+    assert text_data.num_examples == 5
+    examples = [data for data,
+                in text_data.get_example_stream().get_epoch_iterator()]
+    assert examples == expected
+    assert text_data.get_data(text_data.open(), 3) == ([1, 2],)
+    assert (text_data.get_data(text_data.open(), slice(3, None)) ==
+            (expected[3:],))
+
+    stream = DataStream(text_data, iteration_scheme=ShuffledScheme(
+        5, 3, rng=numpy.random.RandomState(1)))
+    requests = list(ShuffledScheme(5, 3, rng=numpy.random.RandomState(1))
+                    .get_request_iterator())
+    epoch = stream.get_epoch_iterator()
+    batch, = next(epoch)
+    assert batch == [expected[i] for i in requests[0]]
+    epoch = cPickle.loads(cPickle.dumps(epoch))
+    batch, = next(epoch)
+    assert batch == [expected[i] for i in requests[1]]
+
+    text_data = cPickle.loads(cPickle.dumps(text_data))
+    assert text_data.get_data(text_data.open(), [4, 0, 4]) == (
+        [expected[4], expected[0], expected[4]],)
+    assert_raises(IndexError, text_data.get_data, text_data.open(), [5])
+    assert_raises(ValueError, text_data.get_data, text_data.open())
+    assert_raises(ValueError, TextFile, ['a.txt.gz'], dictionary,
+                  random_access=True)
+
+
 def test_ngram_stream():
     sentences = [list(numpy.random.randint(10, size=sentence_length))
                  for sentence_length in [3, 5, 7]]
@@ -85,6 +292,47 @@ def test_window_stream():
     assert i == 1  # Should get 2 examples
 
 
+def test_batched_window_stream():
+    sentences = [list(numpy.random.randint(10, size=sentence_length))
+                 for sentence_length in [3, 5, 0, 7, 6]]
+    stream = DataStream(IterableDataset(sentences))
+    for args in [(0, 4, 4, True), (-2, 4, 4, False), (-2, 4, 3, True),
+                 (1, 2, 3, False)]:
+        expected = list(Window(*(args + (stream,))).get_epoch_iterator())
+        windows = BatchedWindow(3, *(args + (stream,)))
+        assert not windows.produces_examples
+        batches = list(windows.get_epoch_iterator())
+        assert all(len(source) == 3 for source, _ in batches[:-1])
+        assert ([(list(source), list(target)) for source_batch, target_batch
+                 in batches for source, target in zip(source_batch,
+                                                      target_batch)] ==
+                [(list(source), list(target)) for source, target in expected])
+
+    # Sequences of vectors
+    sequences = [numpy.arange(12).reshape(6, 2)]
+    windows = BatchedWindow(10, 1, 2, 1, True,
+                            DataStream(IterableDataset(sequences)))
+    sources, targets = next(windows.get_epoch_iterator())
+    assert sources.shape == (5, 2, 2)
+    assert_equal(targets[:, 0], sequences[0][1:])
+
+
+def test_batched_ngram_stream():
+    sentences = [numpy.random.randint(10, size=sentence_length)
+                 for sentence_length in [3, 5, 7]]
+    stream = DataStream(IterableDataset(sentences))
+    expected = list(NGrams(2, stream).get_epoch_iterator())
+    ngrams = BatchedNGrams(4, 2, stream)
+    for epoch in range(2):
+        batches = list(ngrams.get_epoch_iterator())
+        assert [len(targets) for _, targets in batches] == [4, 4, 1]
+        sources = numpy.concatenate([source for source, _ in batches])
+        targets = numpy.concatenate([target for _, target in batches])
+        assert_equal(sources, [source for source, _ in expected])
+        assert_equal(targets, [target for _, target in expected])
+    assert_raises(ValueError, ngrams.get_data, [0, 1])
+
+
 def test_ngram_stream_error_on_multiple_sources():
     # Check that NGram accepts only data streams with one source
     sentences = [list(numpy.random.randint(10, size=sentence_length))
@@ -108,3 +356,37 @@ def test_ngram_stream_raises_error_on_request():
     stream = DataStream(IterableDataset(sentences))
     ngrams = NGrams(4, stream)
     assert_raises(ValueError, ngrams.get_data, [0, 1])
+
+
+def test_bucketed_batch():
+    sentences = [list(range(length)) for length in
+                 [1, 5, 2, 6, 3, 9, 1, 4, 7, 2]]
+    stream = DataStream(IterableDataset(OrderedDict(
+        [('features', sentences), ('ids', list(range(10)))])))
+    bucketed = BucketedBatch(stream, 2, [3, 6])
+    assert bucketed.sources == ('features', 'ids')
+    batches = list(bucketed.get_epoch_iterator())
+    assert [batch[1].tolist() for batch in batches] == [
+        [0, 2], [1, 4], [3, 5], [6, 9], [7], [8]]
+    # The next epoch starts with empty buckets
+    assert [batch[1].tolist() for batch in bucketed.get_epoch_iterator()
+            ] == [batch[1].tolist() for batch in batches]
+
+
+def test_bucketed_batch_buffer_size():
+    stream = DataStream(IterableDataset(OrderedDict(
+        [('ids', list(range(6))),
+         ('features', [[0], [0] * 5, [0] * 6, [0] * 2, [0] * 4, [0]])])))
+    bucketed = BucketedBatch(stream, 3, [3, 6], buffer_size=3,
+                             length_source='features')
+    assert [batch[0].tolist() for batch in bucketed.get_epoch_iterator()
+            ] == [[0], [3], [1, 4], [5], [2]]
+
+
+def test_bucketed_batch_value_errors():
+    stream = DataStream(IterableDataset([[1], [2, 3]]))
+    assert_raises(ValueError, BucketedBatch, stream, 2, [3, 3])
+    assert_raises(ValueError, BucketedBatch, stream, 2, [3], buffer_size=1)
+    batch_stream = DataStream(IndexableDataset([[1], [2, 3]]),
+                              iteration_scheme=SequentialScheme(2, 1))
+    assert_raises(ValueError, BucketedBatch, batch_stream, 2, [3])
@@ -1,12 +1,15 @@
 from multiprocessing import Process
 
-from numpy.testing import assert_allclose, assert_raises
+import numpy
+import zmq
+from numpy.testing import assert_allclose, assert_equal, assert_raises
 from six.moves import cPickle
 from nose.exc import SkipTest
 
-from fuel.datasets import MNIST
-from fuel.schemes import SequentialScheme
-from fuel.server import start_server
+from fuel.datasets import IndexableDataset, IterableDataset, MNIST
+from fuel.schemes import ConstantScheme, SequentialScheme, ShuffledScheme
+from fuel.server import (codec_available, recv_arrays, send_arrays,
+                         start_server, CODECS)
 from fuel.streams import DataStream, ServerDataStream
 
 
@@ -57,3 +60,111 @@ class TestServer(object):
 
     def test_reset(self):
         self.stream.reset()
+
+
+def get_indexable_stream():
+    return DataStream(
+        IndexableDataset(numpy.arange(100)),
+        iteration_scheme=ShuffledScheme(100, 7))
+
+
+class TestMultipleProducers(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(), 5558),
+            kwargs={'num_producers': 3})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5558)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.stream = None
+
+    def test_epochs(self):
+        for _ in range(2):
+            batches = list(self.stream.get_epoch_iterator())
+            assert_equal(len(batches), 15)
+            assert_equal(numpy.sort(numpy.concatenate(
+                [batch[0] for batch in batches])), numpy.arange(100))
+
+
+def test_num_producers_value_errors():
+    assert_raises(ValueError, start_server, get_indexable_stream(),
+                  num_producers=0)
+    assert_raises(ValueError, start_server,
+                  DataStream(IterableDataset(range(10))), num_producers=2)
+    assert_raises(ValueError, start_server,
+                  DataStream(IterableDataset(range(10)),
+                             iteration_scheme=ConstantScheme(2)),
+                  num_producers=2)
+
+
+def test_compression_value_error_on_unknown_source():
+    assert_raises(ValueError, start_server, get_indexable_stream(),
+                  compression={'featurse': 'zlib'})
+
+
+class TestProtocol(object):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.push = self.context.socket(zmq.PUSH)
+        self.push.bind('inproc://test_protocol')
+        self.pull = self.context.socket(zmq.PULL)
+        self.pull.connect('inproc://test_protocol')
+        rng = numpy.random.RandomState(1)
+        self.arrays = [
+            rng.randint(0, 4, size=(10, 3, 32, 32)).astype('uint8'),
+            numpy.asfortranarray(rng.normal(size=(5, 7))),
+            rng.normal(size=(6, 8))[::2, ::3],
+            numpy.zeros((0, 3), dtype='int64'),
+            numpy.array(3.5, dtype='float32'),
+            numpy.zeros(4, dtype=[('a', 'f4'), ('b', 'i8', (2,))])]
+
+    def tearDown(self):
+        self.context.destroy()
+
+    def check(self, compression=None):
+        send_arrays(self.push, self.arrays, compression=compression)
+        received = recv_arrays(self.pull)
+        assert_equal(len(received), len(self.arrays))
+        for array, expected in zip(received, self.arrays):
+            assert_equal(array.dtype, expected.dtype)
+            assert_equal(array, expected)
+
+    def test_uncompressed(self):
+        self.check()
+
+    def test_compressed(self):
+        for codec in CODECS:
+            if codec_available(codec):
+                self.check(codec)
+
+    def test_compression_per_array(self):
+        self.check(['zlib', None, 'zlib', 'zlib', None, None])
+
+    def test_compression_reduces_size(self):
+        send_arrays(self.push, self.arrays[:1], compression='zlib')
+        frames = self.pull.recv_multipart()
+        assert len(frames[1]) < self.arrays[0].nbytes / 2
+
+    def test_views_are_copied(self):
+        buffer_ = numpy.arange(2 * 10 ** 5, dtype='float64')
+        send_arrays(self.push, [buffer_[:10 ** 5]])
+        buffer_[:] = 0
+        received, = recv_arrays(self.pull)
+        assert_equal(received, numpy.arange(10 ** 5, dtype='float64'))
+
+    def test_stop(self):
+        send_arrays(self.push, None, stop=True)
+        assert_raises(StopIteration, recv_arrays, self.pull)
+
+    def test_value_error_on_object_arrays(self):
+        assert_raises(ValueError, send_arrays, self.push,
+                      [numpy.array([None])])
+
+    def test_value_error_on_unknown_codec(self):
+        assert_raises(ValueError, codec_available, 'foo')
+
+    def test_value_error_on_codec_count_mismatch(self):
+        assert_raises(ValueError, send_arrays, self.push, self.arrays,
+                      compression=['zlib', None])
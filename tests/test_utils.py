@@ -10,9 +10,16 @@ from numpy.testing import assert_raises, assert_equal
 from six.moves import range, cPickle
 
 from fuel import config
+from fuel.datasets import IndexableDataset
 from fuel.iterator import DataIterator
+from fuel.schemes import SequentialScheme
+from fuel.streams import DataStream
+from fuel.transformers import Mapping, MultiProcessing, ScaleAndShift
 from fuel.utils import do_not_pickle_attributes, find_in_data_path, Subset
-from fuel.utils.parallel import producer_consumer
+from fuel.utils.parallel import producer_consumer, SharedMemoryRing
+from fuel.utils.profiling import (
+    enable_profiling, disable_profiling, profile_summary, profile_report,
+    log_profile)
 
 
 class TestSubset(object):
@@ -286,3 +293,101 @@ def test_producer_consumer():
     assert (producer_consumer(partial(send_integers, n=2000),
                               receive_integers) ==
             sum(i ** 2 for i in range(2000)))
+
+
+class TestSharedMemoryRing(object):
+    def setUp(self):
+        self.ring = SharedMemoryRing([((3, 4), 'float32'), None], 2)
+
+    def test_round_trip(self):
+        features = numpy.arange(12, dtype='float32').reshape((3, 4))
+        message = self.ring.write((features, [1, 2]))
+        assert message[0] is not None
+        data = self.ring.read(message)
+        assert_equal(data[0], features)
+        assert_equal(data[1], [1, 2])
+
+    def test_smaller_arrays_fit(self):
+        features = numpy.ones((2, 3), dtype='float32')
+        data = self.ring.read(self.ring.write((features, None)))
+        assert_equal(data[0], features)
+
+    def test_mismatched_arrays_are_sent_in_message(self):
+        for features in [numpy.ones((4, 4), dtype='float32'),
+                         numpy.ones((3, 4), dtype='float64'),
+                         numpy.ones(3, dtype='float32')]:
+            slot, items = self.ring.write((features, None))
+            assert slot is None
+            assert items[0][1] is features
+
+    def test_slots_are_recycled(self):
+        features = numpy.zeros((3, 4), dtype='float32')
+        for i in range(5):
+            data = self.ring.read(self.ring.write((features + i, None)))
+            assert_equal(data[0], i)
+
+    def test_value_error_on_wrong_number_of_sources(self):
+        assert_raises(ValueError, self.ring.write, (None,))
+
+    def test_value_error_on_object_dtype(self):
+        assert_raises(ValueError, SharedMemoryRing, [((2,), object)], 2)
+
+
+class TestProfiling(object):
+    def setUp(self):
+        def slow(data):
+            time.sleep(0.01)
+            return data
+
+        self.dataset = DataStream(
+            IndexableDataset(numpy.zeros((10, 5), dtype='float32')),
+            iteration_scheme=SequentialScheme(10, 2))
+        self.stream = ScaleAndShift(Mapping(self.dataset, slow), 2, 1)
+
+    def test_profiling_disabled_by_default(self):
+        list(self.stream.get_epoch_iterator())
+        assert self.stream.profile is None
+        assert_equal(profile_summary(self.stream), [])
+
+    def test_counters(self):
+        enable_profiling(self.stream)
+        list(self.stream.get_epoch_iterator())
+        summary = profile_summary(self.stream)
+        assert_equal([row['stage'] for row in summary],
+                     ['ScaleAndShift', 'Mapping', 'DataStream'])
+        assert_equal([row['depth'] for row in summary], [0, 1, 2])
+        assert all(row['batches'] == 5 for row in summary)
+        assert all(row['bytes'] == 10 * 5 * 4 for row in summary)
+        assert summary[1]['self_time'] >= 0.05
+        assert summary[0]['self_time'] < summary[1]['self_time']
+        assert summary[0]['time'] >= summary[1]['time']
+
+    def test_report(self):
+        enable_profiling(self.stream)
+        list(self.stream.get_epoch_iterator())
+        report = profile_report(self.stream)
+        assert_equal(len(report.splitlines()), 4)
+        assert '    DataStream' in report
+
+    def test_log_profile(self):
+        class Logger(object):
+            def log(self, level, msg, *args):
+                self.message = msg % args
+
+        logger = Logger()
+        enable_profiling(self.stream)
+        list(self.stream.get_epoch_iterator())
+        log_profile(self.stream, logger=logger)
+        assert 'Mapping' in logger.message
+
+    def test_disable_profiling(self):
+        enable_profiling(self.stream)
+        disable_profiling(self.stream)
+        assert self.dataset.profile is None
+
+    def test_multiprocessing_wait_time(self):
+        stream = MultiProcessing(self.stream)
+        enable_profiling(stream)
+        list(stream.get_epoch_iterator())
+        assert stream.profile.wait_time > 0
+        assert_equal(stream.profile.batches, 5)
@@ -4,8 +4,9 @@ import numpy
 from numpy.testing import assert_raises, assert_allclose, assert_equal
 from PIL import Image
 from picklable_itertools.extras import partition_all
-from six.moves import zip
-from fuel.transformers._image import window_batch_bchw3d
+from six.moves import zip, cPickle
+from fuel.transformers._image import (window_batch_bchw, window_batch_bchw3d,
+                                      rotate_batch_bchw, augment_batch_bchw)
 from fuel import config
 from fuel.datasets.base import IndexableDataset, IterableDataset
 from fuel.schemes import ShuffledScheme, SequentialExampleScheme
@@ -16,7 +17,8 @@ from fuel.transformers.image import (ImagesFromBytes, Image2DSlicer,
                                      RandomSpatialFlip, Drop,
                                      SamplewiseCropTransformer,
                                      FixedSizeCrop, FixedSizeCropND,
-                                     Random2DRotation, GammaCorrectionND)
+                                     Random2DRotation, GammaCorrectionND,
+                                     RandomCropFlipRotate)
 
 
 def reorder_axes(shp):
@@ -148,6 +150,46 @@ class TestImagesFromBytes(ImageTestingMixin):
         assert_raises(TypeError, stream.transform_source_example, 54321,
                       'source2')
 
+    def test_images_from_bytes_threads(self):
+        batch = self.dataset.indexables[0]
+        serial = ImagesFromBytes(self.batch_stream)
+        threaded = ImagesFromBytes(self.batch_stream, num_threads=2)
+        for expected, image in zip(
+                serial.transform_source_batch(batch, 'source1'),
+                threaded.transform_source_batch(batch, 'source1')):
+            assert_equal(image, expected)
+        threaded.close()
+        assert threaded.pool is None
+
+    def test_images_from_bytes_stack(self):
+        images = []
+        for _ in range(3):
+            bytes_io = BytesIO()
+            Image.new('RGB', (5, 4)).save(bytes_io, format='PNG')
+            images.append(bytes_io.getvalue())
+        stream = ImagesFromBytes(self.batch_stream, num_threads=2,
+                                 stack=True)
+        output = stream.transform_source_batch(images, 'source1')
+        assert isinstance(output, numpy.ndarray)
+        assert_equal(output.shape, (3, 3, 4, 5))
+
+    def test_images_from_bytes_stack_different_shapes(self):
+        batch = self.dataset.indexables[0]
+        stream = ImagesFromBytes(self.batch_stream, stack=True)
+        output = stream.transform_source_batch(batch, 'source1')
+        assert isinstance(output, list)
+        assert_equal([image.shape for image in output],
+                     [(3, 10, 12), (3, 9, 8), (3, 12, 14)])
+
+    def test_images_from_bytes_picklable(self):
+        stream = ImagesFromBytes(self.batch_stream, num_threads=2)
+        list(stream.get_epoch_iterator())
+        cPickle.loads(cPickle.dumps(stream))
+
+    def test_images_from_bytes_value_error_on_num_threads(self):
+        assert_raises(ValueError, ImagesFromBytes, self.batch_stream,
+                      num_threads=0)
+
 
 class TestMinimumDimensions(ImageTestingMixin):
     def setUp(self):
@@ -465,6 +507,147 @@ class TestRandom2DRotation(ImageTestingMixin):
                                  [0, 50, 51, 57, 58]]], dtype='float32')
         assert_equal(out, expected)
 
+    def test_rotation_kernel_matches_pil(self):
+        rng = numpy.random.RandomState(123)
+        batch = rng.randint(1, 256, size=(8, 3, 13, 17)).astype('uint8')
+        angles = rng.uniform(-180, 180, size=8)
+        out = numpy.empty_like(batch)
+        rotate_batch_bchw(batch, numpy.deg2rad(angles), out)
+        expected = numpy.array([
+            numpy.array(Image.fromarray(image.transpose(1, 2, 0)).rotate(
+                angle, resample=Image.NEAREST)).transpose(2, 0, 1)
+            for image, angle in zip(batch, angles)])
+        assert (out == expected).mean() > 0.99
+
+    def test_rotation_kernel_bilinear(self):
+        batch = numpy.random.RandomState(123).uniform(
+            size=(2, 1, 6, 6)).astype('float32')
+        out = numpy.empty_like(batch)
+        rotate_batch_bchw(batch, numpy.zeros(2), out, True)
+        assert_allclose(out, batch)
+        rotate_batch_bchw(batch, numpy.array([numpy.pi, numpy.pi]), out,
+                          True)
+        assert_allclose(out, batch[:, :, ::-1, ::-1], rtol=1e-5)
+
+    def test_random_2D_rotation_uses_kernel(self):
+        batch = numpy.arange(2 * 3 * 4 * 5, dtype='float64').reshape(
+            (2, 3, 4, 5))
+
+        class HalfTurns(object):
+            def uniform(self, low, high, size):
+                return numpy.array([180., -180.])
+
+        stream = Random2DRotation(self.batch_stream, rng=HalfTurns(),
+                                  which_sources=('source1',))
+        out = stream.transform_source_batch(batch, 'source1')
+        assert_equal(out.dtype, batch.dtype)
+        assert_allclose(out, batch[:, :, ::-1, ::-1])
+
+    def test_random_2D_rotation_read_only(self):
+        batch = numpy.arange(2 * 3 * 4 * 5, dtype='uint8').reshape(
+            (2, 3, 4, 5))
+        batch.setflags(write=False)
+
+        class HalfTurns(object):
+            def uniform(self, low, high, size):
+                return numpy.array([180., -180.])
+
+        stream = Random2DRotation(self.batch_stream, rng=HalfTurns(),
+                                  which_sources=('source1',))
+        assert stream._use_kernel(batch)
+        out = stream.transform_source_batch(batch, 'source1')
+        assert_equal(out, batch[:, :, ::-1, ::-1])
+
+    def test_random_2D_rotation_bicubic_falls_back_to_pil(self):
+        stream = Random2DRotation(self.batch_stream, resample='bicubic',
+                                  which_sources=('source1',))
+        assert not stream._use_kernel(self.source1)
+        out = stream.transform_source_batch(self.source1, 'source1')
+        assert_equal(out.shape, self.source1.shape)
+
+
+class TestRandomCropFlipRotate(object):
+    def setUp(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        self.batch = rng.randint(1, 256, size=(6, 3, 12, 15)).astype('uint8')
+        self.ragged = [rng.uniform(size=(2, 9, 10)),
+                       rng.uniform(size=(2, 11, 8))]
+        axis_labels = {'images': ('batch', 'channel', 'height', 'width')}
+        self.stream = DataStream(
+            IndexableDataset({'images': self.batch}, axis_labels=axis_labels),
+            iteration_scheme=ShuffledScheme(6, 3))
+
+    def test_crop_only_matches_window(self):
+        stream = RandomCropFlipRotate(self.stream, (5, 7),
+                                      rng=numpy.random.RandomState(1))
+        out = stream.transform_source_batch(self.batch, 'images')
+        rng = numpy.random.RandomState(1)
+        offsets_h = (rng.uniform(size=6) * 8).astype(int)
+        offsets_w = (rng.uniform(size=6) * 9).astype(int)
+        expected = numpy.array([
+            image[:, h:h + 5, w:w + 7]
+            for image, h, w in zip(self.batch, offsets_h, offsets_w)])
+        assert_equal(out, expected)
+
+    def test_matches_chained_transformers(self):
+        angles = numpy.random.RandomState(2).uniform(-0.4, 0.4, size=6)
+        flips_h = numpy.array([1, 0, 1, 1, 0, 0], dtype='uint8')
+        flips_v = numpy.array([0, 0, 1, 0, 1, 0], dtype='uint8')
+        offsets_h = numpy.array([0, 1, 2, 3, 4, 5])
+        offsets_w = numpy.array([5, 4, 3, 2, 1, 0])
+        out = numpy.empty((6, 3, 7, 9), dtype='uint8')
+        augment_batch_bchw(self.batch, offsets_h, offsets_w, flips_h,
+                           flips_v, angles, out)
+        windows = numpy.empty_like(out)
+        window_batch_bchw(self.batch, offsets_h, offsets_w, windows)
+        windows = numpy.ascontiguousarray(numpy.array([
+            window[:, ::-1 if v else 1, ::-1 if h else 1]
+            for window, h, v in zip(windows, flips_h, flips_v)]))
+        expected = numpy.empty_like(out)
+        rotate_batch_bchw(windows, angles, expected)
+        assert_equal(out, expected)
+
+    def test_ragged_batches(self):
+        stream = RandomCropFlipRotate(self.stream, (8, 8), flip_h=True,
+                                      maximum_rotation=0.3,
+                                      resample='bilinear')
+        out = stream.transform_source_batch(self.ragged, 'images')
+        assert isinstance(out, list)
+        assert_equal([image.shape for image in out], [(2, 8, 8)] * 2)
+
+    def test_reproducible(self):
+        outputs = []
+        for _ in range(2):
+            stream = RandomCropFlipRotate(
+                self.stream, (6, 6), flip_h=True, flip_v=True,
+                maximum_rotation=0.5, rng=numpy.random.RandomState(3))
+            outputs.append(stream.transform_source_batch(self.batch,
+                                                         'images'))
+        assert_equal(outputs[0], outputs[1])
+
+    def test_read_only_batch(self):
+        batch = self.batch.copy()
+        batch.setflags(write=False)
+        outputs = []
+        for source in (self.batch, batch):
+            stream = RandomCropFlipRotate(
+                self.stream, (6, 6), flip_h=True, maximum_rotation=0.5,
+                rng=numpy.random.RandomState(3))
+            outputs.append(stream.transform_source_batch(source, 'images'))
+        assert_equal(outputs[0], outputs[1])
+
+    def test_value_errors(self):
+        assert_raises(ValueError, RandomCropFlipRotate, self.stream, (6, 6),
+                      maximum_rotation=4)
+        assert_raises(ValueError, RandomCropFlipRotate, self.stream, (6, 6),
+                      resample='bicubic')
+        stream = RandomCropFlipRotate(self.stream, (13, 6))
+        assert_raises(ValueError, stream.transform_source_batch, self.batch,
+                      'images')
+        stream = RandomCropFlipRotate(self.stream, (6, 6))
+        assert_raises(ValueError, stream.transform_source_batch,
+                      self.batch.astype('int32'), 'images')
+
 
 class TestRandomSpatialFlip(ImageTestingMixin):
 
@@ -1,10 +1,11 @@
 import logging
 import operator
+import os
 import warnings
 from collections import OrderedDict
 
 import numpy
-from numpy.testing import assert_raises, assert_equal
+from numpy.testing import assert_raises, assert_equal, assert_allclose
 from six.moves import zip, cPickle
 from picklable_itertools import izip
 
@@ -17,7 +18,8 @@ from fuel.transformers import (
     ExpectsAxisLabels, Transformer, Mapping, SortMapping, ForceFloatX, Filter,
     Cache, Batch, Padding, MultiProcessing, Unpack, Merge,
     SourcewiseTransformer, Flatten, ScaleAndShift, Cast, Rename,
-    FilterSources, OneHotEncoding, Duplicate)
+    FilterSources, OneHotEncoding, OneHotEncodingND, Duplicate,
+    FusedElementwise, fuse_elementwise)
 from fuel.transformers.defaults import ToBytes
 
 
@@ -283,6 +285,72 @@ class TestForceFloatX(object):
         assert_equal(transformer.axis_labels, stream.axis_labels)
 
 
+class TestFusedElementwise(object):
+    def setUp(self):
+        self.features = numpy.arange(24, dtype='uint8').reshape((4, 2, 3))
+        self.targets = numpy.arange(4)
+        self.stream = DataStream(
+            IndexableDataset(OrderedDict([('features', self.features),
+                                          ('targets', self.targets)])),
+            iteration_scheme=SequentialScheme(4, 2))
+
+    def build(self, stream):
+        stream = ScaleAndShift(stream, 1 / 255., -0.5,
+                               which_sources=('features',))
+        stream = Cast(stream, 'float32', which_sources=('features',))
+        stream = ForceFloatX(stream)
+        return Flatten(stream, which_sources=('features',))
+
+    def test_fused_matches_unfused(self):
+        fused = fuse_elementwise(self.build(self.stream))
+        assert isinstance(fused, FusedElementwise)
+        assert fused.data_stream is self.stream
+        unfused = self.build(self.stream)
+        for (features, targets), (expected_features, expected_targets) in \
+                zip(fused.get_epoch_iterator(),
+                    unfused.get_epoch_iterator()):
+            assert_equal(features.shape, expected_features.shape)
+            assert_equal(features.dtype, expected_features.dtype)
+            assert_allclose(features, expected_features, rtol=1e-6)
+            assert_equal(targets, expected_targets)
+
+    def test_fused_examples(self):
+        stream = DataStream(
+            IndexableDataset(OrderedDict([('features', self.features),
+                                          ('targets', self.targets)])),
+            iteration_scheme=SequentialExampleScheme(4))
+        fused = fuse_elementwise(self.build(stream))
+        features, targets = next(fused.get_epoch_iterator())
+        assert_equal(features.shape, (6,))
+        assert_allclose(features, self.features[0].flatten() / 255. - 0.5,
+                        rtol=1e-6)
+
+    def test_does_not_modify_input(self):
+        features = numpy.ones((4, 3), dtype='float32')
+        stream = DataStream(IndexableDataset({'features': features}),
+                            iteration_scheme=SequentialScheme(4, 4))
+        fused = fuse_elementwise(
+            ScaleAndShift(ForceFloatX(stream), 2, 1))
+        batch, = next(fused.get_epoch_iterator())
+        assert_equal(batch, 3 * numpy.ones((4, 3)))
+        assert_equal(features, numpy.ones((4, 3)))
+
+    def test_fuses_below_other_transformers(self):
+        mapped = Mapping(ForceFloatX(Cast(self.stream, 'float64')),
+                         lambda data: data)
+        assert fuse_elementwise(mapped) is mapped
+        assert isinstance(mapped.data_stream, FusedElementwise)
+        assert mapped.data_stream.data_stream is self.stream
+
+    def test_single_transformer_not_fused(self):
+        stream = Cast(self.stream, 'float32')
+        assert fuse_elementwise(stream) is stream
+
+    def test_value_error_on_unfusable_transformer(self):
+        assert_raises(ValueError, FusedElementwise, self.stream,
+                      [Mapping(self.stream, lambda data: data)])
+
+
 class TestFilter(object):
     def test_filter_examples(self):
         data = [1, 2, 3]
@@ -346,6 +414,30 @@ class TestCache(object):
                 assert_equal(list(range(100))[i * 7:(i + 1) * 7], features)
             assert_equal(i, 2)
 
+    def test_batches_spanning_several_chunks(self):
+        stream = Batch(DataStream(IterableDataset(range(20))),
+                       ConstantScheme(3))
+        cached_stream = Cache(stream, ConstantScheme(8))
+        data = [features for features, in cached_stream.get_epoch_iterator()]
+        assert_equal(data, [numpy.arange(8), numpy.arange(8, 16),
+                            numpy.arange(16, 20)])
+        assert not cached_stream.cache[0]
+
+    def test_cache_survives_reused_chunks(self):
+        class ReusingStream(DataStream):
+            def get_data(self, request=None):
+                data = super(ReusingStream, self).get_data(request)
+                self.buffer = getattr(self, 'buffer', numpy.empty(4, 'int64'))
+                self.buffer[:len(data[0])] = data[0]
+                return (self.buffer[:len(data[0])],)
+
+        stream = ReusingStream(IndexableDataset(numpy.arange(12)),
+                               iteration_scheme=SequentialScheme(12, 4))
+        cached_stream = Cache(stream, ConstantScheme(3))
+        data = [features.copy()
+                for features, in cached_stream.get_epoch_iterator()]
+        assert_equal(data, [numpy.arange(i, i + 3) for i in range(0, 12, 3)])
+
     def test_value_error_on_non_batchsizescheme(self):
         assert_raises(ValueError, Cache, self.stream, SequentialScheme(4, 2))
 
@@ -386,6 +478,44 @@ class TestBatch(object):
         transformer = Batch(stream, ConstantScheme(2), strictness=2)
         assert_raises(ValueError, list, transformer.get_epoch_iterator())
 
+    def test_preallocated_arrays(self):
+        features = numpy.arange(30, dtype='float32').reshape((10, 3))
+        stream = DataStream(IndexableDataset(
+            OrderedDict([('features', features),
+                         ('targets', numpy.arange(10))])),
+            iteration_scheme=SequentialExampleScheme(10))
+        transformer = Batch(stream, ConstantScheme(4))
+        batches = list(transformer.get_epoch_iterator())
+        assert_equal([batch[0] for batch in batches],
+                     [features[:4], features[4:8], features[8:]])
+        assert_equal([batch[1] for batch in batches],
+                     [numpy.arange(4), numpy.arange(4, 8),
+                      numpy.arange(8, 10)])
+        assert all(batch[0].dtype == numpy.float32 for batch in batches)
+
+    def test_fallback_on_shape_mismatch(self):
+        examples = [numpy.ones(2), numpy.ones(2), numpy.ones(3)]
+        stream = DataStream(IterableDataset(examples))
+        batch, = next(Batch(stream, ConstantScheme(3)).get_epoch_iterator())
+        assert_equal(batch.shape, (3,))
+        assert_equal(batch.dtype, numpy.dtype(object))
+        assert_equal(batch[2], numpy.ones(3))
+
+    def test_fallback_on_dtype_mismatch(self):
+        examples = [numpy.int64(1), numpy.float64(2.5)]
+        stream = DataStream(IterableDataset(examples))
+        batch, = next(Batch(stream, ConstantScheme(2)).get_epoch_iterator())
+        assert_equal(batch, numpy.array([1, 2.5]))
+
+    def test_zero_size_request(self):
+        stream = DataStream(IterableDataset(
+            OrderedDict([('features', [1, 2]), ('targets', [3, 4])])))
+        transformer = Batch(stream, ConstantScheme(2))
+        transformer.get_epoch_iterator()
+        features, targets = transformer.get_data(0)
+        assert_equal(features.shape, (0,))
+        assert_equal(targets.shape, (0,))
+
     def test_value_error_on_request_none(self):
         stream = DataStream(IterableDataset([1, 2, 3, 4, 5]))
         transformer = Batch(stream, ConstantScheme(2))
@@ -432,6 +562,48 @@ class TestUnpack(object):
         epoch = wrapper.get_epoch_iterator()
         cPickle.dumps(epoch)
 
+    def test_unpack_multiple_sources(self):
+        dataset = IndexableDataset(
+            OrderedDict([('features', numpy.arange(10).reshape((5, 2))),
+                         ('targets', numpy.arange(5))]))
+        stream = Batch(
+            DataStream(dataset, iteration_scheme=SequentialExampleScheme(5)),
+            iteration_scheme=ConstantScheme(2))
+        examples = list(Unpack(stream).get_epoch_iterator())
+        assert_equal(len(examples), 5)
+        assert_equal(examples[3][0], [6, 7])
+        assert_equal(examples[3][1], 3)
+
+    def test_rebatch(self):
+        wrapper = Batch(Unpack(self.stream_np), ConstantScheme(3))
+        assert_equal(list(wrapper.get_epoch_iterator()),
+                     [(numpy.array([0, 1, 2]),), (numpy.array([3, 4, 5]),),
+                      (numpy.array([6, 7, 8]),), (numpy.array([9]),)])
+
+    def test_rebatch_strictness(self):
+        wrapper = Batch(Unpack(self.stream_np), ConstantScheme(3),
+                        strictness=1)
+        assert_equal(len(list(wrapper.get_epoch_iterator())), 3)
+        wrapper = Batch(Unpack(self.stream_np), ConstantScheme(3),
+                        strictness=2)
+        assert_raises(ValueError, list, wrapper.get_epoch_iterator())
+
+    def test_rebatch_copies_data(self):
+        unpacked = Unpack(self.stream_np)
+        wrapper = Batch(unpacked, ConstantScheme(2))
+        batch, = next(wrapper.get_epoch_iterator())
+        batch[:] = -1
+        assert_equal(unpacked.data[0], [0, 1])
+
+    def test_rebatch_ragged_batches(self):
+        stream = Batch(
+            DataStream(IterableDataset([[1], [2], [3, 4], [5, 6]])),
+            iteration_scheme=ConstantScheme(2))
+        wrapper = Batch(Unpack(Padding(stream)), ConstantScheme(3))
+        (features, mask), = list(wrapper.get_epoch_iterator())[:1]
+        assert_equal(features.dtype, numpy.dtype(object))
+        assert_equal(list(features[2]), [3, 4])
+
     def test_value_error_on_example_stream(self):
         stream = DataStream(
             IterableDataset(
@@ -525,6 +697,37 @@ class TestPadding(object):
                 dict(features=[[1], [2, 3]], targets=[[4, 5, 6], [7]])))
         assert_raises(ValueError, Padding, stream)
 
+    def test_length_multiple(self):
+        stream = Batch(
+            DataStream(IterableDataset([[1], [2, 3, 4], [5, 6, 7, 8, 9]])),
+            ConstantScheme(2))
+        transformer = Padding(stream, length_multiple=4)
+        assert_equal(list(transformer.get_epoch_iterator()),
+                     [(numpy.array([[1, 0, 0, 0], [2, 3, 4, 0]]),
+                       numpy.array([[1, 0, 0, 0], [1, 1, 1, 0]])),
+                      (numpy.array([[5, 6, 7, 8, 9, 0, 0, 0]]),
+                       numpy.array([[1, 1, 1, 1, 1, 0, 0, 0]]))])
+
+    def test_reuse_buffers(self):
+        stream = Batch(
+            DataStream(IterableDataset(
+                [numpy.ones((3, 2)), 2 * numpy.ones((1, 2)),
+                 3 * numpy.ones((2, 2)), 4 * numpy.ones((1, 2)),
+                 5 * numpy.ones((1, 2))])),
+            ConstantScheme(2))
+        expected = [(data.copy(), mask.copy()) for data, mask
+                    in Padding(stream).get_epoch_iterator()]
+        transformer = Padding(stream, reuse_buffers=True)
+        batches = [(data.copy(), mask.copy()) for data, mask
+                   in transformer.get_epoch_iterator()]
+        assert_equal(batches, expected)
+        assert all(batch[0].flags.c_contiguous for batch in batches)
+        assert not cPickle.loads(cPickle.dumps(transformer))._buffers
+
+    def test_value_error_on_length_multiple(self):
+        stream = Batch(DataStream(IterableDataset([[1]])), ConstantScheme(2))
+        assert_raises(ValueError, Padding, stream, length_multiple=0)
+
 
 class TestMerge(object):
     def setUp(self):
@@ -637,6 +840,112 @@ class TestMultiprocessing(object):
         assert_equal(background.axis_labels, self.transformer.axis_labels)
 
 
+class TestMultiprocessingWorkers(object):
+    def setUp(self):
+        stream = DataStream(
+            IndexableDataset(numpy.arange(100)),
+            iteration_scheme=SequentialScheme(100, 7))
+        self.transformer = Mapping(stream, lambda x: (x[0] + 1,))
+
+    def test_ordered(self):
+        background = MultiProcessing(self.transformer, num_workers=3)
+        try:
+            for _ in range(2):
+                batches = list(background.get_epoch_iterator())
+                assert_equal(len(batches), 15)
+                assert_equal(numpy.concatenate([b[0] for b in batches]),
+                             numpy.arange(1, 101))
+        finally:
+            background.close()
+
+    def test_unordered(self):
+        background = MultiProcessing(self.transformer, max_store=4,
+                                     num_workers=2, ordered=False)
+        try:
+            batches = list(background.get_epoch_iterator())
+            assert_equal(
+                numpy.sort(numpy.concatenate([b[0] for b in batches])),
+                numpy.arange(1, 101))
+        finally:
+            background.close()
+
+    def test_error_in_worker(self):
+        def fail(data):
+            if 50 in data[0]:
+                raise KeyError
+            return data
+        background = MultiProcessing(Mapping(self.transformer, fail),
+                                     num_workers=2)
+        try:
+            iterator = background.get_epoch_iterator()
+            assert_raises(RuntimeError, list, iterator)
+        finally:
+            background.close()
+
+    def test_dead_worker(self):
+        def die(data):
+            if 50 in data[0]:
+                os._exit(1)
+            return data
+        background = MultiProcessing(Mapping(self.transformer, die),
+                                     num_workers=2)
+        try:
+            iterator = background.get_epoch_iterator()
+            assert_raises(RuntimeError, list, iterator)
+        finally:
+            background.close()
+
+    def test_value_error_on_scheme_in_chain(self):
+        stream = Batch(DataStream(IterableDataset(range(10))),
+                       ConstantScheme(2))
+        assert_raises(ValueError, MultiProcessing, stream, num_workers=2)
+
+    def test_value_error_without_scheme(self):
+        stream = DataStream(IterableDataset(range(10)))
+        assert_raises(ValueError, MultiProcessing, stream, num_workers=2)
+
+    def test_value_error_on_num_workers(self):
+        assert_raises(ValueError, MultiProcessing, self.transformer,
+                      num_workers=0)
+
+
+class TestMultiprocessingSharedMemory(object):
+    def setUp(self):
+        features = numpy.arange(300, dtype='float32').reshape((100, 3))
+        stream = DataStream(
+            IndexableDataset(OrderedDict([('features', features),
+                                          ('targets', numpy.arange(100))])),
+            iteration_scheme=SequentialScheme(100, 7))
+        self.transformer = Mapping(stream, lambda x: (x[0] + 1, x[1]))
+        self.shared_memory = {'features': ((7, 3), 'float32')}
+
+    def check(self, background):
+        try:
+            for _ in range(2):
+                features, targets = [], []
+                for batch in background.get_epoch_iterator():
+                    features.append(batch[0].copy())
+                    targets.append(batch[1])
+                assert_equal(numpy.vstack(features),
+                             numpy.arange(1, 301).reshape((100, 3)))
+                assert_equal(numpy.concatenate(targets), numpy.arange(100))
+        finally:
+            background.close()
+
+    def test_single_process(self):
+        self.check(MultiProcessing(self.transformer, max_store=3,
+                                   shared_memory=self.shared_memory))
+
+    def test_workers(self):
+        self.check(MultiProcessing(self.transformer, max_store=3,
+                                   num_workers=2,
+                                   shared_memory=self.shared_memory))
+
+    def test_value_error_on_unknown_source(self):
+        assert_raises(ValueError, MultiProcessing, self.transformer,
+                      shared_memory={'foo': ((1,), 'float32')})
+
+
 class TestRename(object):
     def setUp(self):
         self.stream = DataStream(
@@ -808,6 +1117,101 @@ class TestOneHotEncoding(object):
             which_sources=('targets',))
         assert_raises(ValueError, list, wrapper.get_epoch_iterator())
 
+    def test_one_hot_batches_negative_input(self):
+        self.data['targets'] = numpy.array([[0], [-1], [2], [3]])
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 2)),
+            num_classes=4,
+            which_sources=('targets',))
+        assert_raises(ValueError, list, wrapper.get_epoch_iterator())
+
+    def test_one_hot_negative_input_beyond_unsigned_range(self):
+        # -1 would be 255 when viewed as unsigned, which is a valid class
+        self.data['targets'] = numpy.array([[0], [-1], [2], [3]],
+                                           dtype='int8')
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 2)),
+            num_classes=300,
+            which_sources=('targets',))
+        assert_raises(ValueError, list, wrapper.get_epoch_iterator())
+
+    def test_one_hot_float_targets(self):
+        self.data['targets'] = numpy.array([2., 0., 1., 3.])
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 4)),
+            num_classes=4,
+            which_sources=('targets',))
+        _, targets = next(wrapper.get_epoch_iterator())
+        assert_equal(targets, numpy.eye(4)[[2, 0, 1, 3]])
+        self.data['targets'] = numpy.array([2., 0.5, 1., 3.])
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 4)),
+            num_classes=4,
+            which_sources=('targets',))
+        assert_raises(ValueError, list, wrapper.get_epoch_iterator())
+
+    def test_one_hot_sparse_output(self):
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 4)),
+            num_classes=5, output_format='sparse',
+            which_sources=('targets',))
+        _, targets = next(wrapper.get_epoch_iterator())
+        assert_equal(targets.shape, (4, 5))
+        assert_equal(targets.toarray(), numpy.eye(5)[:4])
+
+    def test_one_hot_indices_output(self):
+        wrapper = OneHotEncoding(
+            DataStream(IndexableDataset(self.data),
+                       iteration_scheme=SequentialScheme(4, 4)),
+            num_classes=4, output_format='indices',
+            which_sources=('targets',))
+        _, targets = next(wrapper.get_epoch_iterator())
+        assert_equal(targets, self.data['targets'])
+
+    def test_value_error_on_output_format(self):
+        stream = DataStream(IndexableDataset(self.data),
+                            iteration_scheme=SequentialScheme(4, 4))
+        assert_raises(ValueError, OneHotEncoding, stream, 4,
+                      output_format='csr')
+        assert_raises(ValueError, OneHotEncodingND, stream, 4,
+                      output_format='sparse')
+
+
+class TestOneHotEncodingND(object):
+    def setUp(self):
+        self.targets = numpy.array([[[0, 1], [2, 0]], [[1, 1], [0, 2]]])
+        self.expected = numpy.stack(
+            [numpy.eye(3, dtype=int)[labels].transpose((2, 0, 1))
+             for labels in self.targets])
+
+    def test_one_hot_nd_batches(self):
+        wrapper = OneHotEncodingND(
+            DataStream(IndexableDataset(self.targets[:, None]),
+                       iteration_scheme=SequentialScheme(2, 2)),
+            num_classes=3)
+        targets, = next(wrapper.get_epoch_iterator())
+        assert_equal(targets, self.expected)
+
+    def test_one_hot_nd_examples(self):
+        wrapper = OneHotEncodingND(
+            DataStream(IndexableDataset(self.targets[:, None]),
+                       iteration_scheme=SequentialExampleScheme(2)),
+            num_classes=3)
+        assert_equal([targets for targets, in wrapper.get_epoch_iterator()],
+                     list(self.expected))
+
+    def test_one_hot_nd_invalid_input(self):
+        wrapper = OneHotEncodingND(
+            DataStream(IndexableDataset(self.targets[:, None]),
+                       iteration_scheme=SequentialScheme(2, 2)),
+            num_classes=2)
+        assert_raises(ValueError, list, wrapper.get_epoch_iterator())
+
 
 class VerifyWarningHandler(logging.Handler):
     def __init__(self, *args, **kwargs):